@@ -241,7 +241,7 @@ def setup_param(slf, sc, det, fitsdict):
         else:
             msgs.error('Not ready for this disperser {:s}!'.format(disperser))
     elif sname=='keck_lris_red':
-        arcparam['wv_cen'] = fitsdict['headers'][idx[0]][0]['WAVELEN']
+        arcparam['wv_cen'] = float(fitsdict['wavelen'][idx[0]])
         lamps = ['ArI','NeI','HgI','KrI','XeI']  # Should set according to the lamps that were on
         if disperser == '600/7500':
             arcparam['n_first']=3 # Too much curvature for 1st order
@@ -1,16 +1,29 @@
 from __future__ import (print_function, absolute_import, division, unicode_literals)
 
+from functools import partial
 import numpy as np
 from pypit import armsgs
+from pypit import arutils
 from pypit import arparse as settings
 
 # Logging
 msgs = armsgs.get_logger()
 
 
-def comb_frames(frames_arr, det, frametype, weights=None, maskvalue=1048577, printtype=None):
+def comb_frames(frames_arr, det, frametype, weights=None, maskvalue=1048577, printtype=None, exptime=None):
     """ Combine several frames
 
+    The frames are combined in blocks of rows (see comb_rows), so that
+    the memory used by the temporary arrays of the rejection steps is
+    set by settings.argflag['run']['framecube']['blocksize'], rather
+    than the size of the full stack. Each pixel is combined independently
+    of all other pixels, so the result does not depend on the block size.
+    When more than one CPU is available (settings.argflag['run']['ncpus']),
+    the blocks are combined with a pool of workers.
+
+    If the frames are weighted (see frame_weights), the weights are
+    used by the mean and weightmean combination methods.
+
     Parameters
     ----------
     frames_arr : ndarray (3D)
@@ -19,17 +32,20 @@ def comb_frames(frames_arr, det, frametype, weights=None, maskvalue=1048577, pri
       Detector index
     frametype : str
       What is the type of frame being combining? (only used for screen printout)
-    weights : str, or None (optional)
-      How should the frame combination by weighted (not currently implemented)
+    weights : ndarray, or None (optional)
+      Weight of each frame. If None, the weights are set by
+      settings.argflag[frametype]['combine']['weights'] (see frame_weights)
     maskvalue : int (optional)
       What should the masked values be set to (should be greater than the detector's saturation value -- Default = 1 + 2**20)
     printtype : str (optional)
       The frame type string that should be printed by armsgs. If None, frametype will be used
+    exptime : ndarray, or None (optional)
+      Exposure time of each frame (only used to weight the frames by exposure time)
     """
-    from pypit import arcycomb
     dnum = settings.get_dnum(det)
     reject = settings.argflag[frametype]['combine']['reject']
     method = settings.argflag[frametype]['combine']['method']
+    satpix = settings.argflag[frametype]['combine']['satpix']
     ###########
     # FIRST DO SOME CHECKS ON THE INPUT
     ###########
@@ -56,6 +72,116 @@ def comb_frames(frames_arr, det, frametype, weights=None, maskvalue=1048577, pri
     # Check that some information on the frames was supplied
     if settings.spect is None:
         msgs.error("When combining the {0:s} frames, spectrograph information".format(printtype)+msgs.newline()+"was not provided")
+    # Check the values to be used if all frames are rejected in some pixels
+    if reject['replace'] not in ['min', 'max', 'mean', 'median', 'weightmean', 'maxnonsat']:
+        msgs.error("You must specify what to do in case all pixels are rejected")
+    # Weight of each frame
+    if weights is None:
+        weights = frame_weights(frames_arr, frametype, exptime=exptime)
+    elif np.size(weights) != num_frames:
+        msgs.error("There must be one weight for each of the {0:d} {1:s} frames".format(num_frames, printtype))
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64)
+        if np.any(weights < 0.0) or np.sum(weights) <= 0.0:
+            msgs.error("The weights of the {0:s} frames must be non-negative, and not all zero".format(printtype))
+    # Check the treatment of saturated pixels
+    msgs.info("Finding saturated and non-linear pixels")
+    if satpix not in ['force', 'reject', 'nothing']:
+        msgs.error("Option '{0:s}' for dealing with saturated pixels was not recognised".format(satpix))
+    # Check the rejection steps
+    if reject['cosmics'] > 0.0:
+        msgs.info("Rejecting cosmic rays")
+    else:
+        msgs.info("Not rejecting cosmic rays")
+    if reject['lowhigh'][0] > 0 or reject['lowhigh'][1] > 0:
+        if reject['lowhigh'][0] > 0:
+            msgs.info("Rejecting {0:d} deviant low pixels".format(reject['lowhigh'][0]))
+        if reject['lowhigh'][1] > 0:
+            msgs.info("Rejecting {0:d} deviant high pixels".format(reject['lowhigh'][1]))
+    else:
+        msgs.info("Not rejecting any low/high pixels")
+    if reject['level'][0] > 0.0 or reject['level'][1] > 0.0:
+        msgs.info("Rejecting deviant pixels")
+    else:
+        msgs.info("Not rejecting deviant pixels")
+    if reject['cosmics'] > 0.0 or reject['level'][0] > 0.0 or reject['level'][1] > 0.0:
+        msgs.info("Sigma clipping about the {0:s} with at most {1:d} iteration(s)".format(
+            reject['statistic'], reject['niter']))
+    # Check the combination method
+    if method not in ['mean', 'median', 'weightmean']:
+        msgs.error("Combination type '{0:s}' is unknown".format(method))
+    if weights is not None:
+        if method == 'median':
+            msgs.warn("The frame weights are not used when frames are combined with a median")
+        else:
+            msgs.info("Weighting the frames by: " + ", ".join(["{0:.3g}".format(w) for w in weights]))
+    msgs.info("Combining frames with a {0:s} operation".format(method))
+    msgs.info("Replacing completely masked pixels with the {0:s} value of the input frames".format(reject['replace']))
+    ##############
+    # Split the frames into blocks of rows
+    blocksize = settings.argflag['run']['framecube']['blocksize']
+    if blocksize is None:
+        nrows = sz_x
+    else:
+        # Number of rows in a double precision block of (at most) blocksize MB
+        nrows = int(max(1, min(sz_x, blocksize*1024.0**2/(8.0*sz_y*num_frames))))
+    blocks = [(x0, min(x0+nrows, sz_x)) for x0 in range(0, sz_x, nrows)]
+    combine = partial(comb_rows, reject=reject, method=method, satpix=satpix,
+                      satlevel=settings.spect[dnum]['saturation']*settings.spect[dnum]['nonlinear'],
+                      saturation=settings.spect[dnum]['saturation'], weights=weights, maskvalue=maskvalue)
+    # Combine the blocks
+    comb_arr = np.zeros((sz_x, sz_y), dtype=np.float)
+    ncpus = settings.get_ncpus(len(blocks))
+    if ncpus > 1:
+        msgs.info("Combining {0:d} blocks of {1:d} rows with {2:d} CPUs".format(len(blocks), nrows, ncpus))
+    elif len(blocks) > 1:
+        msgs.info("Combining {0:d} blocks of {1:d} rows".format(len(blocks), nrows))
+    rows = (np.asarray(frames_arr[x0:x1]) for x0, x1 in blocks)
+    for (x0, x1), comb_rows_arr in zip(blocks, arutils.mp_imap(combine, rows, ncpus,
+                                                               pool=settings.argflag['run']['pool'])):
+        comb_arr[x0:x1] = comb_rows_arr
+    if satpix == 'force':
+        msgs.info("Applied saturated pixels to final combined image")
+    ##############
+    # And return a 2D numpy array
+    msgs.info("{0:d} {1:s} frames combined successfully!".format(num_frames, printtype))
+    return comb_arr
+
+
+def comb_rows(frames_arr, reject, method, satpix, satlevel, saturation, weights=None, maskvalue=1048577):
+    """ Combine a block of rows of several frames
+
+    This function is called by comb_frames for each block of rows.
+    The input settings are checked by comb_frames.
+
+    Parameters
+    ----------
+    frames_arr : ndarray (3D)
+      Block of rows of the frames to be combined (the input may be modified)
+    reject : dict
+      Rejection settings (i.e. settings.argflag[frametype]['combine']['reject'])
+    method : str
+      Combination method (mean, median, weightmean)
+    satpix : str
+      What to do with saturated pixels (reject, force, nothing)
+    satlevel : float
+      Level above which a pixel is considered saturated or non-linear
+    saturation : float
+      Saturation level of the detector
+    weights : ndarray, or None (optional)
+      Weight of each frame. If None, all frames are given equal weight
+    maskvalue : int (optional)
+      What should the masked values be set to (should be greater than the detector's saturation value -- Default = 1 + 2**20)
+
+    Returns
+    -------
+    frames_arr : ndarray (2D)
+      The combined block of rows
+    """
+    from pypit import arcycomb
+    # The combination routines require double precision frames
+    if frames_arr.dtype != np.float64:
+        frames_arr = frames_arr.astype(np.float64)
     # Calculate the values to be used if all frames are rejected in some pixels
     if reject['replace'] == 'min':
         allrej_arr = arcycomb.minmax(frames_arr, 0)
@@ -64,111 +190,152 @@ def comb_frames(frames_arr, det, frametype, weights=None, maskvalue=1048577, pri
     elif reject['replace'] == 'mean':
         allrej_arr = arcycomb.mean(frames_arr)
     elif reject['replace'] == 'median':
-        allrej_arr = arcycomb.median(frames_arr)
+        if weights is None:
+            allrej_arr = arcycomb.median(frames_arr)
+        else:
+            # arcycomb.median sorts the input, which would mix up the weights
+            allrej_arr = arcycomb.median(frames_arr.copy())
     elif reject['replace'] == 'weightmean':
-        msgs.work("No weights are implemented yet")
         allrej_arr = arcycomb.masked_weightmean(frames_arr, maskvalue)
     elif reject['replace'] == 'maxnonsat':
-        allrej_arr = arcycomb.maxnonsat(frames_arr, settings.spect[dnum]['saturation']*settings.spect[dnum]['nonlinear'])
-    else:
-        msgs.error("You must specify what to do in case all pixels are rejected")
+        allrej_arr = arcycomb.maxnonsat(frames_arr, satlevel)
     ################
     # Saturated Pixels
-    msgs.info("Finding saturated and non-linear pixels")
-    if settings.argflag[frametype]['combine']['satpix'] == 'force':
+    if satpix == 'force':
         # If a saturated pixel is in one of the frames, force them to all have saturated pixels
 #		satw = np.zeros_like(frames_arr)
 #		satw[np.where(frames_arr > settings.spect['det']['saturation']*settings.spect['det']['nonlinear'])] = 1.0
 #		satw = np.any(satw,axis=2)
-        setsat = arcycomb.masked_limitget(frames_arr, settings.spect[dnum]['saturation']*settings.spect[dnum]['nonlinear'], 2)
+        setsat = arcycomb.masked_limitget(frames_arr, satlevel, 2)
 #		del satw
-    elif settings.argflag[frametype]['combine']['satpix'] == 'reject':
+    elif satpix == 'reject':
         # Ignore saturated pixels in frames if possible
-        frames_arr = arcycomb.masked_limitset(frames_arr, settings.spect[dnum]['saturation']*settings.spect[dnum]['nonlinear'], 2, maskvalue)
-    elif settings.argflag[frametype]['combine']['satpix'] == 'nothing':
+        frames_arr = arcycomb.masked_limitset(frames_arr, satlevel, 2, maskvalue)
+    elif satpix == 'nothing':
         # Don't do anything special for saturated pixels (Hopefully the user has specified how to deal with them below!)
         pass
-    else:
-        msgs.error("Option '{0:s}' for dealing with saturated pixels was not recognised".format(settings.argflag[frametype]['combine']['satpix']))
     # Delete unecessary arrays
     # None!
     ################
     # Cosmic Rays
+    usemedian = int(reject['statistic'] == 'median')
     if reject['cosmics'] > 0.0:
-        msgs.info("Rejecting cosmic rays")  # Use a robust statistic
-        medarr = arcycomb.masked_median(frames_arr, maskvalue)
-        stdarr = 1.4826*arcycomb.masked_median(np.abs(frames_arr-medarr[:, :, np.newaxis]), maskvalue)
-        frames_arr = arcycomb.masked_limitsetarr(frames_arr, (medarr + reject['cosmics']*stdarr), 2, maskvalue)
-        # Delete unecessary arrays
-        del medarr, stdarr
-    else:
-        msgs.info("Not rejecting cosmic rays")
+        frames_arr = arcycomb.masked_sigclip(frames_arr, -1.0, reject['cosmics'], reject['niter'],
+                                             usemedian, maskvalue)
     ################
     # Low and High pixel rejection --- Masks *additional* pixels
-    rejlo, rejhi = reject['lowhigh']
+    # (the frames are not reordered, so that they can be weighted afterwards)
     if reject['lowhigh'][0] > 0 or reject['lowhigh'][1] > 0:
-        # First reject low pixels
-        frames_arr = np.sort(frames_arr, axis=2)
-        if reject['lowhigh'][0] > 0:
-            msgs.info("Rejecting {0:d} deviant low pixels".format(reject['lowhigh'][0]))
-            while rejlo > 0:
-                xi, yi = np.indices(sz_x, sz_y)
-                frames_arr[xi, yi, np.argmin(frames_arr, axis=2)] = maskvalue
-                del xi, yi
-                rejlo -= 1
-        # Now reject high pixels
-        if reject['lowhigh'][1] > 0:
-            msgs.info("Rejecting {0:d} deviant high pixels".format(reject['lowhigh'][1]))
-            frames_arr[np.where(frames_arr == maskvalue)] *= -1
-            while rejhi > 0:
-                xi, yi = np.indices(sz_x, sz_y)
-                frames_arr[xi, yi, np.argmax(frames_arr, axis=2)] = -maskvalue
-                del xi, yi
-                rejhi -= 1
-            frames_arr[np.where(frames_arr) == -maskvalue] *= -1
-# The following is an example of *not* masking additional pixels
-#		if reject['lowhigh'][1] > 0:
-#			msgs.info("Rejecting {0:d} deviant high pixels".format(reject['lowhigh'][1]))
-#			masktemp[:,:,-reject['lowhigh'][0]:] = True
-    else:
-        msgs.info("Not rejecting any low/high pixels")
+        frames_arr = arcycomb.masked_lowhigh(frames_arr, reject['lowhigh'][0], reject['lowhigh'][1], maskvalue)
     ################
     # Deviant Pixels
     if reject['level'][0] > 0.0 or reject['level'][1] > 0.0:
-        msgs.info("Rejecting deviant pixels")  # Use a robust statistic
-        medarr = arcycomb.masked_median(frames_arr, maskvalue)
-        stdarr = 1.4826*arcycomb.masked_median(np.abs(frames_arr-medarr[:, :, np.newaxis]), maskvalue)
-        frames_arr = arcycomb.masked_limitsetarr(frames_arr, (medarr - reject['level'][0]*stdarr), -2, maskvalue)
-        frames_arr = arcycomb.masked_limitsetarr(frames_arr, (medarr + reject['level'][1]*stdarr), 2, maskvalue)
-        # Delete unecessary arrays
-        del medarr, stdarr
-    else:
-        msgs.info("Not rejecting deviant pixels")
+        frames_arr = arcycomb.masked_sigclip(frames_arr, reject['level'][0], reject['level'][1], reject['niter'],
+                                             usemedian, maskvalue)
     ##############
     # Combine the arrays
-    msgs.info("Combining frames with a {0:s} operation".format(method))
-    if method == 'mean':
-        frames_arr = arcycomb.masked_mean(frames_arr, maskvalue)
-    elif method == 'median':
+    if method == 'median':
         frames_arr = arcycomb.masked_median(frames_arr, maskvalue)
+    elif weights is not None:
+        # Mask, weight and normalise in a single pass
+        frames_arr = arcycomb.masked_mean_weights(frames_arr, weights, maskvalue, int(method == 'weightmean'))
+    elif method == 'mean':
+        frames_arr = arcycomb.masked_mean(frames_arr, maskvalue)
     elif method == 'weightmean':
         frames_arr = arcycomb.masked_weightmean(frames_arr, maskvalue)
-    else:
-        msgs.error("Combination type '{0:s}' is unknown".format(method))
     ##############
     # If any pixels are completely masked, apply user-specified function
-    msgs.info("Replacing completely masked pixels with the {0:s} value of the input frames".format(reject['replace']))
     frames_arr = arcycomb.masked_replace(frames_arr, allrej_arr, maskvalue)
     # Delete unecessary arrays
     del allrej_arr
     ##############
     # Apply the saturated pixels:
-    if settings.argflag[frametype]['combine']['satpix'] == 'force':
-        msgs.info("Applying saturated pixels to final combined image")
-        frames_arr[setsat] = settings.spect[dnum]['saturation']
-    ##############
-    # And return a 2D numpy array
-    msgs.info("{0:d} {1:s} frames combined successfully!".format(num_frames, printtype))
+    if satpix == 'force':
+        frames_arr[setsat] = saturation
     # Make sure the returned array is the correct type
     frames_arr = np.array(frames_arr, dtype=np.float)
     return frames_arr
+
+
+
+def frame_weights(frames_arr, frametype, exptime=None):
+    """ Weight of each frame, set by settings.argflag[frametype]['combine']['weights']
+
+    The options are:
+      uniform -- all frames are given equal weight (returns None)
+      exptime -- each frame is weighted by its exposure time
+      sn      -- each frame is weighted by its (S/N)^2, estimated from
+                 the median counts of the frame (assuming Poisson noise)
+      list    -- the user-supplied weights, one for each frame
+
+    Parameters
+    ----------
+    frames_arr : ndarray (3D)
+      Array of frames to be combined
+    frametype : str
+      What is the type of frame being combined?
+    exptime : ndarray, or None (optional)
+      Exposure time of each frame
+
+    Returns
+    -------
+    weights : ndarray, or None
+      Weight of each frame, or None if the frames are given equal weight
+    """
+    wtype = settings.argflag[frametype]['combine']['weights']
+    num_frames = frames_arr.shape[2]
+    if isinstance(wtype, list):
+        if len(wtype) != num_frames:
+            msgs.error("{0:d} weights were given for {1:d} {2:s} frames".format(len(wtype), num_frames, frametype))
+        weights = np.array(wtype, dtype=np.float64)
+    elif wtype == 'uniform':
+        return None
+    elif wtype == 'exptime':
+        if exptime is None:
+            msgs.warn("Exposure times were not provided -- the {0:s} frames will be given equal weight".format(frametype))
+            return None
+        weights = np.array(exptime, dtype=np.float64)
+    elif wtype == 'sn':
+        weights = np.array([np.median(frames_arr[:, :, i]) for i in range(num_frames)], dtype=np.float64)
+        weights = np.clip(weights, 0.0, None)
+    else:
+        msgs.error("Weights '{0:s}' for the {1:s} frames are not recognised".format(str(wtype), frametype))
+    if np.all(weights >= 0.0) and np.sum(weights) <= 0.0:
+        # e.g. the exposure time of bias frames
+        msgs.warn("The weights of the {0:s} frames are all zero -- the frames will be given equal weight".format(frametype))
+        return None
+    return weights
+
+
+def comb_sets(sframes, det, frametype, printtype=None):
+    """ Combine the sets of matched frames (see arsort.match_frames)
+
+    The frames of each set are combined with equal weights, since the
+    weights set by settings.argflag[frametype]['combine']['weights']
+    refer to the frames before they were matched. The combined sets
+    are then weighted by their number of frames.
+
+    Parameters
+    ----------
+    sframes : list of ndarray (3D)
+      The matched sets of frames
+    det : int
+      Detector index
+    frametype : str
+      What is the type of frame being combined?
+    printtype : str (optional)
+      The frametype to print to screen
+
+    Returns
+    -------
+    comb_frame : ndarray
+      The combined frame
+    """
+    subframes = np.zeros(sframes[0].shape[:2] + (len(sframes),))
+    numarr = np.zeros(len(sframes))
+    for i in range(len(sframes)):
+        numarr[i] = sframes[i].shape[2]
+        subframes[:, :, i] = comb_frames(sframes[i], det, frametype, weights=np.ones(sframes[i].shape[2]),
+                                         printtype=printtype)
+    # Combine all sub-frames
+    return comb_frames(subframes, det, frametype, weights=numarr, printtype=printtype)
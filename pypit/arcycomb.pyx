@@ -8,8 +8,29 @@ cimport cython
 DTYPE = np.float64
 ctypedef np.float_t DTYPE_t
 
-cdef extern from "math.h":
+cdef extern from "math.h" nogil:
     double csqrt "sqrt" (double)
+    double cfabs "fabs" (double)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef double sorted_median(double[:] arr, int cnt) nogil:
+    # Sort the first cnt elements of arr and return their median
+    cdef int i, j
+    cdef double temp
+    for i in range(1, cnt):
+        temp = arr[i]
+        j = i - 1
+        while j >= 0 and arr[j] > temp:
+            arr[j+1] = arr[j]
+            j -= 1
+        arr[j+1] = temp
+    if cnt%2==0:
+        return 0.5*(arr[cnt/2] + arr[cnt/2 - 1])
+    else:
+        return arr[(cnt-1)/2]
+
 
 #@cython.boundscheck(False)
 def masked_limitget(np.ndarray[DTYPE_t, ndim=3] array not None,
@@ -134,6 +155,50 @@ def masked_limitsetarr(np.ndarray[DTYPE_t, ndim=3] array not None,
     return array
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def masked_lowhigh(np.ndarray[DTYPE_t, ndim=3] array not None,
+                  int nlow,
+                  int nhigh,
+                  double maskvalue):
+    # Mask the nlow lowest and then the nhigh highest unmasked
+    # values of each pixel, without reordering the frames
+
+    cdef int sz_x, sz_y, nfr
+    cdef int x, y, n, r, idx
+    cdef double temp
+
+    sz_x = array.shape[0]
+    sz_y = array.shape[1]
+    nfr  = array.shape[2]
+
+    for x in range(sz_x):
+        for y in range(sz_y):
+            # Reject the low values
+            for r in range(nlow):
+                idx = -1
+                for n in range(nfr):
+                    if array[x,y,n] != maskvalue:
+                        if idx == -1 or array[x,y,n] < temp:
+                            idx = n
+                            temp = array[x,y,n]
+                if idx == -1:
+                    break
+                array[x,y,idx] = maskvalue
+            # Reject the high values
+            for r in range(nhigh):
+                idx = -1
+                for n in range(nfr):
+                    if array[x,y,n] != maskvalue:
+                        if idx == -1 or array[x,y,n] > temp:
+                            idx = n
+                            temp = array[x,y,n]
+                if idx == -1:
+                    break
+                array[x,y,idx] = maskvalue
+    return array
+
+
 #@cython.boundscheck(False)
 def masked_mean(np.ndarray[DTYPE_t, ndim=3] array not None,
                   double maskvalue):
@@ -163,6 +228,51 @@ def masked_mean(np.ndarray[DTYPE_t, ndim=3] array not None,
     return meanarr
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def masked_mean_weights(np.ndarray[DTYPE_t, ndim=3] array not None,
+                  np.ndarray[DTYPE_t, ndim=1] weights not None,
+                  double maskvalue,
+                  int mighell):
+    # Mean of the unmasked values of each pixel, where each frame
+    # is given a weight. If mighell is 1, the weight of each value
+    # is also multiplied by the weights of masked_weightmean.
+
+    cdef int sz_x, sz_y, nfr
+    cdef int x, y, n
+    cdef double sumv, intv, wght
+
+    sz_x = array.shape[0]
+    sz_y = array.shape[1]
+    nfr  = array.shape[2]
+
+    if weights.shape[0] != nfr:
+        raise ValueError("The number of weights must equal the number of frames")
+
+    cdef np.ndarray[DTYPE_t, ndim=2] meanarr = np.zeros((sz_x,sz_y), dtype=DTYPE)
+
+    for x in range(sz_x):
+        for y in range(sz_y):
+            intv = 0.0
+            sumv = 0.0
+            for n in range(nfr):
+                if array[x,y,n] != maskvalue:
+                    if mighell == 1:
+                        if array[x,y,n] <= 1.0: # Deal with spurious cases
+                            intv += weights[n]
+                            continue
+                        wght = weights[n]*csqrt(array[x,y,n])
+                    else:
+                        wght = weights[n]
+                    sumv += wght*array[x,y,n]
+                    intv += wght
+            if intv == 0.0:
+                meanarr[x,y] = maskvalue
+            else:
+                meanarr[x,y] = sumv/intv
+    return meanarr
+
+
 #@cython.boundscheck(False)
 def masked_median(np.ndarray[DTYPE_t, ndim=3] array not None,
                   double maskvalue):
@@ -222,6 +332,74 @@ def masked_replace(np.ndarray[DTYPE_t, ndim=2] array not None,
     return array
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def masked_sigclip(np.ndarray[DTYPE_t, ndim=3] array not None,
+                  double siglo,
+                  double sighi,
+                  int niter,
+                  int usemedian,
+                  double maskvalue):
+    # Iteratively mask the unmasked values of each pixel that are more
+    # than siglo standard deviations below, or sighi standard deviations
+    # above, the central value (siglo or sighi <= 0 means no rejection).
+    # If usemedian is 1, the central value is the median and the standard
+    # deviation is 1.4826 times the median absolute deviation, otherwise
+    # the mean and standard deviation are used. The iterations stop when
+    # no more values are rejected. The GIL is released while clipping.
+
+    cdef int sz_x, sz_y, nfr
+    cdef int x, y, n, it, cnt, nrej
+    cdef double cen, std, sumv
+
+    sz_x = array.shape[0]
+    sz_y = array.shape[1]
+    nfr  = array.shape[2]
+
+    cdef double[:, :, :] arr = array
+    cdef double[:] vals = np.zeros(nfr, dtype=DTYPE)
+
+    with nogil:
+        for x in range(sz_x):
+            for y in range(sz_y):
+                for it in range(niter):
+                    # Fill in the array
+                    cnt = 0
+                    for n in range(nfr):
+                        if arr[x,y,n] != maskvalue:
+                            vals[cnt] = arr[x,y,n]
+                            cnt += 1
+                    if cnt == 0:
+                        break
+                    # Central value and standard deviation
+                    if usemedian == 1:
+                        cen = sorted_median(vals, cnt)
+                        for n in range(cnt):
+                            vals[n] = cfabs(vals[n]-cen)
+                        std = 1.4826*sorted_median(vals, cnt)
+                    else:
+                        sumv = 0.0
+                        for n in range(cnt):
+                            sumv += vals[n]
+                        cen = sumv/cnt
+                        sumv = 0.0
+                        for n in range(cnt):
+                            sumv += (vals[n]-cen)*(vals[n]-cen)
+                        std = csqrt(sumv/cnt)
+                    # Mask the deviant values
+                    nrej = 0
+                    for n in range(nfr):
+                        if arr[x,y,n] == maskvalue:
+                            continue
+                        if (siglo > 0.0 and arr[x,y,n] < cen - siglo*std) or \
+                                (sighi > 0.0 and arr[x,y,n] > cen + sighi*std):
+                            arr[x,y,n] = maskvalue
+                            nrej += 1
+                    if nrej == 0:
+                        break
+    return array
+
+
 #@cython.boundscheck(False)
 def masked_weightmean(np.ndarray[DTYPE_t, ndim=3] array not None,
                   double maskvalue):
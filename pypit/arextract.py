@@ -59,7 +59,7 @@ def boxcar(slf, det, specobjs, sciframe, varframe, skyframe, crmask, scitrace):
     bgcorr = np.zeros_like(cr_mask)
     # Loop on Slits
     for sl in range(nslit):
-        word = np.where(slf._slitpix[det - 1] == sl + 1)
+        word = slf.GetSlitPixels(det, sl)
         if word[0].size == 0:
             continue
         mask_slit = np.zeros(sciframe.shape, dtype=np.float)
@@ -68,26 +68,13 @@ def boxcar(slf, det, specobjs, sciframe, varframe, skyframe, crmask, scitrace):
         nobj = scitrace[sl]['nobj']
         for o in range(nobj):
             msgs.info("Performing boxcar extraction of object {0:d}/{1:d} in slit {2:d}/{3:d}".format(o+1, nobj, sl+1, nslit))
-            if scitrace[sl]['object'] is None:
-                # The object for all slits is provided in the first extension
-                objreg = np.copy(scitrace[0]['object'][:, :, o])
-                wzro = np.where(slf._slitpix[det - 1] != sl + 1)
-                objreg[wzro] = 0.0
-            else:
-                objreg = scitrace[sl]['object'][:, :, o]
+            objreg = artrace.aperture_image(scitrace[sl]['object'][o])
             # Fit the background
             msgs.info("   Fitting the background")
-            if scitrace[sl]['background'] is None:
-                # The background for all slits is provided in the first extension
-                bckreg = np.copy(scitrace[0]['background'][:, :, o])
-                wzro = np.where(slf._slitpix[det - 1] != sl + 1)
-                bckreg[wzro] = 0.0
-            else:
-                bckreg = scitrace[sl]['background'][:, :, o]
+            bckreg = artrace.aperture_image(scitrace[sl]['background'][o])
             # Trim CRs further
-            bg_mask = np.zeros_like(sciframe)
-            bg_mask[np.where((bckreg*cr_mask <= 0.))] = 1.
-            bg_mask[np.where((slf._slitpix[det - 1] != sl + 1))] = 1.
+            bg_mask = np.ones_like(sciframe)
+            bg_mask[word] = (bckreg*cr_mask)[word] <= 0.
             mask_sci = np.ma.array(sciframe, mask=bg_mask, fill_value=0.)
             clip_image = sigma_clip(mask_sci, axis=1, sigma=3.)  # For the mask only
             # Fit
@@ -109,7 +96,8 @@ def boxcar(slf, det, specobjs, sciframe, varframe, skyframe, crmask, scitrace):
             varsum = np.sum(varframe*weight, axis=1)
             # Update background correction image
             tmp = bckreg + objreg
-            gdp = np.where((tmp > 0) & (slf._slitpix[det - 1] == sl + 1))
+            gdp = tmp[word] > 0
+            gdp = (word[0][gdp], word[1][gdp])
             bgcorr[gdp] = bgframe[gdp]
             # Mask
             boxmask = np.zeros(wvsum.shape, dtype=np.int)
@@ -200,13 +188,7 @@ def obj_profiles(slf, det, specobjs, sciframe, varframe, skyframe, crmask,
         for o in range(nobj):
             msgs.info("Deriving spatial profile of object {0:d}/{1:d} in slit {2:d}/{3:d}".format(o+1, nobj, sl+1, len(specobjs)))
             # Get object pixels
-            if scitrace[sl]['background'] is None:
-                # The object for all slits is provided in the first extension
-                objreg = np.copy(scitrace[0]['object'][:, :, o])
-                wzro = np.where(slf._slitpix[det - 1] != sl + 1)
-                objreg[wzro] = 0.0
-            else:
-                objreg = scitrace[sl]['object'][:, :, o]
+            objreg = artrace.aperture_image(scitrace[sl]['object'][o])
             # Calculate slit image
             slit_img = artrace.slit_image(slf, det, scitrace[sl], o)#, tilts=tilts)
             # Object pixels
@@ -344,13 +326,7 @@ def optimal_extract(slf, det, specobjs, sciframe, varframe,
         for o in range(nobj):
             msgs.info("Performing optimal extraction of object {0:d}/{1:d} in slit {2:d}/{3:d}".format(o+1, nobj, sl+1, len(specobjs)))
             # Get object pixels
-            if scitrace[sl]['background'] is None:
-                # The object for all slits is provided in the first extension
-                objreg = np.copy(scitrace[0]['object'][:, :, o])
-                wzro = np.where(slf._slitpix[det - 1] != sl + 1)
-                objreg[wzro] = 0.0
-            else:
-                objreg = scitrace[sl]['object'][:, :, o]
+            objreg = artrace.aperture_image(scitrace[sl]['object'][o])
             # Fit dict
             fit_dict = scitrace[sl]['opt_profile'][o]
             if 'param' not in fit_dict.keys():
@@ -2,6 +2,8 @@ from __future__ import (print_function, absolute_import, division, unicode_liter
 from future.utils import iteritems
 
 import os
+import tempfile
+from functools import partial
 import astropy.io.fits as pyfits
 from astropy.time import Time
 import numpy as np
@@ -9,9 +11,7 @@ from pypit import arparse as settings
 from pypit import armsgs
 from pypit import arproc
 from pypit import arlris
-#from multiprocessing import Pool as mpPool
-#from multiprocessing.pool import ApplyResult
-#import arutils
+from pypit import arutils
 
 try:
     basestring
@@ -28,6 +28,11 @@ def load_headers(datlines):
     """
     Load the header information for each fits file
 
+    If settings.argflag['run']['headercache'] is not None, the header
+    information extracted from each file is stored in a cache file
+    (see load_header_cache), and the headers of a file are only read
+    again if the file has changed since it was cached.
+
     Parameters
     ----------
     datlines : list
@@ -38,64 +43,53 @@ def load_headers(datlines):
     Returns
     -------
     fitsdict : dict
-      The relevant header information of all fits files
+      The relevant header information of all fits files. Only the values
+      of the settings.spect['keyword'] keywords are kept (one array per
+      keyword); the full headers can be read with get_header.
     """
-    def generate_updates(dct, keylst, keys, whddict, headarr):
-        """ Generate a list of settings to be updated
-        """
-        for (key, value) in iteritems(dct):
-            keys += [str(key)]
-            if isinstance(value, dict):
-                generate_updates(value, keylst, keys, whddict, headarr)
-            else:
-                try:
-                    tfrhd = int(value.split('.')[0]) - 1
-                    kchk = '.'.join(value.split('.')[1:])
-                    frhd = whddict['{0:02d}'.format(tfrhd)]
-                    hdrval = headarr[frhd][kchk]
-                    if keys[0] not in ["check", "keyword"]:
-                        keylst += [str(' ').join(keys) + str(" ") +
-                                   str("{0}\n".format(hdrval).replace(" ", ""))]
-                        keylst[-1] = keylst[-1].split()
-                except (AttributeError, ValueError, KeyError):
-                    pass
-            del keys[-1]
-
     chks = settings.spect['check'].keys()
     keys = settings.spect['keyword'].keys()
     fitsdict = dict({'directory': [], 'filename': [], 'utc': []})
-    whddict = dict({})
     for k in keys:
         fitsdict[k]=[]
-    allhead = []
-    headarr = [None for k in range(settings.spect['fits']['numhead'])]
+    cache_file = settings.argflag['run']['headercache']
+    if cache_file is not None:
+        cache = load_header_cache(cache_file)
+        ncached = 0
+    keylst = []
     numfiles = len(datlines)
+    # Check if the header information of each file has been cached
+    entries = [None for i in range(numfiles)]
+    if cache_file is not None:
+        fkeys = [header_cache_key(datlines[i]) for i in range(numfiles)]
+        for i in range(numfiles):
+            fkey, fstat = fkeys[i]
+            if fkey in cache['files'] and cache['files'][fkey]['stat'] == fstat:
+                entries[i] = cache['files'][fkey]
+                ncached += 1
+    # Read the headers of the remaining files (concurrently, in order)
+    scan = scan_headers([datlines[i] for i in range(numfiles) if entries[i] is None])
     for i in range(numfiles):
-        # Try to open the fits file
-        try:
-            for k in range(settings.spect['fits']['numhead']):
-                headarr[k] = pyfits.getheader(datlines[i], ext=settings.spect['fits']['headext{0:02d}'.format(k+1)])
-                whddict['{0:02d}'.format(settings.spect['fits']['headext{0:02d}'.format(k+1)])] = k
-        except:
-            if settings.argflag['run']['setup']:
-                msgs.warn("Bad header in extension {0:d} of file:".format(settings.spect['fits']['headext{0:02d}'.format(k+1)])+msgs.newline()+datlines[i])
-                msgs.warn("Proceeding on the hopes this was a calibration file, otherwise consider removing.")
-            else:
-                msgs.error("Error reading header from extension {0:d} of file:".format(settings.spect['fits']['headext{0:02d}'.format(k+1)])+msgs.newline()+datlines[i])
-        # Save
-        for k in range(settings.spect['fits']['numhead']):
-            tmp = [head.copy() for head in headarr]
-            allhead.append(tmp)
+        entry = entries[i]
+        if entry is None:
+            headarr, badext = next(scan)
+            entry, headarr = load_header_values(datlines[i], headarr=headarr, badext=badext)
+            if entry is None:
+                msgs.warn("Skipping the file..")
+                numfiles -= 1
+                continue
+            if cache_file is not None:
+                fkey, fstat = fkeys[i]
+                cache['files'][fkey] = entry
+                cache['files'][fkey]['stat'] = fstat
+        # Use the header information of the last file to update the settings
+        keylst = [list(kl) for kl in entry['updates']]
         # Perform checks on each fits files, as specified in the settings.instrument file.
         skip = False
         for ch in chks:
-            tfrhd = int(ch.split('.')[0])-1
-            kchk  = '.'.join(ch.split('.')[1:])
-            frhd  = whddict['{0:02d}'.format(tfrhd)]
-            if settings.spect['check'][ch] != str(headarr[frhd][kchk]).strip():
-                print(ch, frhd, kchk)
-                print(settings.spect['check'][ch], str(headarr[frhd][kchk]).strip())
-                msgs.warn("The following file:"+msgs.newline()+datlines[i]+msgs.newline()+"is not taken with the settings.{0:s} detector".format(settings.argflag['run']['spectrograph'])+msgs.newline()+"Remove this file, or specify a different settings file.")
+            if settings.spect['check'][ch] != entry['check'][ch]:
+                msgs.warn("The following file:"+msgs.newline()+datlines[i]+msgs.newline()+"is not taken with the settings.{0:s} detector".format(settings.argflag['run']['spectrograph'])+msgs.newline()+
+                          "(check {0:s} is '{1:s}', expected '{2:s}')".format(ch, str(entry['check'][ch]), str(settings.spect['check'][ch]))+msgs.newline()+"Remove this file, or specify a different settings file.")
                 msgs.warn("Skipping the file..")
                 skip = True
         if skip:
@@ -105,84 +99,22 @@ def load_headers(datlines):
         dspl = datlines[i].split('/')
         fitsdict['directory'].append('/'.join(dspl[:-1])+'/')
         fitsdict['filename'].append(dspl[-1])
-        # Attempt to load a UTC
-        utcfound = False
-        for k in range(settings.spect['fits']['numhead']):
-            if 'UTC' in headarr[k].keys():
-                utc = headarr[k]['UTC']
-                utcfound = True
-                break
-            elif 'UT' in headarr[k].keys():
-                utc = headarr[k]['UT']
-                utcfound = True
-                break
-        if utcfound:
-            fitsdict['utc'].append(utc)
-        else:
-            fitsdict['utc'].append(None)
+        fitsdict['utc'].append(entry['utc'])
+        if entry['utc'] is None:
             msgs.warn("UTC is not listed as a header keyword in file:"+msgs.newline()+datlines[i])
-        # Read binning-dependent detector properties here? (maybe read speed too)
-        #if settings.argflag['run']['spectrograph'] in ['keck_lris_blue']:
-        #    arlris.set_det(fitsdict, headarr[k])
-        # Now get the rest of the keywords
         for kw in keys:
-            if settings.spect['keyword'][kw] is None:
-                value = str('None')  # This instrument doesn't have/need this keyword
-            else:
-                ch = settings.spect['keyword'][kw]
-                try:
-                    tfrhd = int(ch.split('.')[0])-1
-                except ValueError:
-                    value = ch  # Keyword given a value. Only a string allowed for now
-                else:
-                    frhd = whddict['{0:02d}'.format(tfrhd)]
-                    kchk = '.'.join(ch.split('.')[1:])
-                    try:
-                        value = headarr[frhd][kchk]
-                    except KeyError: # Keyword not found in header
-                        msgs.warn("{:s} keyword not in header. Setting to None".format(kchk))
-                        value=str('None')
-            # Convert the input time into hours
-            if kw == 'time':
-                if settings.spect['fits']['timeunit']   == 's'  : value = float(value)/3600.0    # Convert seconds to hours
-                elif settings.spect['fits']['timeunit'] == 'm'  : value = float(value)/60.0      # Convert minutes to hours
-                elif settings.spect['fits']['timeunit'] in Time.FORMATS.keys() : # Astropy time format
-                    if settings.spect['fits']['timeunit'] in ['mjd']:
-                        ival = float(value)
-                    else:
-                        ival = value
-                    tval = Time(ival, scale='tt', format=settings.spect['fits']['timeunit'])
-                    # dspT = value.split('T')
-                    # dy,dm,dd = np.array(dspT[0].split('-')).astype(np.int)
-                    # th,tm,ts = np.array(dspT[1].split(':')).astype(np.float64)
-                    # r=(14-dm)/12
-                    # s,t=dy+4800-r,dm+12*r-3
-                    # jdn = dd + (153*t+2)/5 + 365*s + s/4 - 32083
-                    # value = jdn + (12.-th)/24 + tm/1440 + ts/86400 - 2400000.5  # THIS IS THE MJD
-                    value = tval.mjd * 24.0 # Put MJD in hours
-                else:
-                    msgs.error('Bad time unit')
-            # Put the value in the keyword
-            typv = type(value)
-            if typv is int or typv is np.int_:
-                fitsdict[kw].append(value)
-            elif typv is float or typv is np.float_:
-                fitsdict[kw].append(value)
-            elif isinstance(value, basestring) or typv is np.string_:
-                fitsdict[kw].append(value.strip())
-            elif typv is bool or typv is np.bool_:
-                fitsdict[kw].append(value)
-            else:
-                msgs.bug("I didn't expect a useful header ({0:s}) to contain type {1:s}".format(kw, typv).replace('<type ','').replace('>',''))
-
+            fitsdict[kw].append(entry['values'][kw])
         msgs.info("Successfully loaded headers for file:" + msgs.newline() + datlines[i])
+    scan.close()
 
     # Check if any other settings require header values to be loaded
     msgs.info("Checking spectrograph settings for required header information")
-    # Just use the header info from the last file
-    keylst = []
-    generate_updates(settings.spect.copy(), keylst, [], whddict, headarr)
+    # Just use the header info from the last file (see above)
 
+    # Save the cache
+    if cache_file is not None:
+        msgs.info("Header information of {0:d}/{1:d} files was taken from the cache".format(ncached, len(datlines)))
+        save_header_cache(cache_file, cache)
     # Convert the fitsdict arrays into numpy arrays
     for k in fitsdict.keys():
         fitsdict[k] = np.array(fitsdict[k])
@@ -193,15 +125,330 @@ def load_headers(datlines):
         msgs.error("The headers could not be read from the input data files." + msgs.newline() +
                    "Please check that the settings file matches the data.")
     # Return
-    fitsdict['headers'] = allhead
     return fitsdict, keylst
 
 
+def load_header_values(filename, headarr=None, badext=None):
+    """
+    Extract the values needed by fitsdict and the settings
+    from the headers of a fits file.
+
+    Parameters
+    ----------
+    filename : str
+      Full path of the fits file
+    headarr : list, optional
+      The headers of the file, as returned by read_headers.
+      If None, the headers are read.
+    badext : int, optional
+      The extension that could not be read by read_headers
+
+    Returns
+    -------
+    entry : dict or None
+      The header information of the file (None if the headers could not be read), containing:
+        check -- the values of the settings.spect['check'] keywords
+        utc -- the UTC (None if it is not in the headers)
+        values -- the values of the settings.spect['keyword'] keywords
+        updates -- the settings that depend on the header values
+    headarr : list or None
+      The headers of the file
+    """
+    def generate_updates(dct, keylst, keys, whddict, headarr):
+        """ Generate a list of settings to be updated
+        """
+        for (key, value) in iteritems(dct):
+            keys += [str(key)]
+            if isinstance(value, dict):
+                generate_updates(value, keylst, keys, whddict, headarr)
+            else:
+                try:
+                    tfrhd = int(value.split('.')[0]) - 1
+                    kchk = '.'.join(value.split('.')[1:])
+                    frhd = whddict['{0:02d}'.format(tfrhd)]
+                    hdrval = headarr[frhd][kchk]
+                    if keys[0] not in ["check", "keyword"]:
+                        keylst += [str(' ').join(keys) + str(" ") +
+                                   str("{0}\n".format(hdrval).replace(" ", ""))]
+                        keylst[-1] = keylst[-1].split()
+                except (AttributeError, ValueError, KeyError):
+                    pass
+            del keys[-1]
+
+    if headarr is None and badext is None:
+        headarr, badext = read_headers(filename)
+    if badext is not None:
+        if settings.argflag['run']['setup']:
+            msgs.warn("Bad header in extension {0:d} of file:".format(badext)+msgs.newline()+filename)
+            msgs.warn("If this was a calibration file, consider removing it.")
+            return None, None
+        else:
+            msgs.error("Error reading header from extension {0:d} of file:".format(badext)+msgs.newline()+filename)
+    whddict = dict({})
+    for k in range(settings.spect['fits']['numhead']):
+        whddict['{0:02d}'.format(settings.spect['fits']['headext{0:02d}'.format(k+1)])] = k
+    entry = dict({'check': dict({}), 'utc': None, 'values': dict({}), 'updates': []})
+    # Get the values of the keywords that are checked
+    for ch in settings.spect['check'].keys():
+        tfrhd = int(ch.split('.')[0])-1
+        kchk  = '.'.join(ch.split('.')[1:])
+        frhd  = whddict['{0:02d}'.format(tfrhd)]
+        entry['check'][ch] = str(headarr[frhd][kchk]).strip()
+    # Attempt to load a UTC
+    for k in range(settings.spect['fits']['numhead']):
+        if 'UTC' in headarr[k].keys():
+            entry['utc'] = headarr[k]['UTC']
+            break
+        elif 'UT' in headarr[k].keys():
+            entry['utc'] = headarr[k]['UT']
+            break
+    # Read binning-dependent detector properties here? (maybe read speed too)
+    #if settings.argflag['run']['spectrograph'] in ['keck_lris_blue']:
+    #    arlris.set_det(fitsdict, headarr[k])
+    # Now get the rest of the keywords
+    for kw in settings.spect['keyword'].keys():
+        if settings.spect['keyword'][kw] is None:
+            value = str('None')  # This instrument doesn't have/need this keyword
+        else:
+            ch = settings.spect['keyword'][kw]
+            try:
+                tfrhd = int(ch.split('.')[0])-1
+            except ValueError:
+                value = ch  # Keyword given a value. Only a string allowed for now
+            else:
+                frhd = whddict['{0:02d}'.format(tfrhd)]
+                kchk = '.'.join(ch.split('.')[1:])
+                try:
+                    value = headarr[frhd][kchk]
+                except KeyError: # Keyword not found in header
+                    msgs.warn("{:s} keyword not in header. Setting to None".format(kchk))
+                    value=str('None')
+        # Convert the input time into hours
+        if kw == 'time':
+            if settings.spect['fits']['timeunit']   == 's'  : value = float(value)/3600.0    # Convert seconds to hours
+            elif settings.spect['fits']['timeunit'] == 'm'  : value = float(value)/60.0      # Convert minutes to hours
+            elif settings.spect['fits']['timeunit'] in Time.FORMATS.keys() : # Astropy time format
+                if settings.spect['fits']['timeunit'] in ['mjd']:
+                    ival = float(value)
+                else:
+                    ival = value
+                tval = Time(ival, scale='tt', format=settings.spect['fits']['timeunit'])
+                # dspT = value.split('T')
+                # dy,dm,dd = np.array(dspT[0].split('-')).astype(np.int)
+                # th,tm,ts = np.array(dspT[1].split(':')).astype(np.float64)
+                # r=(14-dm)/12
+                # s,t=dy+4800-r,dm+12*r-3
+                # jdn = dd + (153*t+2)/5 + 365*s + s/4 - 32083
+                # value = jdn + (12.-th)/24 + tm/1440 + ts/86400 - 2400000.5  # THIS IS THE MJD
+                value = float(tval.mjd * 24.0) # Put MJD in hours
+            else:
+                msgs.error('Bad time unit')
+        # Put the value in the keyword
+        typv = type(value)
+        if typv is int or typv is np.int_:
+            entry['values'][kw] = value
+        elif typv is float or typv is np.float_:
+            entry['values'][kw] = value
+        elif isinstance(value, basestring) or typv is np.string_:
+            entry['values'][kw] = value.strip()
+        elif typv is bool or typv is np.bool_:
+            entry['values'][kw] = value
+        else:
+            msgs.bug("I didn't expect a useful header ({0:s}) to contain type {1:s}".format(kw, typv).replace('<type ','').replace('>',''))
+    # Check if any other settings require header values to be loaded
+    generate_updates(settings.spect.copy(), entry['updates'], [], whddict, headarr)
+    return entry, headarr
+
+
+def read_headers(filename):
+    """
+    Read the headers of a fits file, without reading the data.
+    The file is opened once, and only the header blocks up to the
+    last extension listed in the settings are read.
+
+    Parameters
+    ----------
+    filename : str
+      Full path of the fits file
+
+    Returns
+    -------
+    headarr : list or None
+      The headers of the file (None if they could not be read)
+    badext : int or None
+      The extension that could not be read (None if all headers were read)
+    """
+    headarr = [None for k in range(settings.spect['fits']['numhead'])]
+    ext = settings.spect['fits']['headext01']
+    try:
+        with pyfits.open(filename, memmap=False) as hdulist:
+            for k in range(settings.spect['fits']['numhead']):
+                ext = settings.spect['fits']['headext{0:02d}'.format(k+1)]
+                headarr[k] = hdulist[ext].header
+    except Exception:
+        return None, ext
+    return headarr, None
+
+
+def scan_headers(filenames):
+    """
+    Read the headers of a list of fits files. The headers are read by a
+    pool of threads, so that the reading of several files overlaps (this
+    is mostly limited by the latency of the file system). At most
+    settings.argflag['run']['maxopen'] files are open at the same time.
+
+    Parameters
+    ----------
+    filenames : list
+      Full paths of the fits files
+
+    Returns
+    -------
+    A generator of the (headarr, badext) returned by read_headers for
+    each file, in the same order as filenames
+    """
+    nfiles = len(filenames)
+    nopen = settings.argflag['run']['maxopen']
+    if nopen is None:
+        nopen = settings.get_ncpus(nfiles)
+    nopen = min(nopen, nfiles)
+    if nopen > 1:
+        msgs.info("Reading the headers of {0:d} files with {1:d} threads".format(nfiles, nopen))
+    for result in arutils.mp_imap(read_headers, filenames, nopen, pool='thread'):
+        yield result
+
+
+def get_header(fitsdict, idx, k=0):
+    """
+    Read one of the headers of a fits file loaded by load_headers.
+    The full headers are not kept in fitsdict, so this should only be
+    used for header keywords that are not in settings.spect['keyword'].
+
+    Parameters
+    ----------
+    fitsdict : dict
+      Contains relevant information from fits header files
+    idx : int
+      Index of the file in fitsdict
+    k : int, optional
+      Index of the header (0 corresponds to settings.spect['fits']['headext01'])
+
+    Returns
+    -------
+    header : astropy.io.fits.Header
+    """
+    filename = fitsdict['directory'][idx]+fitsdict['filename'][idx]
+    return pyfits.getheader(filename, ext=settings.spect['fits']['headext{0:02d}'.format(k+1)])
+
+
+def header_cache_key(filename):
+    """
+    The key and the file status used to cache the header
+    information of a file (see load_header_cache)
+
+    Parameters
+    ----------
+    filename : str
+      Full path of the fits file
+
+    Returns
+    -------
+    fkey : str
+      The absolute path of the file
+    fstat : list
+      The size and modification time of the file
+    """
+    fkey = os.path.abspath(filename)
+    return fkey, [os.path.getsize(fkey), os.path.getmtime(fkey)]
+
+
+def header_cache_settings():
+    """
+    The settings that determine the header information extracted
+    from each file. A cache is only valid for these settings.
+
+    Returns
+    -------
+    csettings : str
+    """
+    import json
+    csettings = dict(spectrograph=settings.argflag['run']['spectrograph'],
+                     spect=arutils.yamlify(settings.spect))
+    return json.dumps(csettings, sort_keys=True)
+
+
+def load_header_cache(cache_file):
+    """
+    Load the cache of the header information of the raw files.
+
+    The cache is a JSON file that stores, for each file (identified by
+    its absolute path, size and modification time), the values that
+    load_headers extracts from the headers. The cache is discarded if it
+    was generated with different spectrograph settings.
+
+    Parameters
+    ----------
+    cache_file : str
+      Name of the cache file
+
+    Returns
+    -------
+    cache : dict
+      The cached header information
+    """
+    import json
+    csettings = header_cache_settings()
+    cache = dict({'settings': csettings, 'files': dict({})})
+    if not os.path.isfile(cache_file):
+        msgs.info("Generating a new header cache:" + msgs.newline() + cache_file)
+        return cache
+    try:
+        with open(cache_file, 'r') as f:
+            tcache = json.load(f)
+    except ValueError:
+        msgs.warn("Could not read the header cache. Generating a new header cache:" + msgs.newline() + cache_file)
+        return cache
+    if tcache.get('settings') != csettings:
+        msgs.info("The spectrograph settings have changed. Generating a new header cache:" + msgs.newline() + cache_file)
+        return cache
+    msgs.info("Loaded the header cache:" + msgs.newline() + cache_file)
+    return tcache
+
+
+def save_header_cache(cache_file, cache):
+    """
+    Save the cache of the header information of the raw files.
+
+    Parameters
+    ----------
+    cache_file : str
+      Name of the cache file
+    cache : dict
+      The cached header information (see load_header_cache)
+    """
+    import json
+    try:
+        cstr = json.dumps(arutils.yamlify(cache))
+    except TypeError:
+        msgs.warn("The header information could not be cached")
+        return
+    with open(cache_file, 'w') as f:
+        f.write(cstr)
+
+
 def load_frames(fitsdict, ind, det, frametype='<None>', msbias=None, trim=True):
     """
     Load data frames, usually raw.
     Bias subtract (if not msbias!=None) and trim (if True)
 
+    When more than one CPU is available (settings.argflag['run']['ncpus']),
+    the frames are read with a pool of workers (settings.argflag['run']['pool']),
+    and each frame is inserted into a preallocated frame cube, preserving
+    the order of ind.
+
+    When more than one frame is loaded, the storage of the frame cube
+    is set by settings.argflag['run']['framecube'] (see frame_cube).
+
     Parameters
     ----------
     fitsdict : dict
@@ -216,75 +463,126 @@ def load_frames(fitsdict, ind, det, frametype='<None>', msbias=None, trim=True):
     frames : ndarray (3 dimensional)
       One image per ind
     """
-    def load_indfr(name,ext):
-        msgs.work("Trim and overscan has not been applied")
-        temp = pyfits.getdata(name, ext)
-        return temp
-
     msgs.info("Loading individual {0:s} frames".format(frametype))
-    # Get detector number
-    dnum = settings.get_dnum(det)
     if np.size(ind) == 0:
         msgs.warn("No {0:s} frames to load".format(frametype))
         return None
-    msgs.work("Implement multiprocessing here (better -- at the moment it's slower than not) to speed up data reading")
-    for i in range(np.size(ind)):
-        # Instrument specific read
-        if settings.argflag['run']['spectrograph'] in ['keck_lris_blue', 'keck_lris_red']:
-            temp, head0, _ = arlris.read_lris(fitsdict['directory'][ind[i]]+fitsdict['filename'][ind[i]], det=det)
-        else:
-            hdulist = pyfits.open(fitsdict['directory'][ind[i]]+fitsdict['filename'][ind[i]])
-            temp = hdulist[settings.spect[dnum]['dataext01']].data
-            head0 = hdulist[0].header
-        temp = temp.astype(np.float)  # Let us avoid uint16
-        if settings.argflag['trace']['dispersion']['direction'] == 1:
-            temp = temp.T
-        if msbias is not None:
-            if type(msbias) is np.ndarray:
-                temp -= msbias  # Subtract the master bias frame
-            elif isinstance(msbias,basestring):
-                if msbias == "overscan":
-                    arproc.sub_overscan(temp, det)
-                else:
-                    msgs.error("Could not subtract bias level when loading {0:s} frames".format(frametype))
-            if trim:
-                temp = arproc.trim(temp, det)
-        # Save image
-        if i == 0:
-            frames = np.zeros((temp.shape[0], temp.shape[1], np.size(ind)))
-            frames[:,:,i] = temp.copy()
-        else:
-            frames[:,:,i] = temp.copy()
-        del temp
-
-#	pool = mpPool(processes=np.min([settings.argflag['run']['ncpus'],np.size(ind)]))
-#	async_results = []
-#	for i in range(np.size(ind)):
-#		async_results.append(pool.apply_async(pyfits.getdata, (fitsdict['directory'][ind[i]]+fitsdict['filename'][ind[i]], settings.spect['fits']['dataext'])))
-#	pool.close()
-#	pool.join()
-#	map(ApplyResult.wait, async_results)
-#	for j in range(np.size(ind)):
-#		if j == 0:
-#			temp = async_results[j].get()
-#			frames = np.zeros((temp.shape[0], temp.shape[1], np.size(ind)))
-#			if msbias is None:
-#				frames[:,:,i] = temp
-#			else:
-#				frames[:,:,i] = temp - msbias
-#			del temp
-#		else:
-#			if msbias is None:
-#				frames[:,:,i] = async_results[j].get()
-#			else:
-#				frames[:,:,i] = async_results[j].get() - msbias
-    if np.size(ind) == 1:
-        msgs.info("Loaded {0:d} {1:s} frame successfully".format(np.size(ind), frametype))
+    ind = np.atleast_1d(ind)
+    nfiles = np.size(ind)
+    filenames = [fitsdict['directory'][ind[i]]+fitsdict['filename'][ind[i]] for i in range(nfiles)]
+    # Load the first frame to determine the size of the output cube
+    temp = load_raw_frame(filenames[0], det, frametype=frametype, msbias=msbias, trim=trim)
+    if nfiles == 1:
+        frames = np.zeros((temp.shape[0], temp.shape[1], nfiles))
+    else:
+        frames = frame_cube(temp.shape[0], temp.shape[1], nfiles)
+    frames[:, :, 0] = temp
+    del temp
+    # Load the remaining frames
+    ncpus = settings.get_ncpus(nfiles-1)
+    ptype = settings.argflag['run']['pool']
+    if ncpus > 1:
+        msgs.info("Loading {0:d} frames with {1:d} CPUs".format(nfiles-1, ncpus))
+    if ncpus > 1 and ptype == 'thread':
+        # The workers insert each frame directly into the cube
+        def fill_frame(i):
+            frames[:, :, i] = load_raw_frame(filenames[i], det, frametype=frametype, msbias=msbias, trim=trim)
+        for _ in arutils.mp_imap(fill_frame, range(1, nfiles), ncpus, pool=ptype):
+            pass
+    else:
+        loader = partial(load_raw_frame, det=det, frametype=frametype, msbias=msbias, trim=trim)
+        for i, temp in enumerate(arutils.mp_imap(loader, filenames[1:], ncpus, pool=ptype)):
+            frames[:, :, i+1] = temp
+    if nfiles == 1:
+        msgs.info("Loaded {0:d} {1:s} frame successfully".format(nfiles, frametype))
     else:
-        msgs.info("Loaded {0:d} {1:s} frames successfully".format(np.size(ind), frametype))
+        msgs.info("Loaded {0:d} {1:s} frames successfully".format(nfiles, frametype))
     return frames
 
 
+def frame_cube(nx, ny, nframes):
+    """
+    Allocate an empty cube to store a stack of frames.
+
+    The frames are stored along the last axis, so that the values of
+    each pixel in all frames are contiguous in memory. The data type
+    of the cube is settings.argflag['run']['framecube']['dtype'].
+    If settings.argflag['run']['framecube']['memmap'] is True, the cube
+    is backed by an anonymous temporary file in the directory
+    settings.argflag['run']['framecube']['directory'], and the file
+    is deleted when the cube is no longer referenced.
+
+    Parameters
+    ----------
+    nx : int
+      Number of pixels along the first axis of each frame
+    ny : int
+      Number of pixels along the second axis of each frame
+    nframes : int
+      Number of frames
+
+    Returns
+    -------
+    frames : ndarray or memmap (3 dimensional)
+      An array of zeros with shape (nx, ny, nframes)
+    """
+    cube = settings.argflag['run']['framecube']
+    dtype = np.dtype(cube['dtype'])
+    if not cube['memmap']:
+        return np.zeros((nx, ny, nframes), dtype=dtype)
+    msgs.info("Storing {0:d} frames in a memory-mapped file ({1:.1f} MB)".format(
+        nframes, nx*ny*nframes*dtype.itemsize/1024.0**2))
+    return np.memmap(tempfile.TemporaryFile(dir=cube['directory']), dtype=dtype,
+                     mode='w+', shape=(nx, ny, nframes))
+
+
+def load_raw_frame(filename, det, frametype='<None>', msbias=None, trim=True):
+    """
+    Load a single raw data frame.
+    Bias subtract (if not msbias!=None) and trim (if True)
+
+    Parameters
+    ----------
+    filename : str
+      Full path of the raw frame
+    det : int
+      Detector number, starts at 1
+    frametype : str, optional
+      The type of frame being loaded (only used for screen printout)
+    msbias : ndarray or str, optional
+      Master bias frame, or 'overscan'
+    trim : bool, optional
+      Trim the frame to the data sections?
+
+    Returns
+    -------
+    frame : ndarray
+      The processed frame
+    """
+    dnum = settings.get_dnum(det)
+    # Instrument specific read
+    if settings.argflag['run']['spectrograph'] in ['keck_lris_blue', 'keck_lris_red']:
+        temp, head0, _ = arlris.read_lris(filename, det=det)
+        temp = temp.astype(np.float, copy=False)  # Already float64 and C-contiguous
+    else:
+        hdulist = pyfits.open(filename)
+        temp = hdulist[settings.spect[dnum]['dataext01']].data.astype(np.float)  # Let us avoid uint16
+        hdulist.close()
+    if settings.argflag['trace']['dispersion']['direction'] == 1:
+        temp = temp.T
+    if msbias is not None:
+        if type(msbias) is np.ndarray:
+            temp -= msbias  # Subtract the master bias frame
+        elif isinstance(msbias, basestring):
+            if msbias == "overscan":
+                arproc.sub_overscan(temp, det)
+            else:
+                msgs.error("Could not subtract bias level when loading {0:s} frames".format(frametype))
+        if trim:
+            temp = arproc.trim(temp, det)
+    return temp
+
+
 def load_extraction(name, frametype='<None>', wave=True):
     msgs.info("Loading a pre-existing {0:s} extraction frame:".format(frametype)+msgs.newline()+name)
     props_savas = dict({"ORDWN":"ordwnum"})
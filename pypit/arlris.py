@@ -1,6 +1,7 @@
 # Module for LRIS specific codes
 from __future__ import absolute_import, division, print_function
 
+import os
 import numpy as np
 import glob
 import astropy.io.fits as pyfits
@@ -18,6 +19,9 @@ except NameError:  # For Python 3
 # Logging
 msgs = armsgs.get_logger()
 
+# Cache of the layouts of the raw LRIS mosaics (see lris_layout)
+_lris_layouts = dict({})
+
 
 def read_lris(raw_file, det=None, TRIM=False):
     """
@@ -25,6 +29,11 @@ def read_lris(raw_file, det=None, TRIM=False):
     Packed in a multi-extension HDU
     Based on readmhdufits.pro
 
+    The layout of the mosaic is determined from the headers alone
+    (see lris_layout), and only the extensions of the requested
+    detector are read. The data of each amplifier are written
+    directly into the output image.
+
     Parameters
     ----------
     raw_file : str
@@ -37,21 +46,121 @@ def read_lris(raw_file, det=None, TRIM=False):
     Returns
     -------
     array : ndarray
-      Combined image 
+      Combined image (C-contiguous, with the spectral direction along the first axis)
     header : FITS header
     sections : list
       List of datasec, oscansec, ampsec sections
     """
 
-    # Check for file; allow for extra .gz, etc. suffix
-    fil = glob.glob(raw_file+'*') 
+    # Read
+    fil = lris_filename(raw_file)
+    msgs.info("Reading LRIS file: {:s}".format(fil))
+    hdu = pyfits.open(fil)
+    head0 = hdu[0].header
+    layout = lris_layout(hdu, det=det, TRIM=TRIM)
+
+    # allocate output array (in Python indexing)...
+    array = np.zeros(layout['shape'])
+
+    # insert extensions into master image...
+    for amp in layout['amps']:
+        temp = hdu[amp['ext']].data
+        for src, dst in amp['copy']:
+            sub = temp[src]
+            # flip in X and Y as needed...
+            if amp['yflip']:
+                sub = sub[::-1, :]
+            if dst[2]:
+                sub = sub[:, ::-1]
+            array[dst[0], dst[1]] = sub
+    hdu.close()
+
+    # make sure BZERO is a valid integer for IRAF
+    obzero = head0['BZERO']
+    head0['O_BZERO'] = obzero
+    head0['BZERO'] = 32768-obzero
+
+    # Return
+    return array, head0, layout['sections']
+
+
+def lris_filename(raw_file):
+    """
+    Find a raw LRIS file; allow for extra .gz, etc. suffix
+
+    Parameters
+    ----------
+    raw_file : str
+      Filename
+
+    Returns
+    -------
+    filename : str
+      The name of the file on disk
+    """
+    if os.path.isfile(raw_file):
+        return raw_file
+    fil = glob.glob(raw_file+'*')
     if len(fil) != 1:
-        msgs.error("Found {:d} files matching {:s}".format(len(fil)))
+        msgs.error("Found {:d} files matching {:s}".format(len(fil), raw_file))
+    return fil[0]
 
-    # Read
-    msgs.info("Reading LRIS file: {:s}".format(fil[0]))
-    hdu = pyfits.open(fil[0])
+
+def read_lris_layout(raw_file, det=None, TRIM=False):
+    """
+    Determine the layout of a raw LRIS mosaic without reading the data
+
+    Parameters
+    ----------
+    raw_file : str
+      Filename
+    det : int, optional
+      Detector number; Default = both
+    TRIM : bool, optional
+      Trim the image?
+
+    Returns
+    -------
+    layout : dict
+      See lris_layout
+    """
+    with pyfits.open(lris_filename(raw_file)) as hdu:
+        layout = lris_layout(hdu, det=det, TRIM=TRIM)
+    return layout
+
+
+def lris_layout(hdu, det=None, TRIM=False):
+    """
+    Determine the layout of a raw LRIS mosaic from its headers.
+    The layout is cached, and only needs to be determined once
+    for each configuration (binning, detector, and the geometry
+    of the extensions).
+
+    Parameters
+    ----------
+    hdu : HDUList
+      The raw LRIS file (only the headers are used)
+    det : int, optional
+      Detector number; Default = both
+    TRIM : bool, optional
+      Trim the image?
+
+    Returns
+    -------
+    layout : dict
+      shape -- the shape of the combined image (in Python indexing)
+      amps -- the extension of each amplifier and the sections of the
+              raw data that are copied into the combined image
+      sections -- List of datasec, oscansec sections
+    """
     head0 = hdu[0].header
+    n_ext = len(hdu)-1  # Number of extensions (usually 4)
+    geometry = [(hdu[i].header['DETSEC'], hdu[i].header.get('DATASEC'),
+                 hdu[i].header['NAXIS1'], hdu[i].header['NAXIS2']) for i in range(1, n_ext+1)]
+    key = (head0['BINNING'], head0['PRECOL'], head0['POSTPIX'], head0['PRELINE'],
+           head0['POSTLINE'], det, TRIM, tuple(geometry))
+    if key in _lris_layouts:
+        return _lris_layouts[key]
 
     # Get post, pre-pix values
     precol = head0['PRECOL']
@@ -68,15 +177,13 @@ def read_lris(raw_file, det=None, TRIM=False):
     xbin, ybin = [int(ibin) for ibin in binning.split(',')]
 
     # First read over the header info to determine the size of the output array...
-    n_ext = len(hdu)-1  # Number of extensions (usually 4)
     xcol = []
     xmax = 0
     ymax = 0
     xmin = 10000
     ymin = 10000
-    for i in np.arange(1, n_ext+1):
-        theader = hdu[i].header
-        detsec = theader['DETSEC']
+    for i in range(n_ext):
+        detsec = geometry[i][0]
         if detsec != '0':
             # parse the DETSEC keyword to determine the size of the array.
             x1, x2, y1, y2 = np.array(load_sections(detsec, fmt_iraf=False)).flatten()
@@ -113,9 +220,7 @@ def read_lris(raw_file, det=None, TRIM=False):
         nx = nx // 2
         n_ext = n_ext // 2
         det_idx = np.arange(n_ext, dtype=np.int) + (det-1)*n_ext
-        ndet = 1
     elif det is None:
-        ndet = 2
         det_idx = np.arange(n_ext).astype(int)
     else:
         raise ValueError('Bad value for det')
@@ -125,91 +230,64 @@ def read_lris(raw_file, det=None, TRIM=False):
         nx += n_ext*(precol+postpix)
         ny += preline + postline
 
-    # allocate output array...
-    array = np.zeros( (nx, ny) )
     order = np.argsort(np.array(xcol))
 
-
-    # insert extensions into master image...
+    # The raw data of each extension have shape (ny, nx). The sections of
+    # each amplifier (see lris_read_amp) are copied into the combined image
+    # in the same (Python) orientation.
+    amps = []
     for kk, i in enumerate(order[det_idx]):
-
-        # grab complete extension...
-        data, predata, postdata, x1, y1 = lris_read_amp(hdu, i+1)
-                            #, linebias=linebias, nobias=nobias, $
-                            #x1=x1, x2=x2, y1=y1, y2=y2, gaindata=gaindata)
-        # insert components into output array...
+        nxt, nydata = geometry[i][2], geometry[i][3]
+        # parse the DETSEC keyword to determine the location of the amplifier.
+        x1, x2, y1, y2 = np.array(load_sections(geometry[i][0], fmt_iraf=False)).flatten()
+        # parse the DATASEC keyword to determine the size of the science region (unbinned)
+        xdata1, xdata2, ydata1, ydata2 = np.array(load_sections(geometry[i][1], fmt_iraf=False)).flatten()
+        if (xdata1-1) != precol:
+            msgs.error("Something wrong in LRIS datasec or precol")
+        xshape = 1024 // xbin
+        if (xshape+precol+postpix) != nxt:
+            msgs.error("Wrong size for in LRIS detector somewhere.  Funny binning?")
+        nxdata = xshape
+        # flip in X as needed (data only)...
+        xflip = x1 > x2
+        x1 = min(x1, x2)
+        # flip in Y as needed...
+        yflip = y1 > y2
+        y1 = min(y1, y2)
+        amp = dict({'ext': i+1, 'yflip': yflip, 'copy': []})
         if not TRIM:
             # insert predata...
-            buf = predata.shape
-            nxpre = buf[0]
             xs = kk*precol
-            xe = xs + nxpre
-            '''
-            if keyword_set(VERBOSITY) then begin
-                section = '['+stringify(xs)+':'+stringify(xe)+',*]'
-                message, 'inserting extension '+stringify(i)+ $
-                         ' predata  in '+section, /info
-            endif 
-            '''
-            array[xs:xe, :] = predata
-
+            amp['copy'].append(((slice(None), slice(0, precol)), (slice(None), slice(xs, xs+precol), False)))
             # insert data...
-            buf = data.shape
-            nxdata = buf[0]
-            nydata = buf[1]
-            xs = n_ext*precol + kk*nxdata #(x1-xmin)/xbin
+            xs = n_ext*precol + kk*nxdata
             xe = xs + nxdata
             # Data section
             section = '[{:d}:{:d},{:d}:{:d}]'.format(preline,nydata-postline, xs, xe)  # Eliminate lines
             dsec.append(section)
-            #print('data',xs,xe)
-            array[xs:xe, :] = data   # Include postlines
-
-            #; insert postdata...
-            buf = postdata.shape
-            nxpost = buf[0]
+            amp['copy'].append(((slice(None), slice(precol, precol+xshape)), (slice(None), slice(xs, xe), xflip)))  # Include postlines
+            # insert postdata...
             xs = nx - n_ext*postpix + kk*postpix
-            xe = xs + nxpost 
+            xe = xs + postpix
             section = '[:,{:d}:{:d}]'.format(xs, xe)
             osec.append(section)
-            '''
-            if keyword_set(VERBOSITY) then begin
-                section = '['+stringify(xs)+':'+stringify(xe)+',*]'
-                message, 'inserting extension '+stringify(i)+ $
-                         ' postdata in '+section, /info
-            endif 
-            '''
-            array[xs:xe, :] = postdata
+            amp['copy'].append(((slice(None), slice(nxt-postpix, nxt)), (slice(None), slice(xs, xe), False)))
         else:
-            buf = data.shape
-            nxdata = buf[0]
-            nydata = buf[1]
-
             xs = (x1-xmin)//xbin
-            xe = xs + nxdata 
+            xe = xs + nxdata
             ys = (y1-ymin)//ybin
             ye = ys + nydata - postline
-
             yin1 = preline
-            yin2 = nydata - postline 
-
-            '''
-            if keyword_set(VERBOSITY) then begin
-                section = '['+stringify(xs)+':'+stringify(xe)+ $
-                          ','+stringify(ys)+':'+stringify(ye)+']'
-                message, 'inserting extension '+stringify(i)+ $
-                         ' data     in '+section, /info
-            endif 
-            '''
-            array[xs:xe, ys:ye] = data[:, yin1:yin2]
-
-    # make sure BZERO is a valid integer for IRAF
-    obzero = head0['BZERO']
-    head0['O_BZERO'] = obzero
-    head0['BZERO'] = 32768-obzero
-
-    # Return, transposing array back to goofy Python indexing
-    return array.T, head0, (dsec, osec)
+            yin2 = nydata - postline
+            if yflip:
+                # The rows are selected after the flip in Y
+                yin1, yin2 = nydata-yin2, nydata-yin1
+            amp['copy'].append(((slice(yin1, yin2), slice(precol, precol+xshape)), (slice(ys, ye), slice(xs, xe), xflip)))
+        amps.append(amp)
+
+    layout = dict({'shape': (ny, nx), 'amps': amps, 'sections': (dsec, osec)})
+    _lris_layouts[key] = layout
+    return layout
 
 
 def lris_read_amp(inp, ext):
@@ -157,6 +157,39 @@ def SetupScience(fitsdict):
     return sciexp, setup_dict
 
 
+def StackScience(sciexp, fitsdict, setup_dict):
+    """ Group the science exposures of each target that were taken
+    with the same setup (on all detectors)
+
+    The exposures of a group may be dithered, so they are registered
+    with each science frame before they are compared (see
+    arproc.stack_register).
+
+    Parameters
+    ----------
+    sciexp : list
+      A list containing all science exposure classes
+    fitsdict : dict
+      Contains relevant information from fits header files
+    setup_dict : dict
+
+    Returns
+    -------
+    stacks : list
+      For each science exposure, the indices of all science exposures
+      of the same target and setup (including itself)
+    """
+    keys = []
+    for slf in sciexp:
+        setups = [arsort.instr_setup(slf, kk+1, fitsdict, setup_dict, must_exist=True)
+                  for kk in range(settings.spect['mosaic']['ndet'])]
+        keys.append((slf._target_name, tuple(setups)))
+    stacks = []
+    for sc in range(len(sciexp)):
+        stacks.append([sciexp[i]._idx_sci[0] for i in range(len(sciexp)) if keys[i] == keys[sc]])
+    return stacks
+
+
 def UpdateMasters(sciexp, sc, det, ftype=None, chktype=None):
     """ Update the master calibrations for other science targets
 
@@ -64,6 +64,12 @@ def ARMLSD(fitsdict, reuseMaster=False, reloadMaster=True):
     # Masters
     #settings.argflag['reduce']['masters']['file'] = setup_file
 
+    # Group the exposures of each target, to identify cosmic rays
+    if settings.argflag['reduce']['cosmics']['method'] == 'stack':
+        stacks = armbase.StackScience(sciexp, fitsdict, setup_dict)
+        # The exposures of each group are loaded once per detector, and kept until its last member is reduced
+        stkframes = dict({})
+
     # Start reducing the data
     for sc in range(numsci):
         slf = sciexp[sc]
@@ -202,13 +208,31 @@ def ARMLSD(fitsdict, reuseMaster=False, reloadMaster=True):
             ###############
             # Load the science frame and from this generate a Poisson error frame
             msgs.info("Loading science frame")
-            sciframe = arload.load_frames(fitsdict, [scidx], det,
-                                          frametype='science',
-                                          msbias=slf._msbias[det-1])
-            sciframe = sciframe[:, :, 0]
+            stack, stkidx = None, None
+            if settings.argflag['reduce']['cosmics']['method'] == 'stack':
+                if len(stacks[sc]) >= 3:
+                    # Load all exposures of this target and setup to identify cosmic rays
+                    stkidx = stacks[sc]
+                    stkkey = (tuple(stkidx), det)
+                    if stkkey not in stkframes:
+                        stkframes[stkkey] = arload.load_frames(fitsdict, stkidx, det,
+                                                               frametype='science',
+                                                               msbias=slf._msbias[det-1])
+                    stack = stkframes[stkkey]
+                    if sc == max([i for i in range(numsci) if stacks[i] == stkidx]):
+                        del stkframes[stkkey]
+                    sciframe = stack[:, :, stkidx.index(scidx)].astype(np.float)
+                else:
+                    msgs.warn("At least 3 exposures of the same target and setup are needed to" + msgs.newline() +
+                              "identify cosmic rays with the stack method. Using L.A.Cosmic")
+            if stack is None:
+                sciframe = arload.load_frames(fitsdict, [scidx], det,
+                                              frametype='science',
+                                              msbias=slf._msbias[det-1])
+                sciframe = sciframe[:, :, 0]
             # Extract
             msgs.info("Processing science frame")
-            arproc.reduce_multislit(slf, sciframe, scidx, fitsdict, det)
+            arproc.reduce_multislit(slf, sciframe, scidx, fitsdict, det, stack=stack, stkidx=stkidx)
 
             ###############
             # Using model sky, calculate a flexure correction
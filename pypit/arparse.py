@@ -380,6 +380,34 @@ class BaseArgFlag(BaseFunctions):
             msgs.error("The list values of argument {0:s} must be >= 0".format(get_current_name()))
         self.update(v)
 
+    def arc_combine_reject_niter(self, v=1):
+        """ Maximum number of iterations used to reject cosmic rays and
+        deviant pixels when combining the arc frames.
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        v = key_int(v)
+        if v < 1:
+            msgs.error("The argument of {0:s} must be >= 1".format(get_current_name()))
+        self.update(v)
+
+    def arc_combine_reject_statistic(self, v='median'):
+        """ What statistic should be used to reject cosmic rays and deviant
+        pixels when combining the arc frames? If median, the standard deviation
+        is estimated from the median absolute deviation.
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        allowed = ['median', 'mean']
+        v = key_allowed(v, allowed)
+        self.update(v)
+
     def arc_combine_reject_replace(self, v='maxnonsat'):
         """ What should be done if all pixels are rejected when
         combining the arc frames?
@@ -405,6 +433,25 @@ class BaseArgFlag(BaseFunctions):
         v = key_allowed(v, allowed)
         self.update(v)
 
+    def arc_combine_weights(self, v='uniform'):
+        """ How should the arc frames be weighted when they are combined?
+        The options are: uniform, exptime (exposure time), sn (S/N squared),
+        or a list with one weight for each frame, in the format: [w1,w2,...].
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        if v.startswith('[') or v.startswith('('):
+            v = key_list(v)
+            if any([not isinstance(w, (int, float)) or w < 0.0 for w in v]):
+                msgs.error("The list values of argument {0:s} must be >= 0".format(get_current_name()))
+        else:
+            allowed = combine_weights()
+            v = key_allowed(v, allowed)
+        self.update(v)
+
     def arc_extract_binby(self, v=1.0):
         """ Binning factor to use when extracting 1D arc spectrum. A value of
         1 means that no binning will be performed. This argument does not need
@@ -601,6 +648,34 @@ class BaseArgFlag(BaseFunctions):
             msgs.error("The list values of argument {0:s} must be >= 0".format(get_current_name()))
         self.update(v)
 
+    def bias_combine_reject_niter(self, v=1):
+        """ Maximum number of iterations used to reject cosmic rays and
+        deviant pixels when combining the bias frames.
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        v = key_int(v)
+        if v < 1:
+            msgs.error("The argument of {0:s} must be >= 1".format(get_current_name()))
+        self.update(v)
+
+    def bias_combine_reject_statistic(self, v='median'):
+        """ What statistic should be used to reject cosmic rays and deviant
+        pixels when combining the bias frames? If median, the standard deviation
+        is estimated from the median absolute deviation.
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        allowed = ['median', 'mean']
+        v = key_allowed(v, allowed)
+        self.update(v)
+
     def bias_combine_reject_replace(self, v):
         """ What should be done if all pixels are rejected when
         combining the bias frames?
@@ -626,6 +701,25 @@ class BaseArgFlag(BaseFunctions):
         v = key_allowed(v, allowed)
         self.update(v)
 
+    def bias_combine_weights(self, v='uniform'):
+        """ How should the bias frames be weighted when they are combined?
+        The options are: uniform, exptime (exposure time), sn (S/N squared),
+        or a list with one weight for each frame, in the format: [w1,w2,...].
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        if v.startswith('[') or v.startswith('('):
+            v = key_list(v)
+            if any([not isinstance(w, (int, float)) or w < 0.0 for w in v]):
+                msgs.error("The list values of argument {0:s} must be >= 0".format(get_current_name()))
+        else:
+            allowed = combine_weights()
+            v = key_allowed(v, allowed)
+        self.update(v)
+
     '''
     def bias_useoverscan(self, v):
         """ Subtract the bias level using the overscan region?
@@ -797,6 +891,34 @@ class BaseArgFlag(BaseFunctions):
             msgs.error("The list values of argument {0:s} must be >= 0".format(get_current_name()))
         self.update(v)
 
+    def pinhole_combine_reject_niter(self, v=1):
+        """ Maximum number of iterations used to reject cosmic rays and
+        deviant pixels when combining the pinhole frames.
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        v = key_int(v)
+        if v < 1:
+            msgs.error("The argument of {0:s} must be >= 1".format(get_current_name()))
+        self.update(v)
+
+    def pinhole_combine_reject_statistic(self, v='median'):
+        """ What statistic should be used to reject cosmic rays and deviant
+        pixels when combining the pinhole frames? If median, the standard deviation
+        is estimated from the median absolute deviation.
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        allowed = ['median', 'mean']
+        v = key_allowed(v, allowed)
+        self.update(v)
+
     def pinhole_combine_reject_replace(self, v):
         """ What should be done if all pixels are rejected when
         combining the pinhole frames?
@@ -822,6 +944,25 @@ class BaseArgFlag(BaseFunctions):
         v = key_allowed(v, allowed)
         self.update(v)
 
+    def pinhole_combine_weights(self, v='uniform'):
+        """ How should the pinhole frames be weighted when they are combined?
+        The options are: uniform, exptime (exposure time), sn (S/N squared),
+        or a list with one weight for each frame, in the format: [w1,w2,...].
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        if v.startswith('[') or v.startswith('('):
+            v = key_list(v)
+            if any([not isinstance(w, (int, float)) or w < 0.0 for w in v]):
+                msgs.error("The list values of argument {0:s} must be >= 0".format(get_current_name()))
+        else:
+            allowed = combine_weights()
+            v = key_allowed(v, allowed)
+        self.update(v)
+
     def pinhole_useframe(self, v):
         """ What filetype should be used to identify the slit edges?
         you can also specify a master calibrations file if it exists.
@@ -906,6 +1047,34 @@ class BaseArgFlag(BaseFunctions):
             msgs.error("The list values of argument {0:s} must be >= 0".format(get_current_name()))
         self.update(v)
 
+    def pixelflat_combine_reject_niter(self, v=1):
+        """ Maximum number of iterations used to reject cosmic rays and
+        deviant pixels when combining the pixel flat frames.
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        v = key_int(v)
+        if v < 1:
+            msgs.error("The argument of {0:s} must be >= 1".format(get_current_name()))
+        self.update(v)
+
+    def pixelflat_combine_reject_statistic(self, v='median'):
+        """ What statistic should be used to reject cosmic rays and deviant
+        pixels when combining the pixel flat frames? If median, the standard deviation
+        is estimated from the median absolute deviation.
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        allowed = ['median', 'mean']
+        v = key_allowed(v, allowed)
+        self.update(v)
+
     def pixelflat_combine_reject_replace(self, v):
         """ What should be done if all pixels are rejected when
         combining the pixel flat frames?
@@ -932,6 +1101,25 @@ class BaseArgFlag(BaseFunctions):
         self.update(v)
 
 
+    def pixelflat_combine_weights(self, v='uniform'):
+        """ How should the pixel flat frames be weighted when they are combined?
+        The options are: uniform, exptime (exposure time), sn (S/N squared),
+        or a list with one weight for each frame, in the format: [w1,w2,...].
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        if v.startswith('[') or v.startswith('('):
+            v = key_list(v)
+            if any([not isinstance(w, (int, float)) or w < 0.0 for w in v]):
+                msgs.error("The list values of argument {0:s} must be >= 0".format(get_current_name()))
+        else:
+            allowed = combine_weights()
+            v = key_allowed(v, allowed)
+        self.update(v)
+
     def pixelflat_useframe(self, v):
         """ What filetype should be used for pixel-to-pixel calibration (flat),
         you can also specify a master calibrations file if it exists.
@@ -996,6 +1184,54 @@ class BaseArgFlag(BaseFunctions):
         v = key_allowed(v, allowed)
         self.update(v)
 
+    def reduce_cosmics_dtype(self, v):
+        """ Data type used to identify cosmic rays with the L.A.Cosmic
+        algorithm (float32, float64). Using float32 is faster, and halves
+        the memory required.
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        allowed = ['float32', 'float64']
+        v = key_allowed(v, allowed)
+        self.update(v)
+
+    def reduce_cosmics_method(self, v):
+        """ Method used to identify cosmic rays in a science frame. With
+        'stack', a frame is compared to the other exposures of the same
+        target that were taken with the same setup (at least 3 exposures
+        are required), and L.A.Cosmic is only used for the pixels that
+        cannot be resolved by the exposures (lacosmic, stack)
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        allowed = ['lacosmic', 'stack']
+        v = key_allowed(v, allowed)
+        self.update(v)
+
+    def reduce_cosmics_nrows(self, v):
+        """ Number of rows of each block of a frame that is searched for
+        cosmic rays at once. The blocks are processed in parallel when
+        more than one CPU is used. If None, the entire frame is processed
+        at once.
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        v = key_none(v)
+        if v is not None:
+            v = key_int(v)
+            if v <= 0:
+                msgs.error("The argument of {0:s} must be >= 1 or 'None'".format(get_current_name()))
+        self.update(v)
+
     def reduce_detnum(self, v):
         """ Reduce only the input detector of the array
 
@@ -1317,6 +1553,75 @@ class BaseArgFlag(BaseFunctions):
         """
         self.update(v)
 
+    def run_framecube_blocksize(self, v):
+        """ Maximum size (in MB) of each block of rows of a stack of frames
+        that is combined at once. If None, the entire stack is combined at once.
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        v = key_none(v)
+        if v is not None:
+            v = key_float(v)
+            if v <= 0.0:
+                msgs.error("The argument of {0:s} must be > 0 or 'None'".format(get_current_name()))
+        self.update(v)
+
+    def run_framecube_directory(self, v):
+        """ Directory used to store the disk-backed (memory-mapped) cubes
+        of raw frames. If None, the system temporary directory is used.
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        v = key_none(v)
+        if v is not None and not pathexists(v):
+            msgs.error("The argument of {0:s} must be an existing directory or 'None'".format(get_current_name()) +
+                       msgs.newline() + "The following directory does not exist:" + msgs.newline() + v)
+        self.update(v)
+
+    def run_framecube_dtype(self, v):
+        """ Data type used to store stacks of raw frames (float32, float64).
+        Using float32 halves the memory required to combine frames.
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        allowed = ['float32', 'float64']
+        v = key_allowed(v, allowed)
+        self.update(v)
+
+    def run_framecube_memmap(self, v):
+        """ If True, stacks of raw frames are stored in a disk-backed
+        (memory-mapped) cube, rather than in memory.
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        v = key_bool(v)
+        self.update(v)
+
+    def run_headercache(self, v):
+        """ Name of a file used to cache the header information of the raw
+        files, so that the headers of a file are only read again if the file
+        has changed. If None, the headers are not cached.
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        v = key_none(v)
+        self.update(v)
+
     def run_load_settings(self, v):
         """ Load a reduction settings file (Note: this command overwrites all default settings)
 
@@ -1351,6 +1656,22 @@ class BaseArgFlag(BaseFunctions):
                         msgs.newline() + "file or 'None'. The following file does not exist:" + msgs.newline() + v)
         self.update(v)
 
+    def run_maxopen(self, v):
+        """ Maximum number of files whose headers are read at the same time.
+        If None, the number of CPUs set by 'run ncpus' is used.
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        v = key_none(v)
+        if v is not None:
+            v = key_int(v)
+            if v <= 0:
+                msgs.error("The argument of {0:s} must be >= 1 or 'None'".format(get_current_name()))
+        self.update(v)
+
     def run_ncpus(self, v):
         """ Number of CPUs to use (-1 means all bar one CPU available,
         -2 means all bar two CPUs available)
@@ -1399,6 +1720,19 @@ class BaseArgFlag(BaseFunctions):
                         msgs.info("Setting {0:d} CPUs".format(v))
         self.update(v)
 
+    def run_pool(self, v):
+        """ Type of worker pool used by the parallel steps of the reduction
+        when more than one CPU is available (thread, process)
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        allowed = ['thread', 'process']
+        v = key_allowed(v, allowed)
+        self.update(v)
+
     def run_preponly(self, v):
         """ If True, PYPIT will prepare the calibration frames and will
         only reduce the science frames when preponly is set to False
@@ -1693,6 +2027,34 @@ class BaseArgFlag(BaseFunctions):
             msgs.error("The list values of argument {0:s} must be > 0.0".format(get_current_name()))
         self.update(v)
 
+    def trace_combine_reject_niter(self, v=1):
+        """ Maximum number of iterations used to reject cosmic rays and
+        deviant pixels when combining the trace frames.
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        v = key_int(v)
+        if v < 1:
+            msgs.error("The argument of {0:s} must be >= 1".format(get_current_name()))
+        self.update(v)
+
+    def trace_combine_reject_statistic(self, v='median'):
+        """ What statistic should be used to reject cosmic rays and deviant
+        pixels when combining the trace frames? If median, the standard deviation
+        is estimated from the median absolute deviation.
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        allowed = ['median', 'mean']
+        v = key_allowed(v, allowed)
+        self.update(v)
+
     def trace_combine_reject_replace(self, v):
         """ What should be done if all pixels are rejected when
         combining the trace frames?
@@ -1718,6 +2080,25 @@ class BaseArgFlag(BaseFunctions):
         v = key_allowed(v, allowed)
         self.update(v)
 
+    def trace_combine_weights(self, v='uniform'):
+        """ How should the trace frames be weighted when they are combined?
+        The options are: uniform, exptime (exposure time), sn (S/N squared),
+        or a list with one weight for each frame, in the format: [w1,w2,...].
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        if v.startswith('[') or v.startswith('('):
+            v = key_list(v)
+            if any([not isinstance(w, (int, float)) or w < 0.0 for w in v]):
+                msgs.error("The list values of argument {0:s} must be >= 0".format(get_current_name()))
+        else:
+            allowed = combine_weights()
+            v = key_allowed(v, allowed)
+        self.update(v)
+
     def trace_dispersion_direction(self, v):
         """ Specify the primary dispersion direction of the raw data (0 for row, 1 for column)
 
@@ -1782,6 +2163,20 @@ class BaseArgFlag(BaseFunctions):
             msgs.error("The argument of {0:s} must be >= 0".format(get_current_name()))
         self.update(v)
 
+    def trace_object_retrace(self, v):
+        """ How should the objects be traced after the sky background has been
+        finalized? Either trace them again from scratch (full), or refine the
+        centroids of the objects found in the first pass (refine)
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        allowed = ['full', 'refine']
+        v = key_allowed(v, allowed)
+        self.update(v)
+
     def trace_object_xedge(self, v):
         """ How close to the edge can one find an object?
 
@@ -3078,6 +3473,17 @@ class BaseSpect(BaseFunctions):
         v = key_keyword(v)
         self.update(v)
 
+    def keyword_wavelen(self, v):
+        """ Central wavelength of the disperser
+
+        Parameters
+        ----------
+        v : str
+          value of the keyword argument given by the name of this function
+        """
+        v = key_keyword(v)
+        self.update(v)
+
     def mosaic_camera(self, v):
         """ Set the name of the instrument used (this will be used in the QA).
 
@@ -3869,6 +4275,25 @@ def get_dnum(det, caps=False, prefix=True):
     return dnum
 
 
+def get_ncpus(ntask):
+    """ Number of CPUs to use for a parallel step with ntask independent tasks
+
+    Parameters
+    ----------
+    ntask : int
+      Number of independent tasks
+
+    Returns
+    -------
+    ncpus : int
+      The smaller of ntask and the number of CPUs set by 'run ncpus' (at least 1)
+    """
+    ncpus = argflag['run']['ncpus']
+    if not isinstance(ncpus, int):
+        ncpus = 1
+    return int(max(1, min(ncpus, ntask)))
+
+
 def check_deprecated(v, deprecated, upper=False):
     """ Check if a keyword argument is deprecated.
 
@@ -4323,6 +4748,13 @@ def combine_satpixs():
     return methods
 
 
+def combine_weights():
+    """ The options that can be used to weight the frames when combining a set of frames
+    """
+    methods = ['uniform', 'exptime', 'sn']
+    return methods
+
+
 def is_keyword(v):
     """ Check if a value is of the format required to be a call to a header keyword
 
@@ -1,8 +1,9 @@
 from __future__ import (print_function, absolute_import, division, unicode_literals)
 
+import warnings
+from functools import partial
 import numpy as np
 from scipy.signal import savgol_filter
-import scipy.signal as signal
 import scipy.ndimage as ndimage
 import scipy.interpolate as interp
 from matplotlib import pyplot as plt
@@ -22,6 +23,11 @@ from pypit import ardebug as debugger
 # Logging
 msgs = armsgs.get_logger()
 
+# Cache of the slices of the data and overscan sections (see section_plan)
+_section_plans = dict({})
+# Cache of the detector geometry of LRIS (see get_datasec_trimmed)
+_lris_geometry = dict({})
+
 
 def background_subtraction(slf, sciframe, varframe, slitn, det, refine=0.0):
     """ Generate a frame containing the background sky spectrum
@@ -56,7 +62,7 @@ def background_subtraction(slf, sciframe, varframe, slitn, det, refine=0.0):
       number of pixels from the right slit edge to use as background pixels
     """
     # Obtain all pixels that are within the slit edges, and are not masked
-    word = np.where((slf._slitpix[det - 1] == slitn + 1) & (slf._scimask[det - 1] == 0))
+    word = slf.GetSlitPixels(det, slitn, unmasked=True)
     if word[0].size == 0:
         msgs.warn("There are no pixels in slit {0:d}".format(slitn))
         debugger.set_trace()
@@ -118,11 +124,9 @@ def background_subtraction(slf, sciframe, varframe, slitn, det, refine=0.0):
         srt = np.argsort(tilts[wbgpix])
         ivar = arutils.calc_ivar(varframe)
         # Perform a weighted b-spline fit to the sky background pixels
-        mask, bspl = arutils.robust_polyfit(tilts[wbgpix][srt], sciframe[wbgpix][srt], 3, function='bspline',
-                                            weights=np.sqrt(ivar)[wbgpix][srt], sigma=5.,
-                                            maxone=False, **settings.argflag['reduce']['skysub']['bspline'])
-        bgf_flat = arutils.func_val(bspl, tilts.flatten(), 'bspline')
-        bgframe = bgf_flat.reshape(tilts.shape)
+        mask, bspl = arutils.bspline_iterfit(tilts[wbgpix][srt], sciframe[wbgpix][srt], ivar=ivar[wbgpix][srt],
+                                             sigma=5., **settings.argflag['reduce']['skysub']['bspline'])
+        bgframe = arutils.bspline_val(bspl, tilts)
         if msgs._debug['sky_sub']:
             def plt_bspline_sky(tilts, scifrcp, bgf_flat):
                 # Setup
@@ -134,7 +138,7 @@ def background_subtraction(slf, sciframe, varframe, slitn, det, refine=0.0):
                 ax.scatter(tilts[gdp]*tilts.shape[0], scifrcp[gdp], marker='o')
                 ax.plot(tilts.flatten()[srt]*tilts.shape[0], bgf_flat[srt], 'r-')
                 plt.show()
-            plt_bspline_sky(tilts, sciframe, bgf_flat)
+            plt_bspline_sky(tilts, sciframe, bgframe.flatten())
             debugger.set_trace()
     else:
         msgs.error('Not ready for this method for skysub {:s}'.format(
@@ -146,6 +150,70 @@ def background_subtraction(slf, sciframe, varframe, slitn, det, refine=0.0):
     return bgframe, nl, nr
 
 
+def bg_reject_bins(sxvpix, sscipix, edges, rejsigma=3.0):
+    """ Reject the pixels that deviate from the sky level in each bin
+    of the spectral coordinate (i.e. the pixels containing the science
+    target). All bins are processed at once, with the same result as a
+    zeroth order arutils.robust_polyfit (maxone=True) of each bin with
+    more than 5 pixels.
+
+    Parameters
+    ----------
+    sxvpix : ndarray
+      Sorted spectral coordinate (tilts) of the pixels
+    sscipix : ndarray
+      Counts of the pixels (in the same order as sxvpix)
+    edges : ndarray
+      Edges of the bins. The pixels on an edge belong to both adjacent bins
+      (the mask of the latter bin is kept)
+    rejsigma : float, optional
+      Rejection threshold (in units of the robust standard deviation)
+
+    Returns
+    -------
+    maskpix : ndarray
+      Mask of the rejected pixels (1=rejected)
+    fitcls : ndarray
+      The sky level of each bin (the average of the 7 middle unrejected pixels)
+    """
+    maskpix = np.zeros(sxvpix.size)
+    fitcls = np.zeros(edges.size)
+    # The pixels of each bin
+    lo = np.searchsorted(sxvpix, edges[:-1], side='left')
+    nbin = np.searchsorted(sxvpix, edges[1:], side='right') - lo
+    fit = np.where(nbin > 5)[0]
+    if fit.size == 0:
+        return maskpix, fitcls
+    # Gather the bins into rows of an array, padded with NaN
+    nfit, ncol = fit.size, np.max(nbin[fit])
+    cols = np.arange(ncol)
+    valid = cols[np.newaxis, :] < nbin[fit][:, np.newaxis]
+    index = np.where(valid, lo[fit][:, np.newaxis] + cols[np.newaxis, :], 0)
+    yval = np.where(valid, sscipix[index], np.nan)
+    mask = np.zeros(yval.shape, dtype=np.bool)
+    # Each iteration rejects the most deviant pixel of the bins that
+    # rejected a pixel in the previous iteration
+    active = np.arange(nfit)
+    while active.size != 0:
+        ngood = nbin[fit][active] - np.sum(mask[active], axis=1)
+        yact = np.where(mask[active], np.nan, yval[active])
+        ydev = np.abs(yact - np.nanmean(yact, axis=1)[:, np.newaxis])
+        sigmed = 1.4826*np.nanmedian(ydev, axis=1)
+        imax = np.nanargmax(ydev, axis=1)
+        rej = (ngood > 2) & (ydev[np.arange(active.size), imax] > rejsigma*sigmed)
+        mask[active[rej], imax[rej]] = True
+        active = active[rej]
+    maskpix[index[valid]] = mask[valid]
+    # Sky level: average the 7 middle unrejected pixels, if there are more than 8
+    good = valid & ~mask
+    szt = np.sum(good, axis=1)
+    order = np.argsort(~good, axis=1, kind='mergesort')
+    mid = np.clip(szt[:, np.newaxis]//2 + np.arange(-3, 4)[np.newaxis, :], 0, ncol-1)
+    midval = np.mean(yval[np.arange(nfit)[:, np.newaxis], order[np.arange(nfit)[:, np.newaxis], mid]], axis=1)
+    fitcls[fit] = np.where(szt > 8, midval, np.nanmean(np.where(good, yval, np.nan), axis=1))
+    return maskpix, fitcls
+
+
 def badpix(det, frame, sigdev=10.0):
     """
     frame is a master bias frame
@@ -179,141 +247,58 @@ def badpix(det, frame, sigdev=10.0):
 def bg_subtraction(slf, det, sciframe, varframe, crpix, tracemask=None,
                    rejsigma=3.0, maskval=-999999.9):
     """ Extract a science target and background flux
+
+    The sky background is modelled independently in each slit (see
+    bg_subtraction_slit), and the slits are processed in parallel by
+    a pool of processes if more than one CPU is used.
+
     :param slf:
     :param sciframe:
     :param varframe:
     :return:
     """
-    from pypit import arcyutils
-    from pypit import arcyproc
     # Set some starting parameters (maybe make these available to the user)
     msgs.work("Should these parameters be made available to the user?")
-    polyorder, repeat = 5, 1
-    # Begin the algorithm
-    errframe = np.sqrt(varframe)
-    # Find which pixels are within the order edges
-    msgs.info("Identifying pixels within each order")
-    ordpix = arcyutils.order_pixels(slf._pixlocn[det-1],
-                                    slf._lordloc[det-1]*0.95+slf._rordloc[det-1]*0.05,
-                                    slf._lordloc[det-1]*0.05+slf._rordloc[det-1]*0.95)
-    msgs.info("Applying bad pixel mask")
-    ordpix *= (1-slf._bpix[det-1].astype(np.int)) * (1-crpix.astype(np.int))
-    if tracemask is not None: ordpix *= (1-tracemask.astype(np.int))
-    # Construct an array of pixels to be fit with a spline
-    msgs.bug("Remember to include the following in a loop over order number")
-    #whord = np.where(ordpix != 0)
-    o = 0 # order=1
-    whord = np.where(ordpix == o+1)
-    tilts = slf._tilts[det-1].copy()
-    xvpix  = tilts[whord]
-    scipix = sciframe[whord]
-    varpix = varframe[whord]
-    xargsrt = np.argsort(xvpix, kind='mergesort')
-    sxvpix  = xvpix[xargsrt]
-    sscipix = scipix[xargsrt]
-    svarpix = varpix[xargsrt]
-    # Reject deviant pixels -- step through every 1.0/sciframe.shape[0] in sxvpix and reject significantly deviant pixels
-    edges = np.linspace(min(0.0,np.min(sxvpix)),max(1.0,np.max(sxvpix)),sciframe.shape[0])
-    fitcls = np.zeros(sciframe.shape[0])
-    #if tracemask is None:
-    if True:
-        maskpix = np.zeros(sxvpix.size)
-        msgs.info("Identifying pixels containing the science target")
-        msgs.work("Speed up this step in cython")
-        for i in range(sciframe.shape[0]-1):
-            wpix = np.where((sxvpix>=edges[i]) & (sxvpix<=edges[i+1]))
-            if (wpix[0].size>5):
-                txpix = sxvpix[wpix]
-                typix = sscipix[wpix]
-                msk, cf = arutils.robust_polyfit(txpix, typix, 0, sigma=rejsigma)
-                maskpix[wpix] = msk
-                #fitcls[i] = cf[0]
-                wgd=np.where(msk == 0)
-                szt = np.size(wgd[0])
-                if szt > 8:
-                    fitcls[i] = np.mean(typix[wgd][szt//2-3:szt//2+4]) # Average the 7 middle pixels
-                    #fitcls[i] = np.mean(np.random.shuffle(typix[wgd])[:5]) # Average the 5 random pixels
-                else:
-                    fitcls[i] = cf[0]
-    else:
-        msgs.work("Speed up this step in cython")
-        for i in range(sciframe.shape[0]-1):
-            wpix = np.where((sxvpix >= edges[i]) & (sxvpix <= edges[i+1]))
-            typix = sscipix[wpix]
-            szt = typix.size
-            if szt > 8:
-                fitcls[i] = np.mean(typix[szt//2-3:szt//2+4])  # Average the 7 middle pixels
-            elif szt != 0:
-                fitcls[i] = np.mean(typix)
-            else:
-                fitcls[i] = 0.0
-        # Trace the sky lines to get a better estimate of the tilts
-        scicopy = sciframe.copy()
-        scicopy[np.where(ordpix == 0)] = maskval
-        scitilts, _ = artrace.model_tilt(slf, det, scicopy, guesstilts=tilts.copy(), censpec=fitcls, maskval=maskval, plotQA=True)
-        xvpix  = scitilts[whord]
-        scipix = sciframe[whord]
-        varpix = varframe[whord]
-        mskpix = tracemask[whord]
-        xargsrt = np.argsort(xvpix, kind='mergesort')
-        sxvpix  = xvpix[xargsrt]
-        sscipix = scipix[xargsrt]
-        svarpix = varpix[xargsrt]
-        maskpix = mskpix[xargsrt]
-    # Check the mask is reasonable
-    scimask = sciframe.copy()
-    rxargsrt = np.argsort(xargsrt, kind='mergesort')
-    scimask[whord] *= (1.0-maskpix)[rxargsrt]
-    #arutils.ds9plot(scimask)
-    # Now trace the sky lines to get a better estimate of the spectral tilt during the observations
-    scifrcp = scimask.copy()
-    scifrcp[whord] += (maskval*maskpix)[rxargsrt]
-    scifrcp[np.where(ordpix == 0)] = maskval
-    # Check tilts? -- Can also be error in flat fielding or slit illumination
-    if msgs._debug['sky_sub']:
-        gdp = scifrcp != maskval
-        #debugger.xplot(tilts[gdp]*tilts.shape[0], scifrcp[gdp], scatter=True)
-        idx = 1893
-        if True:
-            plt.clf()
-            ax = plt.gca()
-            ax.scatter(tilts[idx-2,:], scifrcp[idx-2,:], color='green')
-            ax.scatter(tilts[idx-1,:], scifrcp[idx-1,:], color='blue')
-            ax.scatter(tilts[idx,:], scifrcp[idx,:], color='red')
-            ax.scatter(tilts[idx+1,:], scifrcp[idx+1,:], color='orange')
-            ax.set_ylim(0., 3000)
-            plt.show()
-            debugger.set_trace()
-    #
-    msgs.info("Fitting sky background spectrum")
-    if settings.argflag['reduce']['skysub']['method'].lower() == 'bspline':
-        msgs.info("Using bspline sky subtraction")
-        gdp = scifrcp != maskval
-        srt = np.argsort(tilts[gdp])
-        #bspl = arutils.func_fit(tilts[gdp][srt], scifrcp[gdp][srt], 'bspline', 3,
-        #                        **settings.argflag['reduce']['skysub']['bspline'])
-        ivar = arutils.calc_ivar(varframe)
-        mask, bspl = arutils.robust_polyfit(tilts[gdp][srt], scifrcp[gdp][srt], 3, function='bspline',
-                                            weights=np.sqrt(ivar)[gdp][srt], sigma=5.,
-                                            maxone=False, **settings.argflag['reduce']['skysub']['bspline'])
-        bgf_flat = arutils.func_val(bspl, tilts.flatten(), 'bspline')
-        bgframe = bgf_flat.reshape(tilts.shape)
-        if msgs._debug['sky_sub']:
-            def plt_bspline_sky(tilts, scifrcp, bgf_flat, maskval):
-                # Setup
-                srt = np.argsort(tilts.flatten())
-                # Plot
-                plt.close()
-                plt.clf()
-                ax = plt.gca()
-                ax.scatter(tilts[gdp]*tilts.shape[0], scifrcp[gdp], marker='o')
-                ax.plot(tilts.flatten()[srt]*tilts.shape[0], bgf_flat[srt], 'r-')
-                plt.show()
-            plt_bspline_sky(tilts, scifrcp, bgf_flat, maskval)
-            debugger.set_trace()
-    else:
+    if settings.argflag['reduce']['skysub']['method'].lower() != 'bspline':
         msgs.error('Not ready for this method for skysub {:s}'.format(
                 settings.argflag['reduce']['skysub']['method'].lower()))
+    msgs.info("Applying bad pixel mask")
+    badpix = (slf._bpix[det-1] != 0) | (crpix != 0)
+    if tracemask is not None:
+        badpix |= (tracemask != 0)
+    # Crop the frames around each slit
+    msgs.info("Identifying pixels within each slit")
+    tilts = slf._tilts[det-1]
+    ivar = arutils.calc_ivar(varframe)
+    # Only the inner 90 percent of each slit is used to fit the sky background
+    lordloc = slf._lordloc[det-1]*0.95 + slf._rordloc[det-1]*0.05
+    rordloc = slf._lordloc[det-1]*0.05 + slf._rordloc[det-1]*0.95
+    crops, slits = [], []
+    for o in range(slf._lordloc[det-1].shape[1]):
+        crop = slf.GetSlitCrop(det, o)
+        inslit = slf._slitpix[det-1][crop] == o+1
+        if not np.any(inslit):
+            msgs.warn("There are no pixels in slit {0:d}".format(o+1))
+            continue
+        spatpix = slf._pixlocn[det-1][crop][:, :, 1]
+        gdpix = inslit & ~badpix[crop] & \
+            (spatpix > lordloc[crop[0], o][:, np.newaxis]) & (spatpix < rordloc[crop[0], o][:, np.newaxis])
+        if np.sum(gdpix) <= 5:
+            msgs.warn("Not enough pixels to model the sky background in slit {0:d}".format(o+1))
+            continue
+        crops.append(crop)
+        slits.append((tilts[crop], sciframe[crop], ivar[crop], gdpix, inslit))
+    # Model the sky background of each slit
+    msgs.info("Fitting sky background spectrum")
+    msgs.info("Using bspline sky subtraction")
+    fitter = partial(bg_subtraction_slit, nspec=sciframe.shape[0], rejsigma=rejsigma,
+                     bspline=settings.argflag['reduce']['skysub']['bspline'])
+    bgframe = np.zeros_like(sciframe)
+    ncpus = settings.get_ncpus(len(slits))
+    if ncpus > 1:
+        msgs.info("Fitting the sky background of {0:d} slits with {1:d} CPUs".format(len(slits), ncpus))
+    for crop, slit, bgslit in zip(crops, slits, arutils.mp_imap(fitter, slits, ncpus, pool='process')):
+        bgframe[crop][slit[4]] = bgslit[slit[4]]
     if np.sum(np.isnan(bgframe)) > 0:
         msgs.warn("NAN in bgframe.  Replacing with 0")
         bad = np.isnan(bgframe)
@@ -327,6 +312,50 @@ def bg_subtraction(slf, det, sciframe, varframe, crpix, tracemask=None,
     return bgframe
 
 
+def bg_subtraction_slit(slit, nspec, rejsigma=3.0, bspline=None):
+    """ Model the sky background of a slit
+
+    This function is called by bg_subtraction for each slit.
+
+    Parameters
+    ----------
+    slit : tuple
+      The tilts, science frame, inverse variance, the pixels used to
+      fit the sky background, and the pixels of the slit, cropped
+      around the slit
+    nspec : int
+      Number of spectral pixels of the detector (the number of bins
+      used to reject the pixels containing the science target)
+    rejsigma : float, optional
+      Rejection threshold of the pixels containing the science target
+    bspline : dict, optional
+      Parameters of the bspline fit
+
+    Returns
+    -------
+    bgframe : ndarray
+      The sky background of the pixels of the slit (zero elsewhere)
+    """
+    tilts, sciframe, ivar, gdpix, inslit = slit
+    if bspline is None:
+        bspline = dict({})
+    # Reject deviant pixels -- step through every 1.0/nspec in the sorted tilts and reject significantly deviant pixels
+    xvpix = tilts[gdpix]
+    xargsrt = np.argsort(xvpix, kind='mergesort')
+    sxvpix = xvpix[xargsrt]
+    edges = np.linspace(min(0.0, np.min(sxvpix)), max(1.0, np.max(sxvpix)), nspec)
+    maskpix, fitcls = bg_reject_bins(sxvpix, sciframe[gdpix][xargsrt], edges, rejsigma=rejsigma)
+    # Perform a weighted b-spline fit to the remaining pixels
+    fitpix = gdpix.copy()
+    fitpix[gdpix] = maskpix[np.argsort(xargsrt, kind='mergesort')] == 0
+    srt = np.argsort(tilts[fitpix])
+    mask, bspl = arutils.bspline_iterfit(tilts[fitpix][srt], sciframe[fitpix][srt], ivar=ivar[fitpix][srt],
+                                         sigma=5., **bspline)
+    bgframe = np.zeros_like(sciframe)
+    bgframe[inslit] = arutils.bspline_val(bspl, tilts[inslit])
+    return bgframe
+
+
 def error_frame_postext(sciframe, idx, fitsdict):
     # Dark Current noise
     dnoise = settings.spect['det']['darkcurr'] * float(fitsdict["exptime"][idx])/3600.0
@@ -461,9 +490,8 @@ def flatnorm(slf, det, msflat, maskval=-999999.9, overpix=6, plotdesc=""):
             if np.where(gdp)[0].size < 2*everyn:
                 msgs.warn("Not enough pixels in slit {0:d} to fit a bspline")
                 continue
-            bspl = arutils.func_fit(tilts[gdp][srt], msflat[gdp][srt], 'bspline', 3, everyn=everyn)
-            model_flat = arutils.func_val(bspl, tilts.flatten(), 'bspline')
-            model = model_flat.reshape(tilts.shape)
+            mask, bspl = arutils.bspline_iterfit(tilts[gdp][srt], msflat[gdp][srt], everyn=everyn, maxiter=0)
+            model = arutils.bspline_val(bspl, tilts)
             word = np.where(ordpix == o + 1)
             msnormflat[word] = msflat[word] / model[word]
             msblaze[:, o] = arutils.func_val(bspl, np.linspace(0.0, 1.0, msflat.shape[0]), 'bspline')
@@ -505,22 +533,34 @@ def get_ampscale(slf, det, msflat):
       A frame to scale all amplifiers to the same counts at the amplifier borders
     """
     dnum = settings.get_dnum(det)
+    numamp = settings.spect[dnum]['numamplifiers']
+    datasec = slf._datasec[det-1]
+    # List the pairs of adjacent pixels that belong to different amplifiers (once for all amplifier pairs)
+    bound = []
+    for axis in range(2):
+        if axis == 0:
+            lo, hi = datasec[:-1, :], datasec[1:, :]
+        else:
+            lo, hi = datasec[:, :-1], datasec[:, 1:]
+        w = np.where(lo != hi)
+        bound.append((w, lo[w], hi[w]))
+
+    def tstval(vals, a, b):
+        # Label the pixels of amplifier a with 1, amplifier b with 2 and all others with 0
+        return (vals == a+1).astype(np.int) + 2*(vals == b+1)
 
     sclframe = np.ones_like(msflat)
-    ampdone = np.zeros(settings.spect[dnum]['numamplifiers'], dtype=int) # 1 = amplifiers have been assigned a scale
+    ampdone = np.zeros(numamp, dtype=int) # 1 = amplifiers have been assigned a scale
     ampdone[0]=1
-    while np.sum(ampdone) != settings.spect[dnum]['numamplifiers']:
+    while np.sum(ampdone) != numamp:
         abst, bbst, nbst, n0bst, n1bst = -1, -1, -1, -1, -1 # Reset the values for the most overlapping amplifier
-        for a in range(0, settings.spect[dnum]['numamplifiers']): # amplifier 'a' is always the reference amplifier
+        for a in range(0, numamp): # amplifier 'a' is always the reference amplifier
             if ampdone[a] == 0: continue
-            for b in range(0, settings.spect[dnum]['numamplifiers']):
+            for b in range(0, numamp):
                 if ampdone[b] == 1 or a == b: continue
-                tstframe = np.zeros_like(msflat)
-                tstframe[np.where(slf._datasec[det-1] == a+1)] = 1
-                tstframe[np.where(slf._datasec[det-1] == b+1)] = 2
                 # Determine the total number of adjacent edges between amplifiers a and b
-                n0 = np.sum(tstframe[1:,:]-tstframe[:-1,:])
-                n1 = np.sum(tstframe[:,1:]-tstframe[:,:-1])
+                n0 = np.sum(tstval(bound[0][2], a, b) - tstval(bound[0][1], a, b))
+                n1 = np.sum(tstval(bound[1][2], a, b) - tstval(bound[1][1], a, b))
                 if (abs(n0)+abs(n1)) > nbst:
                     n0bst = n0
                     n1bst = n1
@@ -528,12 +568,11 @@ def get_ampscale(slf, det, msflat):
                     abst = a
                     bbst = b
         # Determine the scaling factor for these two amplifiers
-        tstframe = np.zeros_like(msflat)
-        tstframe[np.where(slf._datasec[det-1] == abst+1)] = 1
-        tstframe[np.where(slf._datasec[det-1] == bbst+1)] = 2
         if abs(n0bst) > abs(n1bst):
             # The amplifiers overlap on the zeroth index
-            w = np.where(tstframe[1:,:]-tstframe[:-1,:] != 0)
+            w, lo, hi = bound[0]
+            edge = tstval(hi, abst, bbst) != tstval(lo, abst, bbst)
+            w = (w[0][edge], w[1][edge])
             sclval = np.median(msflat[w[0][0]+1, w[1]])/np.median(msflat[w[0][0], w[1]])
             # msflat[w[0][0], w[1][0:50]] = 1.0E10
             # msflat[w[0][0]-1, w[1][0:50]] = -1.0E10
@@ -546,7 +585,9 @@ def get_ampscale(slf, det, msflat):
                 sclval = sclframe[w[0][0]+1, w[1]] / sclval
         else:
             # The amplifiers overlap on the first index
-            w = np.where(tstframe[:,1:]-tstframe[:,:-1] != 0)
+            w, lo, hi = bound[1]
+            edge = tstval(hi, abst, bbst) != tstval(lo, abst, bbst)
+            w = (w[0][edge], w[1][edge])
             sclval = np.median(msflat[w[0], w[1][0]+1]/msflat[w[0], w[1][0]])
             if n1bst > 0:
                 # Then pixel w[1][0] falls on amplifier a
@@ -555,8 +596,7 @@ def get_ampscale(slf, det, msflat):
                 # pixel w[1][0] falls on amplifier b
                 sclval = sclframe[w[0], w[1][0]+1] / sclval
         # Finally, apply the scale factor thwe amplifier b
-        w = np.where(slf._datasec[det-1] == bbst+1)
-        sclframe[w] = np.median(sclval)
+        sclframe[datasec == bbst+1] = np.median(sclval)
         ampdone[bbst] = 1
     return sclframe
 
@@ -566,6 +606,10 @@ def get_datasec_trimmed(slf, fitsdict, det, scidx):
      Generate a frame that identifies each pixel to an amplifier, and then trim it to the data sections.
      This frame can be used to later identify which trimmed pixels correspond to which amplifier
 
+     For LRIS, the size of the frame and the data/overscan sections are determined
+     from the headers of the science frame (the pixel data are not read), and are
+     cached for each spectrograph, binning and detector.
+
     Parameters
     ----------
     slf : class
@@ -585,50 +629,41 @@ def get_datasec_trimmed(slf, fitsdict, det, scidx):
     dnum = settings.get_dnum(det)
 
     # Get naxis0, naxis1, datasec, oscansec, ampsec for specific instruments
+    geometry = None
     if settings.argflag['run']['spectrograph'] in ['keck_lris_blue', 'keck_lris_red']:
-        msgs.info("Parsing datasec and oscansec from headers")
-        temp, head0, secs = arlris.read_lris(fitsdict['directory'][scidx]+
-                                             fitsdict['filename'][scidx],
-                                             det)
+        key = (settings.argflag['run']['spectrograph'], fitsdict['binning'][scidx], det)
+        if key not in _lris_geometry:
+            msgs.info("Parsing datasec and oscansec from headers")
+            layout = arlris.read_lris_layout(fitsdict['directory'][scidx]+
+                                             fitsdict['filename'][scidx], det)
+            _lris_geometry[key] = dict({'shape': layout['shape'], 'sections': layout['sections'],
+                                        'datasec': None})
+        geometry = _lris_geometry[key]
+        secs = geometry['sections']
         # Naxis
-        fitsdict['naxis0'][scidx] = temp.shape[0]
-        fitsdict['naxis1'][scidx] = temp.shape[1]
+        fitsdict['naxis0'][scidx] = geometry['shape'][0]
+        fitsdict['naxis1'][scidx] = geometry['shape'][1]
         # Loop on amplifiers
         for kk in range(settings.spect[dnum]['numamplifiers']):
             datasec = "datasec{0:02d}".format(kk+1)
             settings.spect[dnum][datasec] = settings.load_sections(secs[0][kk], fmt_iraf=False)
             oscansec = "oscansec{0:02d}".format(kk+1)
             settings.spect[dnum][oscansec] = settings.load_sections(secs[1][kk], fmt_iraf=False)
+        if geometry['datasec'] is not None:
+            slf._datasec[det-1] = geometry['datasec'].copy()
+            return
     # For convenience
     naxis0, naxis1 = int(fitsdict['naxis0'][scidx]), int(fitsdict['naxis1'][scidx])
     # Initialize the returned array
     retarr = np.zeros((naxis0, naxis1))
+    plan = section_plan(det, retarr.shape)
     for i in range(settings.spect[dnum]['numamplifiers']):
-        datasec = "datasec{0:02d}".format(i+1)
-        x0, x1 = settings.spect[dnum][datasec][0][0], settings.spect[dnum][datasec][0][1]
-        y0, y1 = settings.spect[dnum][datasec][1][0], settings.spect[dnum][datasec][1][1]
-        if x0 < 0: x0 += naxis0
-        if x1 <= 0: x1 += naxis0
-        if y0 < 0: y0 += naxis1
-        if y1 <= 0: y1 += naxis1
         # Fill in the pixels for this amplifier
-        xv = np.arange(x0, x1)
-        yv = np.arange(y0, y1)
-        w = np.ix_(xv, yv)
-        try:
-            retarr[w] = i+1
-        except IndexError:
-            debugger.set_trace()
-        # Save these locations for trimming
-        if i == 0:
-            xfin = xv.copy()
-            yfin = yv.copy()
-        else:
-            xfin = np.unique(np.append(xfin, xv.copy()))
-            yfin = np.unique(np.append(yfin, yv.copy()))
-    # Construct and array with the rows and columns to be extracted
-    w = np.ix_(xfin, yfin)
-    slf._datasec[det-1] = retarr[w]
+        retarr[plan['datasec'][i]] = i+1
+    # Extract the data sections
+    slf._datasec[det-1] = retarr[plan['trim']].copy()
+    if geometry is not None:
+        geometry['datasec'] = slf._datasec[det-1].copy()
     return
 
 
@@ -684,7 +719,7 @@ def object_profile(slf, sciframe, slitn, det, refine=0.0, factor=3):
       object profile
     """
     # Obtain the indices of the pixels that are in slit number 'slitn', and are not masked
-    word = np.where((slf._slitpix[det - 1] == slitn + 1) & (slf._scimask[det - 1] == 0))
+    word = slf.GetSlitPixels(det, slitn, unmasked=True)
     if word[0].size == 0:
         msgs.warn("There are no pixels in slit {0:d}".format(slitn))
         return None, None
@@ -715,7 +750,7 @@ def object_profile(slf, sciframe, slitn, det, refine=0.0, factor=3):
     return xedges, profile
 
 
-def reduce_prepare(slf, sciframe, scidx, fitsdict, det, standard=False):
+def reduce_prepare(slf, sciframe, scidx, fitsdict, det, standard=False, stack=None, stkidx=None):
     """ Prepare the Run standard extraction steps on a frame
 
     Parameters
@@ -730,6 +765,14 @@ def reduce_prepare(slf, sciframe, scidx, fitsdict, det, standard=False):
       Detector index
     standard : bool, optional
       Standard star frame?
+    stack : ndarray, optional
+      Bias subtracted exposures of the same target and setup (including
+      the science frame), used to identify cosmic rays (see stack_cosmics).
+      The exposures that are not registered with the science frame are
+      discarded (see stack_register), and L.A.Cosmic is used if fewer
+      than 3 exposures remain.
+    stkidx : list, optional
+      Indices of the exposures in stack
     """
     # Check inputs
     if not isinstance(scidx, (int,np.integer)):
@@ -760,8 +803,28 @@ def reduce_prepare(slf, sciframe, scidx, fitsdict, det, standard=False):
     ###############
     # Identify cosmic rays
     msgs.work("Include L.A.Cosmic arguments in the settings files")
-    if True: crmask = lacosmic(slf, fitsdict, det, sciframe, scidx, grow=1.5)
-    else: crmask = np.zeros(sciframe.shape)
+    if stack is not None:
+        # Discard the exposures that are offset from the science frame
+        registered = stack_register(slf, det, stack, stkidx, scidx)
+        if np.sum(registered) < 3:
+            msgs.warn("Fewer than 3 exposures are registered with the science frame. Using L.A.Cosmic")
+            stack = None
+        elif not np.all(registered):
+            stack = stack[:, :, registered]
+            stkidx = [idx for idx, reg in zip(stkidx, registered) if reg]
+    if stack is not None:
+        crmask, unresolved = stack_cosmics(slf, fitsdict, det, stack, stkidx, scidx, grow=1.5)
+        if np.any(unresolved):
+            # Use L.A.Cosmic for the pixels that the exposures cannot resolve
+            msgs.info("Using L.A.Cosmic for {0:d} unresolved pixels".format(np.sum(unresolved)))
+            lamask = lacosmic(slf, fitsdict, det, sciframe, scidx, grow=1.5, pixmask=unresolved)
+            # Keep the cosmic rays (and their growth) that touch an unresolved pixel
+            lalabels, nlabels = ndimage.label(lamask)
+            keep = np.unique(lalabels[unresolved & (lamask != 0)])
+            crmask |= np.in1d(lalabels, keep[keep > 0]).reshape(lamask.shape)
+        crmask = crmask.astype(np.float)
+    else:
+        crmask = lacosmic(slf, fitsdict, det, sciframe, scidx, grow=1.5)
     # Mask
     slf.update_sci_pixmask(det, crmask, 'CR')
     return sciframe, rawvarframe, crmask
@@ -799,7 +862,7 @@ def reduce_echelle(slf, sciframe, scidx, fitsdict, det,
     if settings.argflag['reduce']['skysub']['perform']:
         # Identify background pixels, and generate an image of the sky spectrum in each slit
         for o in range(nord):
-            word = np.where((slf._slitpix[det - 1] == o + 1) & (slf._scimask[det - 1] == 0))
+            word = slf.GetSlitPixels(det, o, unmasked=True)
             if word[0].size == 0:
                 msgs.warn("There are no pixels in slit {0:d}".format(o+1))
                 continue
@@ -896,16 +959,15 @@ def reduce_echelle(slf, sciframe, scidx, fitsdict, det,
     trobjr *= (slf._rordloc[det - 1] - slf._lordloc[det - 1])
     trobjr += slf._lordloc[det - 1]
 
-    # Generate an image of pixel weights for each object. Each weight can
-    # take any floating point value from 0 to 1 (inclusive). For the rec_obj_img,
+    # Generate the apertures of pixel weights for each object. Each weight can
+    # take any floating point value from 0 to 1 (inclusive). For the object apertures,
     # a weight of 1 means that the pixel is fully contained within the object
     # region, and 0 means that the pixel is fully contained within the background
-    # region. The opposite is true for the rec_bg_img array. A pixel that is on
+    # region. The opposite is true for the background apertures. A pixel that is on
     # the border of object/background is assigned a value between 0 and 1.
     msgs.work("Eventually allow ARMED to find multiple objects in the one slit")
     nobj = 1
-    rec_obj_img = np.zeros(sciframe.shape+(nobj,))
-    rec_bg_img = np.zeros(sciframe.shape+(nobj,))
+    scitrace = None
     for o in range(nord):
         # Prepare object/background regions
         objl = np.array([bgnl[o]])
@@ -918,15 +980,9 @@ def reduce_echelle(slf, sciframe, scidx, fitsdict, det,
         tobj_img, tbg_img = artrace.trace_objbg_image(slf, det, sciframe-bgframe, o,
                                                       [objl, objr], [bckl, bckr],
                                                       triml=triml, trimr=trimr)
-        rec_obj_img += tobj_img
-        rec_bg_img += tbg_img
-
-    # Create trace dict
-    scitrace = artrace.trace_object_dict(nobj, trccen[:, 0].reshape(trccen.shape[0], 1),
-                                         object=rec_obj_img, background=rec_bg_img)
-    for o in range(1, nord):
+        # Create trace dict
         scitrace = artrace.trace_object_dict(nobj, trccen[:, o].reshape(trccen.shape[0], 1),
-                                             tracelist=scitrace)
+                                             object=tobj_img, background=tbg_img, tracelist=scitrace)
 
     # Save the quality control
     if not msgs._debug['no_qa']:
@@ -949,7 +1005,7 @@ def reduce_echelle(slf, sciframe, scidx, fitsdict, det,
                         scitrace=scitrace, standard=standard)
 
 
-def reduce_multislit(slf, sciframe, scidx, fitsdict, det, standard=False):
+def reduce_multislit(slf, sciframe, scidx, fitsdict, det, standard=False, stack=None, stkidx=None):
     """ Run standard extraction steps on an echelle frame
 
     Parameters
@@ -964,8 +1020,14 @@ def reduce_multislit(slf, sciframe, scidx, fitsdict, det, standard=False):
       Detector index
     standard : bool, optional
       Standard star frame?
+    stack : ndarray, optional
+      Bias subtracted exposures of the same target and setup, used to
+      identify cosmic rays (see reduce_prepare)
+    stkidx : list, optional
+      Indices of the exposures in stack
     """
-    sciframe, rawvarframe, crmask = reduce_prepare(slf, sciframe, scidx, fitsdict, det, standard=standard)
+    sciframe, rawvarframe, crmask = reduce_prepare(slf, sciframe, scidx, fitsdict, det, standard=standard,
+                                                   stack=stack, stkidx=stkidx)
 
     ###############
     # Estimate Sky Background
@@ -991,8 +1053,8 @@ def reduce_multislit(slf, sciframe, scidx, fitsdict, det, standard=False):
 
     ###############
     # Find objects and estimate their traces
-    scitrace = artrace.trace_object(slf, det, sciframe-bgframe, modelvarframe, crmask,
-                                    bgreg=20, doqa=False, standard=standard)
+    scitrace = artrace.trace_objects(slf, det, sciframe-bgframe, modelvarframe, crmask,
+                                     bgreg=20, doqa=False, standard=standard)
     if scitrace is None:
         msgs.info("Not performing extraction for science frame"+msgs.newline()+fitsdict['filename'][scidx[0]])
         debugger.set_trace()
@@ -1015,11 +1077,15 @@ def reduce_multislit(slf, sciframe, scidx, fitsdict, det, standard=False):
         # Create a trace mask of the object
         trcmask = np.zeros_like(sciframe)
         for sl in range(len(scitrace)):
-            trcmask += scitrace[sl]['object'].sum(axis=2)
+            if scitrace[sl]['object'] is None:
+                continue
+            for aperture in scitrace[sl]['object']:
+                crop = artrace.aperture_crop(aperture)
+                trcmask[crop] += artrace.aperture_image(aperture, crop)
         trcmask[np.where(trcmask > 0.0)] = 1.0
         bgframe = bg_subtraction(slf, det, sciframe, modelvarframe, crmask, tracemask=trcmask)
-        # Redetermine the variance frame based on the new sky model
-        modelvarframe = variance_frame(slf, det, sciframe, scidx, fitsdict, skyframe=bgframe)
+        # Redetermine the variance frame based on the new sky model (overwriting the previous model)
+        modelvarframe = variance_frame(slf, det, sciframe, scidx, fitsdict, skyframe=bgframe, out=modelvarframe)
         # Save
         if not standard:
             slf._modelvarframe[det-1] = modelvarframe
@@ -1032,9 +1098,18 @@ def reduce_multislit(slf, sciframe, scidx, fitsdict, det, standard=False):
         #if not msgs._debug['no_qa']:
         arqa.flexure(slf, det, flex_dict, slit_cen=True)
 
+    ###############
+    # Refine the object traces found before the sky background was finalized
+    if settings.argflag['trace']['object']['retrace'] == 'refine':
+        msgs.info("Refining the object traces")
+        scitrace = artrace.refine_objects(slf, det, sciframe-bgframe, scitrace, doqa=(not standard))
+    else:
+        scitrace = None
+
     # Perform an optimal extraction
     msgs.work("For now, perform extraction -- really should do this after the flexure+heliocentric correction")
-    return reduce_frame(slf, sciframe, rawvarframe, modelvarframe, bgframe, scidx, fitsdict, det, crmask, standard=standard)
+    return reduce_frame(slf, sciframe, rawvarframe, modelvarframe, bgframe, scidx, fitsdict, det, crmask,
+                        scitrace=scitrace, standard=standard)
 
 
 def reduce_frame(slf, sciframe, rawvarframe, modelvarframe, bgframe, scidx, fitsdict, det, crmask,
@@ -1067,8 +1142,8 @@ def reduce_frame(slf, sciframe, rawvarframe, modelvarframe, bgframe, scidx, fits
     # Determine the final trace of the science objects
     if scitrace is None:
         msgs.info("Performing final object trace")
-        scitrace = artrace.trace_object(slf, det, sciframe-bgframe, modelvarframe, crmask,
-                                        bgreg=20, doqa=(not standard), standard=standard)
+        scitrace = artrace.trace_objects(slf, det, sciframe-bgframe, modelvarframe, crmask,
+                                         bgreg=20, doqa=(not standard), standard=standard)
     if standard:
         slf._msstd[det-1]['trace'] = scitrace
         specobjs = arspecobj.init_exp(slf, scidx, det, fitsdict, scitrace, objtype='standard')
@@ -1140,6 +1215,12 @@ def reduce_frame(slf, sciframe, rawvarframe, modelvarframe, bgframe, scidx, fits
 def slit_pixels(slf, frameshape, det):
     """ Generate an image indicating the slit associated with each pixel.
 
+    The left and right edges of all slits are rasterized in a single
+    pass: in each row, the pixels of a slit are a span of columns (padded
+    by settings.argflag['trace']['slits']['pad']), and the spans are
+    filled with a cumulative sum. When the spans of two slits overlap,
+    the pixels are assigned to the last slit.
+
     Parameters
     ----------
     slf : class
@@ -1152,23 +1233,43 @@ def slit_pixels(slf, frameshape, det):
     Returns
     -------
     msordloc : ndarray
-      An image assigning each pixel to a slit number. A zero value indicates
-      that this pixel does not belong to any slit.
+      An integer image assigning each pixel to a slit number. A zero value
+      indicates that this pixel does not belong to any slit.
     """
-
-    from pypit import arcytrace
+    nrow, ncol = frameshape
     nslits = slf._lordloc[det - 1].shape[1]
-    msordloc = np.zeros(frameshape)
-    for o in range(nslits):
-        lordloc = slf._lordloc[det - 1][:, o]
-        rordloc = slf._rordloc[det - 1][:, o]
-        ordloc = arcytrace.locate_order(lordloc, rordloc, frameshape[0], frameshape[1],
-                                        settings.argflag['trace']['slits']['pad'])
-        word = np.where(ordloc != 0)
-        if word[0].size == 0:
-            msgs.warn("There are no pixels in slit {0:d}".format(o + 1))
-            continue
-        msordloc[word] = o + 1
+    pad = settings.argflag['trace']['slits']['pad']
+    dtype = np.int16 if nslits < np.iinfo(np.int16).max else np.int32
+    # The span of columns of each slit in each row (as in arcytrace.locate_order,
+    # the last column of the frame is not included)
+    ow = 0.5*(slf._rordloc[det - 1][:nrow, :] - slf._lordloc[det - 1][:nrow, :])
+    oc = 0.5*(slf._rordloc[det - 1][:nrow, :] + slf._lordloc[det - 1][:nrow, :])
+    lo = np.clip(np.trunc(oc-ow).astype(np.int) - pad, 0, ncol-1)
+    hi = np.clip(np.trunc(oc+ow).astype(np.int) + 1 + pad, None, ncol-1)
+    hi = np.maximum(hi, lo)
+    for o in np.where(np.all(hi == lo, axis=0))[0]:
+        msgs.warn("There are no pixels in slit {0:d}".format(o + 1))
+    # Rows where the spans of several slits overlap
+    srt = np.argsort(lo, axis=1, kind='mergesort')
+    rows = np.arange(lo.shape[0])[:, np.newaxis]
+    slo, shi = lo[rows, srt], hi[rows, srt]
+    nonempty = shi > slo
+    overlap = np.zeros(lo.shape[0], dtype=np.bool)
+    for k in range(1, nslits):
+        # Compare each span with the furthest right end of the previous spans
+        prevhi = np.max(np.where(nonempty[:, :k], shi[:, :k], 0), axis=1)
+        overlap |= nonempty[:, k] & (slo[:, k] < prevhi)
+    # Fill the spans of the rows without overlaps
+    label = np.arange(1, nslits+1)[np.newaxis, :].repeat(lo.shape[0], axis=0)
+    label[overlap, :] = 0
+    spans = np.zeros((nrow, ncol+1), dtype=np.int)
+    np.add.at(spans, (rows.repeat(nslits, axis=1), lo), label)
+    np.add.at(spans, (rows.repeat(nslits, axis=1), hi), -label)
+    msordloc = np.cumsum(spans[:, :ncol], axis=1).astype(dtype)
+    # Fill the rows with overlaps one slit at a time
+    for x in np.where(overlap)[0]:
+        for o in range(nslits):
+            msordloc[x, lo[x, o]:hi[x, o]] = o + 1
     return msordloc
 
 
@@ -1233,94 +1334,57 @@ def slit_profile(slf, mstrace, det, ntcky=None):
 
     extrap_slit = np.zeros(nslits, dtype=np.int)
 
-    # Calculate the slit and blaze profiles
-    msgs.work("Multiprocess this step")
+    # Crop the frames around each slit
+    crops, slits, slitnums = [], [], []
     for o in range(nslits):
-        if settings.argflag["reduce"]["slitprofile"]["perform"]:
-            msgs.info("Deriving the spatial profile and blaze function of slit {0:d}".format(o+1))
-        else:
-            msgs.info("Deriving the blaze function of slit {0:d}".format(o + 1))
-        lordloc = slf._lordloc[det - 1][:, o]
-        rordloc = slf._rordloc[det - 1][:, o]
-        word = np.where(slf._slitpix[det - 1] == o+1)
-        if word[0].size <= (ntcky+1)*(2*slf._pixwid[det - 1][o]+1):
+        crop = slf.GetSlitCrop(det, o)
+        inslit = slf._slitpix[det-1][crop] == o+1
+        if np.sum(inslit) <= (ntcky+1)*(2*slf._pixwid[det - 1][o]+1):
             msgs.warn("There are not enough pixels in slit {0:d}".format(o+1))
             extrap_slit[o] = 1.0
             continue
-        spatval = (word[1] - lordloc[word[0]])/(rordloc[word[0]] - lordloc[word[0]])
-        specval = slf._tilts[det-1][word]
-        fluxval = mstrace[word]
+        crops.append(crop)
+        slitnums.append(o)
+        slits.append((slf._tilts[det-1][crop], mstrace[crop], inslit, crop[0].start, crop[1].start,
+                      slf._lordloc[det - 1][:, o], slf._rordloc[det - 1][:, o],
+                      (ntcky+1)*(2*slf._pixwid[det - 1][o]+1)))
 
-        # Only use pixels where at least half the slit is on the chip
-        cordloc = 0.5 * (lordloc[word[0]] + rordloc[word[0]])
-        wcchip = ((cordloc > 0.0) & (cordloc < mstrace.shape[1]-1.0))
-
-        # Derive the blaze function
-        wsp = np.where((spatval > 0.25) & (spatval < 0.75) & wcchip)
-        if wsp[0].size <= (ntcky+1)*(2*slf._pixwid[det - 1][o]+1):
+    # Calculate the slit and blaze profiles
+    if settings.argflag["reduce"]["slitprofile"]["perform"]:
+        msgs.info("Deriving the spatial profile and blaze function of {0:d} slits".format(len(slits)))
+    else:
+        msgs.info("Deriving the blaze function of {0:d} slits".format(len(slits)))
+    fitter = partial(slit_profile_slit, shape=mstrace.shape, ntcky=ntcky, ntckx=ntckx)
+    ncpus = settings.get_ncpus(len(slits))
+    if ncpus > 1:
+        msgs.info("Fitting {0:d} slits with {1:d} CPUs".format(len(slits), ncpus))
+    fits = arutils.mp_imap(fitter, slits, ncpus, pool='process')
+    for o, crop, slit, fit in zip(slitnums, crops, slits, fits):
+        if fit is None:
             msgs.warn("There are not enough pixels in slit {0:d}".format(o+1))
             extrap_slit[o] = 1.0
             continue
-        if (np.min(word[0]) > 0) or (np.max(word[0]) < mstrace.shape[0]-1):
-            extrap_slit[o] = 1.0
-        tcky = np.linspace(min(0.0, np.min(specval[wsp])), max(1.0, np.max(specval[wsp])), ntcky)
-        tcky = tcky[np.where((tcky > np.min(specval[wsp])) & (tcky < np.max(specval[wsp])))]
-        srt = np.argsort(specval[wsp])
-        # Only perform a bspline if there are enough pixels for the specified knots
-        if tcky.size >= 2:
-            yb, ye = min(np.min(specval), tcky[0]), max(np.max(specval), tcky[-1])
-            mask, blzspl = arutils.robust_polyfit(specval[wsp][srt], fluxval[wsp][srt], 3, function='bspline',
-                                                  sigma=5., maxone=False, xmin=yb, xmax=ye,
-                                                  everyn=specval[wsp].size//tcky.size)  # knots=tcky)
-            blz_flat = arutils.func_val(blzspl, specval, 'bspline')
-            msblaze[:, o] = arutils.func_val(blzspl, np.linspace(0.0, 1.0, msblaze.shape[0]), 'bspline')
-        else:
-            mask, blzspl = arutils.robust_polyfit(specval[wsp][srt], fluxval[wsp][srt], 2, function='polynomial',
-                                                  sigma=5., maxone=False)
-            blz_flat = arutils.func_val(blzspl, specval, 'polynomial')
-            msblaze[:, o] = arutils.func_val(blzspl, np.linspace(0.0, 1.0, msblaze.shape[0]), 'polynomial')
+        extrap, msblaze[:, o], modvals, nrmvals = fit
+        if extrap:
             extrap_slit[o] = 1.0
 
         # Extract a spectrum of the trace frame
         xext = np.arange(mstrace.shape[0])
-        yext = np.round(0.5 * (lordloc + rordloc)).astype(np.int)
+        yext = np.round(0.5 * (slit[5] + slit[6])).astype(np.int)
         wcc = np.where((yext > 0) & (yext < mstrace.shape[1] - 1.0))
         blazeext[wcc[0], o] = mstrace[(xext[wcc], yext[wcc],)]
         if wcc[0].size != mstrace.shape[0]:
             extrap_slit[o] = 1.0
 
-        # Calculate the slit profile
-        sprof_fit = fluxval / (blz_flat + (blz_flat == 0.0))
-        wch = np.where(wcchip)
-        tckx = np.linspace(min(0.0, np.min(spatval[wch])), max(1.0, np.max(spatval[wch])), ntckx)
-        tckx = tckx[np.where((tckx > np.min(spatval[wch])) & (tckx < np.max(spatval[wch])))]
-        srt = np.argsort(spatval[wch])
-        # Only perform a bspline if there are enough pixels for the specified knots
-        if tckx.size >= 1:
-            xb, xe = min(np.min(spatval), tckx[0]), max(np.max(spatval), tckx[-1])
-            mask, sltspl = arutils.robust_polyfit(spatval[wch][srt], sprof_fit[wch][srt], 3, function='bspline',
-                                                  sigma=5., maxone=False, xmin=xb, xmax=xe,
-                                                  everyn=spatval[wch].size//tckx.size)  #, knots=tckx)
-            slt_flat = arutils.func_val(sltspl, spatval, 'bspline')
-            sltnrmval = arutils.func_val(sltspl, 0.5, 'bspline')
-        else:
-            mask, sltspl = arutils.robust_polyfit(spatval[srt], sprof_fit[srt], 2, function='polynomial',
-                                                  sigma=5., maxone=False)
-            slt_flat = arutils.func_val(sltspl, spatval, 'polynomial')
-            sltnrmval = arutils.func_val(sltspl, 0.5, 'polynomial')
-            extrap_slit[o] = 1.0
-
-        modvals = blz_flat * slt_flat
-        # Normalize to the value at the centre of the slit
-        nrmvals = blz_flat * sltnrmval
+        inslit = slit[2]
         if settings.argflag["reduce"]["slitprofile"]["perform"]:
             # Leave slit_profiles as ones if the slitprofile is not being determined, otherwise, set the model.
-            slit_profiles[word] = modvals/nrmvals
-        mstracenrm[word] /= nrmvals
+            slit_profiles[crop][inslit] = modvals/nrmvals
+        mstracenrm[crop][inslit] /= nrmvals
         if msgs._debug['slit_profile']:
             debugger.set_trace()
             model = np.zeros_like(mstrace)
-            model[word] = modvals
+            model[crop][inslit] = modvals
             diff = mstrace - model
             import astropy.io.fits as pyfits
             hdu = pyfits.PrimaryHDU(mstrace)
@@ -1334,6 +1398,101 @@ def slit_profile(slf, mstrace, det, ntcky=None):
     return slit_profiles, mstracenrm, msblaze, blazeext, extrap_slit
 
 
+def slit_profile_slit(slit, shape, ntcky, ntckx):
+    """ Fit the blaze function and the spatial profile of a slit
+
+    This function is called by slit_profile for each slit.
+
+    Parameters
+    ----------
+    slit : tuple
+      The tilts, trace frame and the pixels of the slit (cropped around
+      the slit), the first row and column of the crop, the left and
+      right edges of the slit, and the minimum number of pixels needed
+      to fit the blaze function
+    shape : tuple
+      Shape of the (uncropped) trace frame
+    ntcky : int
+      Number of bspline knots in the spectral direction
+    ntckx : int
+      Number of bspline knots in the spatial direction
+
+    Returns
+    -------
+    extrap : bool
+      True if the slit is poorly determined
+    msblaze : ndarray
+      A model of the blaze function of the slit
+    modvals : ndarray
+      The model of the pixels of the slit
+    nrmvals : ndarray
+      The blaze function of the pixels of the slit, normalized to the
+      centre of the slit
+
+    None is returned if there are not enough pixels to fit the slit.
+    """
+    tilts, mstrace, inslit, row0, col0, lordloc, rordloc, minpix = slit
+    extrap = False
+    word = np.where(inslit)
+    rows = word[0] + row0
+    spatval = (word[1] + col0 - lordloc[rows])/(rordloc[rows] - lordloc[rows])
+    specval = tilts[word]
+    fluxval = mstrace[word]
+
+    # Only use pixels where at least half the slit is on the chip
+    cordloc = 0.5 * (lordloc[rows] + rordloc[rows])
+    wcchip = ((cordloc > 0.0) & (cordloc < shape[1]-1.0))
+
+    # Derive the blaze function
+    wsp = np.where((spatval > 0.25) & (spatval < 0.75) & wcchip)
+    if wsp[0].size <= minpix:
+        return None
+    if (np.min(rows) > 0) or (np.max(rows) < shape[0]-1):
+        extrap = True
+    tcky = np.linspace(min(0.0, np.min(specval[wsp])), max(1.0, np.max(specval[wsp])), ntcky)
+    tcky = tcky[np.where((tcky > np.min(specval[wsp])) & (tcky < np.max(specval[wsp])))]
+    srt = np.argsort(specval[wsp])
+    # Only perform a bspline if there are enough pixels for the specified knots
+    if tcky.size >= 2:
+        yb, ye = min(np.min(specval), tcky[0]), max(np.max(specval), tcky[-1])
+        mask, blzspl = arutils.bspline_iterfit(specval[wsp][srt], fluxval[wsp][srt], sigma=5., xmin=yb, xmax=ye,
+                                               everyn=specval[wsp].size//tcky.size)  # knots=tcky)
+        blz_flat = arutils.func_val(blzspl, specval, 'bspline')
+        msblaze = arutils.func_val(blzspl, np.linspace(0.0, 1.0, shape[0]), 'bspline')
+    else:
+        mask, blzspl = arutils.robust_polyfit(specval[wsp][srt], fluxval[wsp][srt], 2, function='polynomial',
+                                              sigma=5., maxone=False)
+        blz_flat = arutils.func_val(blzspl, specval, 'polynomial')
+        msblaze = arutils.func_val(blzspl, np.linspace(0.0, 1.0, shape[0]), 'polynomial')
+        extrap = True
+
+    # Calculate the slit profile
+    sprof_fit = fluxval / (blz_flat + (blz_flat == 0.0))
+    wch = np.where(wcchip)
+    tckx = np.linspace(min(0.0, np.min(spatval[wch])), max(1.0, np.max(spatval[wch])), ntckx)
+    tckx = tckx[np.where((tckx > np.min(spatval[wch])) & (tckx < np.max(spatval[wch])))]
+    srt = np.argsort(spatval[wch])
+    # Only perform a bspline if there are enough pixels for the specified knots
+    if tckx.size >= 1:
+        xb, xe = min(np.min(spatval), tckx[0]), max(np.max(spatval), tckx[-1])
+        mask, sltspl = arutils.bspline_iterfit(spatval[wch][srt], sprof_fit[wch][srt], sigma=5., xmin=xb, xmax=xe,
+                                               everyn=spatval[wch].size//tckx.size)  #, knots=tckx)
+        slt_flat = arutils.func_val(sltspl, spatval, 'bspline')
+        sltnrmval = arutils.func_val(sltspl, 0.5, 'bspline')
+    else:
+        srt = np.argsort(spatval)
+        mask, sltspl = arutils.robust_polyfit(spatval[srt], sprof_fit[srt], 2, function='polynomial',
+                                              sigma=5., maxone=False)
+        slt_flat = arutils.func_val(sltspl, spatval, 'polynomial')
+        sltnrmval = arutils.func_val(sltspl, 0.5, 'polynomial')
+        extrap = True
+
+    modvals = blz_flat * slt_flat
+    # Normalize to the value at the centre of the slit
+    nrmvals = blz_flat * sltnrmval
+    return extrap, msblaze, modvals, nrmvals
+
+
 def slit_profile_pca(slf, mstrace, det, msblaze, extrap_slit, slit_profiles):
     """ Perform a PCA analysis on the spatial slit profile and blaze function.
 
@@ -1477,7 +1636,7 @@ def slit_profile_pca(slf, mstrace, det, msblaze, extrap_slit, slit_profiles):
     # Normalize the trace frame, but don't remove the slit profile
     mstracenrm = mstrace.copy()
     for o in range(nslits):
-        word = np.where(slf._slitpix[det - 1] == o+1)
+        word = slf.GetSlitPixels(det, o)
         specval = slf._tilts[det-1][word]
         blzspl = interp.interp1d(np.linspace(0.0, 1.0, mstrace.shape[0]), extrap_blz[:, o],
                                  kind="linear", fill_value="extrapolate")
@@ -1490,7 +1649,7 @@ def slit_profile_pca(slf, mstrace, det, msblaze, extrap_slit, slit_profiles):
     for o in range(nslits):
         if extrap_slit[o] == 1:
             continue
-        word = np.where(slf._slitpix[det - 1] == o+1)
+        word = slf.GetSlitPixels(det, o)
         spatval = (word[1] + 0.5 - slf._lordloc[det-1][:, o][word[0]]) /\
                   (slf._rordloc[det-1][:, o][word[0]] - slf._lordloc[det-1][:, o][word[0]])
         groups = np.digitize(spatval, spatbins)
@@ -1548,7 +1707,7 @@ def slit_profile_pca(slf, mstrace, det, msblaze, extrap_slit, slit_profiles):
     for o in range(nslits):
         lordloc = slf._lordloc[det - 1][:, o]
         rordloc = slf._rordloc[det - 1][:, o]
-        word = np.where(slf._slitpix[det - 1] == o+1)
+        word = slf.GetSlitPixels(det, o)
         spatval = (word[1] - lordloc[word[0]])/(rordloc[word[0]] - lordloc[word[0]])
 
         sltspl = interp.interp1d(spatfit, extrap_slt[:, o],
@@ -1579,59 +1738,136 @@ def sn_frame(slf, sciframe, idx):
 
 
 def lacosmic(slf, fitsdict, det, sciframe, scidx, maxiter=1, grow=1.5, maskval=-999999.9,
-             simple_var=False):
+             simple_var=False, pixmask=None):
     """
     Identify cosmic rays using the L.A.Cosmic algorithm
     U{http://www.astro.yale.edu/dokkum/lacosmic/}
     (article : U{http://arxiv.org/abs/astro-ph/0108003})
     This routine is mostly courtesy of Malte Tewes
 
+    The frame is searched in blocks of rows (settings.argflag['reduce']['cosmics']['nrows']),
+    in parallel if more than one CPU is used (see lacosmic_block).
+
     :param grow: Once CRs are identified, grow each CR detection by all pixels within this radius
+    :param pixmask: If provided, only the blocks of rows that contain a True pixel of this mask are searched
     :return: mask of cosmic rays (0=no CR, 1=CR)
     """
-    from pypit import arcyutils
-    from pypit import arcyproc
     dnum = settings.get_dnum(det)
 
     msgs.info("Detecting cosmic rays with the L.A.Cosmic algorithm")
     msgs.work("Include these parameters in the settings files to be adjusted by the user")
-    sigclip = 5.0
-    sigfrac = 0.3
-    objlim  = 5.0
-    # Set the settings
-    scicopy = sciframe.copy()
-    crmask = np.cast['bool'](np.zeros(sciframe.shape))
-    sigcliplow = sigclip * sigfrac
+    dtype = np.dtype(settings.argflag['reduce']['cosmics']['dtype'])
+    scicopy = sciframe.astype(dtype)
 
-    # Determine if there are saturated pixels
-    satpix = np.zeros_like(sciframe)
+    # Saturation level
     satlev = settings.spect[dnum]['saturation']*settings.spect[dnum]['nonlinear']
-    wsat = np.where(sciframe >= satlev)
-    if wsat[0].size == 0: satpix = None
+
+    # Detector noise (read noise and dark current) of the noise model
+    if simple_var:
+        detvar = None
     else:
-        satpix[wsat] = 1.0
-        satpix = np.cast['bool'](satpix)
+        detvar = variance_frame(slf, det, np.zeros_like(sciframe), scidx, fitsdict).astype(dtype)
+
+    # Divide the frame into blocks of rows
+    nrows = settings.argflag['reduce']['cosmics']['nrows']
+    if nrows is None:
+        nrows = sciframe.shape[0]
+    blocks = [(r0, min(r0+nrows, sciframe.shape[0])) for r0 in range(0, sciframe.shape[0], nrows)]
+    if pixmask is not None:
+        blocks = [(r0, r1) for r0, r1 in blocks if np.any(pixmask[r0:r1, :])]
+    finder = partial(lacosmic_block, scicopy, detvar, satlev, maxiter=maxiter, grow=grow)
+    ncpus = settings.get_ncpus(len(blocks))
+    if ncpus > 1:
+        msgs.info("Searching {0:d} blocks of rows with {1:d} CPUs".format(len(blocks), ncpus))
+    results = arutils.mp_imap(finder, blocks, ncpus, pool='thread')
+
+    # Combine the blocks
+    crmask = np.zeros(sciframe.shape, dtype=np.float)
+    counts = np.zeros((maxiter, 3), dtype=np.int)
+    for (r0, r1), (crblock, bcounts) in zip(blocks, results):
+        crmask[r0:r1, :] = crblock
+        counts[:bcounts.shape[0], :] += bcounts
+    for i in range(maxiter):
+        msgs.info("Iteration {0:d} -- {1:d} candidate pixels, {2:d} remaining candidate pixels, "
+                  "{3:d} pixels identified as cosmic rays".format(i+1, counts[i, 0], counts[i, 1], counts[i, 2]))
+        if counts[i, 2] == 0: break
+    msgs.info("Growing cosmic ray mask by 1 pixel")
+    return crmask
+
+
+def lacosmic_block(sciframe, detvar, satlev, rows, maxiter=1, grow=1.5,
+                   sigclip=5.0, sigfrac=0.3, objlim=5.0):
+    """
+    Identify cosmic rays in a block of rows of a frame (see lacosmic).
+
+    The block is padded with enough rows on either side that the
+    result is the same as when the entire frame is processed at once.
+    The block is processed with scipy/numpy routines that release the
+    GIL, so that several blocks can be searched by a pool of threads.
+
+    The 2x2 subsampling, convolution with a Laplacian kernel, clipping and
+    rebinning of the original algorithm are replaced by the equivalent
+    stencil on the original pixels (see lacosmic_laplacian), and the
+    cosmic rays are grown with binary dilations.
+
+    Parameters
+    ----------
+    sciframe : ndarray
+      The frame to search for cosmic rays
+    detvar : ndarray or None
+      The detector contribution (read noise and dark current) to the variance
+      of the noise model. If None, the noise model only includes Poisson noise.
+    satlev : float
+      Saturation level
+    rows : tuple
+      The first and last (exclusive) rows of the block
+    maxiter : int, optional
+      Number of iterations
+    grow : float, optional
+      Once CRs are identified, grow each CR detection by all pixels within this radius
+    sigclip : float, optional
+      Laplacian-to-noise limit for cosmic ray detection
+    sigfrac : float, optional
+      Fractional detection limit for neighbouring pixels
+    objlim : float, optional
+      Minimum contrast between the Laplacian image and the fine structure image
+
+    Returns
+    -------
+    crmask : ndarray
+      Mask of cosmic rays in the block (False=no CR, True=CR)
+    counts : ndarray
+      The number of candidate pixels, remaining candidate pixels, and
+      pixels identified as cosmic rays in each iteration
+    """
+    gval = int(1.0+grow)
+    # Rows needed on either side of the block: the Laplacian and fine structure
+    # images (6 rows), the Sobel and Gaussian filters of the screen (8 rows),
+    # and the final growth of the mask
+    halo = 8 + gval
+    r0, r1 = rows
+    h0, h1 = max(0, r0-halo), min(sciframe.shape[0], r1+halo)
+    scicopy = sciframe[h0:h1, :]
+    crmask = np.zeros(scicopy.shape, dtype=np.bool)
+    sigcliplow = sigclip * sigfrac
+
+    # Determine if there are saturated pixels
+    satpix = scicopy >= satlev
+    if not np.any(satpix): satpix = None
 
     # Define the kernels
-    laplkernel = np.array([[0.0, -1.0, 0.0], [-1.0, 4.0, -1.0], [0.0, -1.0, 0.0]])  # Laplacian kernal
-    growkernel = np.ones((3,3))
+    growkernel = np.ones((3, 3), dtype=np.bool)
+    counts = []
     for i in range(1, maxiter+1):
-        msgs.info("Convolving image with Laplacian kernel")
-        # Subsample, convolve, clip negative values, and rebin to original size
-        #set_trace()
-        subsam = arutils.subsample(scicopy)
-        conved = signal.convolve2d(subsam, laplkernel, mode="same", boundary="symm")
-        cliped = conved.clip(min=0.0)
-        lplus = arutils.rebin(cliped, np.array(cliped.shape)/2.0)
-
-        msgs.info("Creating noise model")
-        # Build a custom noise map, and compare  this to the laplacian
+        # Laplacian image (clipped at 0)
+        lplus = lacosmic_laplacian(scicopy)
+
+        # Build a custom noise map, and compare this to the laplacian
         m5 = ndimage.filters.median_filter(scicopy, size=5, mode='mirror')
-        if simple_var:
-            noise = np.sqrt(np.abs(m5)) #variance_frame(slf, det, m5, scidx, fitsdict))
+        if detvar is None:
+            noise = np.sqrt(np.abs(m5))
         else:
-            noise = np.sqrt(variance_frame(slf, det, m5, scidx, fitsdict))
-        msgs.info("Calculating Laplacian signal to noise ratio")
+            noise = np.sqrt(np.abs(m5) + detvar[h0:h1, :])
 
         # Laplacian S/N
         s = lplus / (2.0 * noise)  # Note that the 2.0 is from the 2x2 subsampling
@@ -1639,22 +1875,13 @@ def lacosmic(slf, fitsdict, det, sciframe, scidx, maxiter=1, grow=1.5, maskval=-
         # Remove the large structures
         sp = s - ndimage.filters.median_filter(s, size=5, mode='mirror')
 
-        msgs.info("Selecting candidate cosmic rays")
         # Candidate cosmic rays (this will include HII regions)
         candidates = sp > sigclip
-        nbcandidates = np.sum(candidates)
-
-        msgs.info("{0:5d} candidate pixels".format(nbcandidates))
+        nbcandidates = np.sum(candidates[r0-h0:r1-h0, :])
 
         # At this stage we use the saturated stars to mask the candidates, if available :
         if satpix is not None:
-            msgs.info("Masking saturated pixels")
             candidates = np.logical_and(np.logical_not(satpix), candidates)
-            nbcandidates = np.sum(candidates)
-
-            msgs.info("{0:5d} candidate pixels not part of saturated stars".format(nbcandidates))
-
-        msgs.info("Building fine structure image")
 
         # We build the fine structure image :
         m3 = ndimage.filters.median_filter(scicopy, size=3, mode='mirror')
@@ -1663,62 +1890,275 @@ def lacosmic(slf, fitsdict, det, sciframe, scidx, maxiter=1, grow=1.5, maskval=-
         f /= noise
         f = f.clip(min=0.01)
 
-        msgs.info("Removing suspected compact bright objects")
-
         # Now we have our better selection of cosmics :
         cosmics = np.logical_and(candidates, sp/f > objlim)
-        nbcosmics = np.sum(cosmics)
-
-        msgs.info("{0:5d} remaining candidate pixels".format(nbcosmics))
+        nbcosmics = np.sum(cosmics[r0-h0:r1-h0, :])
 
         # What follows is a special treatment for neighbors, with more relaxed constains.
-
-        msgs.info("Finding neighboring pixels affected by cosmic rays")
-
         # We grow these cosmics a first time to determine the immediate neighborhod  :
-        growcosmics = np.cast['bool'](signal.convolve2d(np.cast['float32'](cosmics), growkernel, mode="same", boundary="symm"))
+        growcosmics = ndimage.binary_dilation(cosmics, structure=growkernel)
 
         # From this grown set, we keep those that have sp > sigmalim
         # so obviously not requiring sp/f > objlim, otherwise it would be pointless
         growcosmics = np.logical_and(sp > sigclip, growcosmics)
 
         # Now we repeat this procedure, but lower the detection limit to sigmalimlow :
-
-        finalsel = np.cast['bool'](signal.convolve2d(np.cast['float32'](growcosmics), growkernel, mode="same", boundary="symm"))
+        finalsel = ndimage.binary_dilation(growcosmics, structure=growkernel)
         finalsel = np.logical_and(sp > sigcliplow, finalsel)
 
         # Unmask saturated pixels:
         if satpix is not None:
-            msgs.info("Masking saturated stars")
             finalsel = np.logical_and(np.logical_not(satpix), finalsel)
-
-        ncrp = np.sum(finalsel)
-
-        msgs.info("{0:5d} pixels detected as cosmics".format(ncrp))
-
-        # We find how many cosmics are not yet known :
-        newmask = np.logical_and(np.logical_not(crmask), finalsel)
-        nnew = np.sum(newmask)
+        ncrp = np.sum(finalsel[r0-h0:r1-h0, :])
 
         # We update the mask with the cosmics we have found :
         crmask = np.logical_or(crmask, finalsel)
-
-        msgs.info("Iteration {0:d} -- {1:d} pixels identified as cosmic rays ({2:d} new)".format(i, ncrp, nnew))
+        counts.append([nbcandidates, nbcosmics, ncrp])
         if ncrp == 0: break
     # Additional algorithms (not traditionally implemented by LA cosmic) to remove some false positives.
-    msgs.work("The following algorithm would be better on the rectified, tilts-corrected image")
-    filt  = ndimage.sobel(sciframe, axis=1, mode='constant')
-    filty = ndimage.sobel(filt/np.sqrt(np.abs(sciframe)), axis=0, mode='constant')
+    # The following algorithm would be better on the rectified, tilts-corrected image
+    with np.errstate(divide='ignore', invalid='ignore'):
+        filt  = ndimage.sobel(scicopy, axis=1, mode='constant')
+        filty = ndimage.sobel(filt/np.sqrt(np.abs(scicopy)), axis=0, mode='constant')
     filty[np.where(np.isnan(filty))]=0.0
-    sigimg  = arcyproc.cr_screen(filty,0.0)
-    sigsmth = ndimage.filters.gaussian_filter(sigimg,1.5)
+    sigimg  = cr_screen(filty, 0.0)
+    sigsmth = ndimage.filters.gaussian_filter(sigimg, 1.5)
     sigsmth[np.where(np.isnan(sigsmth))]=0.0
-    sigmask = np.cast['bool'](np.zeros(sciframe.shape))
-    sigmask[np.where(sigsmth>sigclip)] = True
-    crmask = np.logical_and(crmask, sigmask)
-    msgs.info("Growing cosmic ray mask by 1 pixel")
-    crmask = arcyutils.grow_masked(crmask.astype(np.float), grow, 1.0)
-    return crmask
+    crmask = np.logical_and(crmask, sigsmth > sigclip)
+    # Grow the cosmic ray mask by all pixels within a radius grow
+    xx, yy = np.mgrid[-gval:gval+1, -gval:gval+1]
+    crmask = ndimage.binary_dilation(crmask, structure=np.sqrt(xx**2 + yy**2) <= grow)
+    return crmask[r0-h0:r1-h0, :], np.array(counts, dtype=np.int)
+
+
+def stack_register(slf, det, stack, stkidx, scidx, maxshift=0.5, snrmin=5.0, width=15):
+    """
+    Identify the exposures of a stack that are registered with the science
+    frame (i.e. the target falls on the same pixels, which is not the case
+    of dithered exposures).
+
+    Each exposure is rectified along the slits, with the same coordinate maps
+    as artrace.trace_object, and collapsed into a spatial profile of each slit.
+    The slit illumination is removed with a running median, and the offset of
+    each exposure along the slits is measured by cross-correlating its
+    profiles with those of the science frame. If the profiles of the science
+    frame do not contain a significant object, there is nothing to register,
+    and all exposures are kept.
+
+    Parameters
+    ----------
+    slf : class
+      Science Exposure Class
+    det : int
+      Detector index
+    stack : ndarray
+      Bias subtracted exposures (nspec, nspat, nexp), including the science frame
+    stkidx : list
+      Indices of the exposures in stack
+    scidx : int
+      Index of the science frame
+    maxshift : float, optional
+      Largest offset (in pixels) of a registered exposure
+    snrmin : float, optional
+      Minimum signal-to-noise ratio of an object in the profiles of the science frame
+    width : int, optional
+      Width (in pixels) of the running median used to remove the slit illumination
+
+    Returns
+    -------
+    registered : ndarray
+      True for the exposures that are registered with the science frame
+    """
+    sidx = list(stkidx).index(scidx)
+    nexp = stack.shape[2]
+    registered = np.ones(nexp, dtype=np.bool)
+    # Spatial profiles of each slit, separated by enough zeros that the lags do not mix slits
+    profiles = []
+    for sl in range(slf._lordloc[det-1].shape[1]):
+        rmap = artrace.trace_object_map(slf, det, sl, stack.shape[1], 2, 2)
+        prof = np.array([np.median(artrace.rectify_slit(stack[:, :, i], rmap), axis=0) for i in range(nexp)])
+        profiles.append(prof - ndimage.median_filter(prof, size=(1, width), mode='nearest'))
+    maxlag = max([prof.shape[1] for prof in profiles])
+    pad = np.zeros((nexp, maxlag))
+    profile = np.concatenate([pad] + [arr for prof in profiles for arr in [prof, pad]], axis=1)
+    # Check that the science frame contains an object
+    sciprof = profile[sidx]
+    noise = 1.4826*np.median(np.abs(np.concatenate([prof[sidx] for prof in profiles])))
+    if not np.max(sciprof) > snrmin*noise:
+        msgs.info("No significant object to register the exposures")
+        return registered
+    # Measure the offset of each exposure
+    lags = np.arange(-maxlag//2, maxlag//2+1)
+    for i in range(nexp):
+        if i == sidx:
+            continue
+        ccf = np.array([np.sum(sciprof*np.roll(profile[i], -lag)) for lag in lags])
+        imax = np.argmax(ccf)
+        shift = float(lags[imax])
+        if 0 < imax < lags.size-1:
+            denom = ccf[imax-1] - 2.0*ccf[imax] + ccf[imax+1]
+            if denom < 0.0:
+                shift += 0.5*(ccf[imax-1] - ccf[imax+1])/denom
+        registered[i] = (ccf[imax] > 0.0) and (np.abs(shift) <= maxshift)
+        if not registered[i]:
+            msgs.info("Exposure {0:d} is offset by {1:.1f} pixels from the science frame".format(stkidx[i], shift))
+    msgs.info("{0:d} of {1:d} exposures are registered with the science frame".format(np.sum(registered), nexp))
+    return registered
+
+
+def stack_cosmics(slf, fitsdict, det, stack, stkidx, scidx, sigclip=5.0, sigfrac=0.3,
+                  fluxtol=0.05, grow=1.5, maskval=-999999.9):
+    """
+    Identify cosmic rays in a science frame by comparing it to other
+    exposures of the same target taken with the same setup. The exposures
+    must be registered (i.e. the target falls on the same pixels, see
+    stack_register).
+
+    The exposures are scaled to the exposure time of the science frame, and
+    the masked median of the exposures (arcycomb.masked_median) is used as a
+    robust estimate of the counts in each pixel. Pixels of the science frame
+    that exceed the median by more than sigclip times the noise are cosmic
+    rays, as well as their neighbours that exceed the median by more than
+    sigfrac*sigclip times the noise. A pixel is unresolved if fewer than 3
+    exposures are not masked (bad or saturated pixels), or if the median is
+    itself affected by cosmic rays (at least half of the exposures deviate).
+
+    Parameters
+    ----------
+    slf : class
+      Science Exposure Class
+    fitsdict : dict
+      Contains relevant information from fits header files
+    det : int
+      Detector index
+    stack : ndarray
+      Bias subtracted exposures (nspec, nspat, nexp), including the science frame
+    stkidx : list
+      Indices of the exposures in stack
+    scidx : int
+      Index of the science frame
+    sigclip : float, optional
+      Detection limit of cosmic rays (in units of the noise)
+    sigfrac : float, optional
+      Fractional detection limit for neighbouring pixels
+    fluxtol : float, optional
+      Fractional uncertainty of the median, added in quadrature to the noise
+      (to allow for small differences in the seeing, transparency, and sky level)
+    grow : float, optional
+      Once CRs are identified, grow each CR detection by all pixels within this radius
+    maskval : float, optional
+      Value used to mask pixels
+
+    Returns
+    -------
+    crmask : ndarray
+      Mask of cosmic rays (False=no CR, True=CR)
+    unresolved : ndarray
+      Mask of the pixels that cannot be resolved by the exposures
+    """
+    from pypit import arcycomb
+    dnum = settings.get_dnum(det)
+    stkidx = list(stkidx)
+    sidx = stkidx.index(scidx)
+    msgs.info("Detecting cosmic rays by comparing {0:d} exposures".format(len(stkidx)))
+
+    # Scale the exposures to the counts (in electrons) of the science frame
+    exptime = np.array([float(fitsdict['exptime'][idx]) for idx in stkidx])
+    frames = stack * gain_frame(slf, det)[:, :, np.newaxis]
+    frames *= (exptime[sidx]/exptime)[np.newaxis, np.newaxis, :]
+    # Mask saturated and bad pixels
+    satlev = settings.spect[dnum]['saturation']*settings.spect[dnum]['nonlinear']
+    badpix = stack >= satlev
+    if slf._bpix[det-1] is not None:
+        badpix |= (slf._bpix[det-1] != 0)[:, :, np.newaxis]
+    frames[badpix] = maskval
+    nvalid = np.sum(~badpix, axis=2)
+
+    # Robust estimate of the counts, and the noise of each exposure
+    medframe = arcycomb.masked_median(frames, maskval)
+    medframe[nvalid == 0] = 0.0
+    noise = np.sqrt(variance_frame(slf, det, medframe, scidx, fitsdict) + (fluxtol*medframe)**2)
+    deviant = (frames - (medframe + sigclip*noise)[:, :, np.newaxis] > 0.0) & ~badpix
+    ndeviant = np.sum(deviant, axis=2)
+
+    # Cosmic rays of the science frame, and their neighbours
+    resid = (frames[:, :, sidx] - medframe)/noise
+    crmask = deviant[:, :, sidx]
+    growkernel = np.ones((3, 3), dtype=np.bool)
+    crmask |= ndimage.binary_dilation(crmask, structure=growkernel) & (resid > sigfrac*sigclip) & ~badpix[:, :, sidx]
+
+    # Pixels that cannot be resolved
+    unresolved = ((nvalid < 3) | (2*ndeviant >= nvalid)) & ~badpix[:, :, sidx]
+    crmask &= ~unresolved
+    msgs.info("{0:d} pixels identified as cosmic rays, {1:d} unresolved pixels".format(np.sum(crmask),
+                                                                                      np.sum(unresolved)))
+    # Grow the cosmic ray mask by all pixels within a radius grow
+    gval = int(1.0+grow)
+    xx, yy = np.mgrid[-gval:gval+1, -gval:gval+1]
+    crmask = ndimage.binary_dilation(crmask, structure=np.sqrt(xx**2 + yy**2) <= grow)
+    return crmask, unresolved
+
+
+def lacosmic_laplacian(frame):
+    """
+    The L.A.Cosmic Laplacian image: the frame is subsampled by a factor
+    of 2, convolved with a Laplacian kernel (with symmetric boundaries),
+    clipped at zero, and rebinned to the original size. The same result
+    is computed directly from the differences between each pixel and its
+    four neighbours, without generating the 4x larger subsampled image.
+
+    Parameters
+    ----------
+    frame : ndarray
+      The frame
+
+    Returns
+    -------
+    lplus : ndarray
+      The Laplacian image, clipped at zero
+    """
+    padded = np.pad(frame, 1, mode='edge')
+    # Differences with the neighbouring pixels (up, down, left, right)
+    du = frame - padded[:-2, 1:-1]
+    dd = frame - padded[2:, 1:-1]
+    dl = frame - padded[1:-1, :-2]
+    dr = frame - padded[1:-1, 2:]
+    # Each subsampled pixel only sees two of the neighbours
+    lplus = np.clip(du+dl, 0.0, None)
+    lplus += np.clip(dd+dl, 0.0, None)
+    lplus += np.clip(du+dr, 0.0, None)
+    lplus += np.clip(dd+dr, 0.0, None)
+    return lplus / 4.0
+
+
+def cr_screen(frame, maskval):
+    """
+    Calculate the significance of each pixel relative to the median and
+    median absolute deviation of its row, ignoring masked values.
+    This is used to screen candidate cosmic rays.
+
+    Parameters
+    ----------
+    frame : ndarray
+      The frame
+    maskval : float
+      Masked value
+
+    Returns
+    -------
+    sigimg : ndarray
+      The significance of each pixel (maskval where it is undefined)
+    """
+    mframe = np.where(frame == maskval, np.nan, frame)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # All-masked rows
+        medarr = np.nanmedian(mframe, axis=1)
+        madarr = 1.4826 * np.nanmedian(np.abs(mframe - medarr[:, np.newaxis]), axis=1)
+    madarr[np.isnan(madarr)] = maskval
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigimg = np.abs(frame - medarr[:, np.newaxis]) / madarr[:, np.newaxis]
+    sigimg[madarr == maskval, :] = maskval
+    return sigimg
 
 
 def gain_frame(slf, det):
@@ -1732,21 +2172,9 @@ def gain_frame(slf, det):
     Returns
     -------
     gain_img : ndarray
-
+      Gain image of the noise model of the detector (do not modify)
     """
-    dnum = settings.get_dnum(det)
-
-    # Loop on amplifiers
-    gain_img = np.zeros_like(slf._datasec[det-1])
-    for ii in range(settings.spect[dnum]['numamplifiers']):
-        amp = ii+1
-        try:
-            amppix = slf._datasec[det-1] == amp
-            gain_img[amppix] = settings.spect[dnum]['gain'][amp - 1]
-        except IndexError:
-            debugger.set_trace()
-    # Return
-    return gain_img
+    return slf.NoiseModel(det)['gain']
 
 
 def rn_frame(slf, det):
@@ -1760,19 +2188,86 @@ def rn_frame(slf, det):
     Returns
     -------
     rn_img : ndarray
-      Read noise *variance* image (i.e. RN**2)
+      Read noise *variance* image (i.e. RN**2) of the noise model of
+      the detector (do not modify)
     """
-    dnum = settings.get_dnum(det)
+    return slf.NoiseModel(det)['rn2']
 
-    # Loop on amplifiers
-    rnimg = np.zeros_like(slf._datasec[det-1])
-    for ii in range(settings.spect[dnum]['numamplifiers']):
-        amp = ii+1
-        amppix = slf._datasec[det-1] == amp
-        rnimg[amppix] = (settings.spect[dnum]['ronoise'][ii]**2 +
-                         (0.5*settings.spect[dnum]['gain'][ii])**2)
-    # Return
-    return rnimg
+
+def section_plan(det, shape):
+    """
+    Convert the data and overscan sections of each amplifier of a
+    detector into slices of a frame with the given shape. The plans
+    are cached, and a new plan is only generated when the sections
+    in the settings (or the shape of the frame) change.
+
+    Parameters
+    ----------
+    det : int
+      Detector Index
+    shape : tuple
+      Shape of the (untrimmed) frame. Only the first two axes are used.
+
+    Returns
+    -------
+    plan : dict
+      datasec -- (xslice, yslice) of the data section of each amplifier
+      oscansec -- (xslice, yslice) of the overscan section of each amplifier (None if not set)
+      dshape, oshape -- shape of the data and overscan section of each amplifier
+      trim -- index of the trimmed frame (slices, unless the data sections
+              of the amplifiers are not contiguous)
+    """
+    dnum = settings.get_dnum(det)
+    nx, ny = shape[0], shape[1]
+    sections = []
+    for i in range(settings.spect[dnum]['numamplifiers']):
+        sections.append([settings.spect[dnum].get("{0:s}{1:02d}".format(sec, i+1))
+                         for sec in ['datasec', 'oscansec']])
+    key = (dnum, nx, ny, str(sections))
+    if key in _section_plans:
+        return _section_plans[key]
+    plan = dict({'datasec': [], 'oscansec': [], 'dshape': [], 'oshape': []})
+    xv, yv = [], []
+    for dsec, osec in sections:
+        # Determine the section of the chip that contains data
+        dx0, dx1 = dsec[0][0], dsec[0][1]
+        dy0, dy1 = dsec[1][0], dsec[1][1]
+        if dx0 < 0: dx0 += nx
+        if dx1 <= 0: dx1 += nx
+        if dy0 < 0: dy0 += ny
+        if dy1 <= 0: dy1 += ny
+        plan['datasec'].append((slice(dx0, dx1), slice(dy0, dy1)))
+        plan['dshape'].append((dx1-dx0, dy1-dy0))
+        xv.append(np.arange(dx0, dx1))
+        yv.append(np.arange(dy0, dy1))
+        # Determine the section of the chip that contains the overscan region
+        if osec is None:
+            plan['oscansec'].append(None)
+            plan['oshape'].append(None)
+            continue
+        ox0, ox1 = osec[0][0], osec[0][1]
+        oy0, oy1 = osec[1][0], osec[1][1]
+        if ox0 < 0: ox0 += nx
+        if ox1 <= 0: ox1 += min(nx, dx1)  # Truncate to datasec
+        if oy0 < 0: oy0 += ny
+        if oy1 <= 0: oy1 += min(ny, dy1)  # Truncate to datasec
+        plan['oscansec'].append((slice(ox0, ox1), slice(oy0, oy1)))
+        plan['oshape'].append((ox1-ox0, oy1-oy0))
+    # The rows and columns of the trimmed frame
+    xv = np.unique(np.concatenate(xv))
+    yv = np.unique(np.concatenate(yv))
+    xcont = (xv.size > 0) and (xv[-1]-xv[0]+1 == xv.size)
+    ycont = (yv.size > 0) and (yv[-1]-yv[0]+1 == yv.size)
+    if xcont and ycont:
+        plan['trim'] = (slice(xv[0], xv[-1]+1), slice(yv[0], yv[-1]+1))
+    elif xcont:
+        plan['trim'] = (slice(xv[0], xv[-1]+1), yv)
+    elif ycont:
+        plan['trim'] = (xv, slice(yv[0], yv[-1]+1))
+    else:
+        plan['trim'] = np.ix_(xv, yv)
+    _section_plans[key] = plan
+    return plan
 
 
 def sub_overscan(frame, det):
@@ -1782,7 +2277,9 @@ def sub_overscan(frame, det):
     Parameters
     ----------
     frame : ndarray
-      frame which should have the overscan region subtracted
+      frame which should have the overscan region subtracted.
+      A cube of frames (with the frames along the last axis)
+      can be given, in which case every frame is processed at once.
     det : int
       Detector Index
 
@@ -1792,107 +2289,79 @@ def sub_overscan(frame, det):
       The input frame with the overscan region subtracted
     """
     dnum = settings.get_dnum(det)
-
+    plan = section_plan(det, frame.shape)
+    method = settings.argflag['reduce']['overscan']['method'].lower()
     for i in range(settings.spect[dnum]['numamplifiers']):
-        # Determine the section of the chip that contains data
-        datasec = "datasec{0:02d}".format(i+1)
-        dx0, dx1 = settings.spect[dnum][datasec][0][0], settings.spect[dnum][datasec][0][1]
-        dy0, dy1 = settings.spect[dnum][datasec][1][0], settings.spect[dnum][datasec][1][1]
-        if dx0 < 0: dx0 += frame.shape[0]
-        if dx1 <= 0: dx1 += frame.shape[0]
-        if dy0 < 0: dy0 += frame.shape[1]
-        if dy1 <= 0: dy1 += frame.shape[1]
-        xds = np.arange(dx0, dx1)
-        yds = np.arange(dy0, dy1)
-        # Determine the section of the chip that contains the overscan region
-        oscansec = "oscansec{0:02d}".format(i+1)
-        ox0, ox1 = settings.spect[dnum][oscansec][0][0], settings.spect[dnum][oscansec][0][1]
-        oy0, oy1 = settings.spect[dnum][oscansec][1][0], settings.spect[dnum][oscansec][1][1]
-        if ox0 < 0: ox0 += frame.shape[0]
-        if ox1 <= 0: ox1 += min(frame.shape[0], dx1)  # Truncate to datasec
-        if oy0 < 0: oy0 += frame.shape[1]
-        if oy1 <= 0: oy1 += min(frame.shape[1], dy1)  # Truncate to datasec
-        xos = np.arange(ox0, ox1)
-        yos = np.arange(oy0, oy1)
-        w = np.ix_(xos, yos)
-        oscan = frame[w]
+        if plan['oscansec'][i] is None:
+            msgs.error("The overscan section is not set for amplifier {0:d}".format(i+1))
+        dnx, dny = plan['dshape'][i]
+        onx, ony = plan['oshape'][i]
+        oscan = frame[plan['oscansec'][i]]
         # Make sure the overscan section has at least one side consistent with datasec
-        if dx1-dx0 == ox1-ox0:
+        if dnx == onx:
             osfit = np.median(oscan, axis=1)  # Mean was hit by CRs
-        elif dy1-dy0 == oy1-oy0:
+        elif dny == ony:
             osfit = np.median(oscan, axis=0)
-        elif settings.argflag['reduce']['overscan']['method'].lower() == "median":
-            osfit = np.median(oscan)
+        elif method == "median":
+            osfit = np.median(oscan, axis=(0, 1))
         else:
             msgs.error("Overscan sections do not match amplifier sections for amplifier {0:d}".format(i+1))
         # Fit/Model the overscan region
-        if settings.argflag['reduce']['overscan']['method'].lower() == "polynomial":
-            c = np.polyfit(np.arange(osfit.size), osfit, settings.argflag['reduce']['overscan']['params'][0])
-            ossub = np.polyval(c, np.arange(osfit.size))#.reshape(osfit.size,1)
-        elif settings.argflag['reduce']['overscan']['method'].lower() == "savgol":
-            ossub = savgol_filter(osfit, settings.argflag['reduce']['overscan']['params'][1], settings.argflag['reduce']['overscan']['params'][0])
-        elif settings.argflag['reduce']['overscan']['method'].lower() == "median":  # One simple value
+        nos = osfit.shape[0] if osfit.ndim == frame.ndim-1 else 1
+        if method == "polynomial":
+            c = np.polyfit(np.arange(nos), osfit, settings.argflag['reduce']['overscan']['params'][0])
+            ossub = np.polynomial.polynomial.polyval(np.arange(nos), c[::-1], tensor=True).T
+        elif method == "savgol":
+            ossub = savgol_filter(osfit, settings.argflag['reduce']['overscan']['params'][1], settings.argflag['reduce']['overscan']['params'][0], axis=0)
+        elif method == "median":  # One simple value
             ossub = osfit * np.ones(1)
         else:
             msgs.warn("Overscan subtraction method {0:s} is not implemented".format(settings.argflag['reduce']['overscan']['method']))
             msgs.info("Using a linear fit to the overscan region")
-            c = np.polyfit(np.arange(osfit.size), osfit, 1)
-            ossub = np.polyval(c, np.arange(osfit.size))#.reshape(osfit.size,1)
-        # Determine the section of the chip that contains data for this amplifier
-        wd = np.ix_(xds, yds)
-        ossub = ossub.reshape(osfit.size, 1)
-        if wd[0].shape[0] == ossub.shape[0]:
-            frame[wd] -= ossub
-        elif wd[1].shape[1] == ossub.shape[0]:
-            frame[wd] -= ossub.T
-        elif settings.argflag['reduce']['overscan']['method'].lower() == "median":
-            frame[wd] -= osfit
+            c = np.polyfit(np.arange(nos), osfit, 1)
+            ossub = np.polynomial.polynomial.polyval(np.arange(nos), c[::-1], tensor=True).T
+        # Subtract the model from the data section of this amplifier
+        data = frame[plan['datasec'][i]]
+        if dnx == nos:
+            data -= ossub.reshape((nos, 1) + frame.shape[2:])
+        elif dny == nos:
+            data -= ossub.reshape((1, nos) + frame.shape[2:])
+        elif method == "median":
+            data -= osfit
         else:
             msgs.error("Could not subtract bias from overscan region --"+msgs.newline()+"size of extracted regions does not match")
     # Return
-    del xds, yds, xos, yos, oscan
     return frame
 
 
 def trim(frame, det):
-    dnum = settings.get_dnum(det)
-    for i in range(settings.spect[dnum]['numamplifiers']):
-        datasec = "datasec{0:02d}".format(i+1)
-        x0, x1 = settings.spect[dnum][datasec][0][0], settings.spect[dnum][datasec][0][1]
-        y0, y1 = settings.spect[dnum][datasec][1][0], settings.spect[dnum][datasec][1][1]
-        if x0 < 0:
-            x0 += frame.shape[0]
-        if x1 <= 0:
-            x1 += frame.shape[0]
-        if y0 < 0:
-            y0 += frame.shape[1]
-        if y1 <= 0:
-            y1 += frame.shape[1]
-        if i == 0:
-            xv = np.arange(x0, x1)
-            yv = np.arange(y0, y1)
-        else:
-            xv = np.unique(np.append(xv, np.arange(x0, x1)))
-            yv = np.unique(np.append(yv, np.arange(y0, y1)))
-    # Construct and array with the rows and columns to be extracted
-    w = np.ix_(xv, yv)
-#	if len(file.shape) == 2:
-#		trimfile = file[w]
-#	elif len(file.shape) == 3:
-#		trimfile = np.zeros((w[0].shape[0],w[1].shape[1],file.shape[2]))
-#		for f in range(file.shape[2]):
-#			trimfile[:,:,f] = file[:,:,f][w]
-#	else:
-#		msgs.error("Cannot trim {0:d}D frame".format(int(len(file.shape))))
+    """
+    Trim a frame to the data sections of the amplifiers
+
+    Parameters
+    ----------
+    frame : ndarray
+      frame to be trimmed. A cube of frames (with the frames
+      along the last axis) can be given.
+    det : int
+      Detector Index
+
+    Returns
+    -------
+    frame : ndarray
+      The trimmed frame. This is a view of the input frame,
+      unless the data sections are not contiguous.
+    """
+    plan = section_plan(det, frame.shape)
     try:
-        return frame[w]
+        return frame[plan['trim']]
     except:
         msgs.bug("Odds are datasec is set wrong. Maybe due to transpose")
         debugger.set_trace()
         msgs.error("Cannot trim file")
 
 
-def variance_frame(slf, det, sciframe, idx, fitsdict=None, skyframe=None, objframe=None):
+def variance_frame(slf, det, sciframe, idx, fitsdict=None, skyframe=None, objframe=None, out=None):
     """ Calculate the variance image including detector noise
     Parameters
     ----------
@@ -1900,23 +2369,33 @@ def variance_frame(slf, det, sciframe, idx, fitsdict=None, skyframe=None, objfra
       Contains relevant information from fits header files
     objframe : ndarray, optional
       Model of object counts
+    out : ndarray, optional
+      Frame in which the variance is stored (may be one of the input frames)
     Returns
     -------
     variance image : ndarray
     """
-    dnum = settings.get_dnum(det)
-
+    noise = slf.NoiseModel(det)
     # The effective read noise (variance image)
-    rnoise = rn_frame(slf, det)
+    rnoise = noise['rn2']
     if skyframe is not None:
+        if out is None:
+            out = np.empty(skyframe.shape, dtype=np.result_type(skyframe, rnoise))
         if objframe is None:
-            objframe = np.zeros_like(skyframe)
-        varframe = np.abs(skyframe + objframe - np.sqrt(2)*np.sqrt(rnoise)) + rnoise
-        return varframe
+            out[...] = skyframe
+        else:
+            np.add(skyframe, objframe, out=out)
+        out -= noise['rnsky']
+        np.abs(out, out=out)
+        out += rnoise
+        return out
     else:
-        scicopy = sciframe.copy()
+        if out is None:
+            out = np.empty(sciframe.shape, dtype=np.result_type(sciframe, rnoise))
         # Dark Current noise
-        dnoise = (settings.spect[dnum]['darkcurr'] *
-                  float(fitsdict["exptime"][idx])/3600.0)
+        dnoise = noise['darkcurr'] * float(fitsdict["exptime"][idx])/3600.0
+        np.abs(sciframe, out=out)
+        out += rnoise
+        out += dnoise
         # Return
-        return np.abs(scicopy) + rnoise + dnoise
+        return out
@@ -591,9 +591,7 @@ def save_2d_images(slf, fitsdict, clobber=True):
     scidx = slf._idx_sci[0]
     path = fitsdict['directory'][scidx]
     ifile = fitsdict['filename'][scidx]
-    headarr = [None for k in range(settings.spect['fits']['numhead'])]
-    for k in range(settings.spect['fits']['numhead']):
-        headarr[k] = pyfits.getheader(path+ifile, ext=settings.spect['fits']['headext{0:02d}'.format(k+1)])
+    head0 = pyfits.getheader(path+ifile, ext=settings.spect['fits']['headext01'])
 
     # Primary header
     prihdu = pyfits.PrimaryHDU()
@@ -601,16 +599,16 @@ def save_2d_images(slf, fitsdict, clobber=True):
     hdus = [prihdu]
     hdukeys = ['BUNIT', 'COMMENT', '', 'BITPIX', 'NAXIS', 'NAXIS1', 'NAXIS2',
                'HISTORY', 'EXTEND', 'DATASEC']
-    for key in headarr[0].keys():
+    for key in head0.keys():
         # Use new ones
         if key in hdukeys:
             continue
         # Update unused ones
-        prihdu.header[key] = headarr[0][key]
+        prihdu.header[key] = head0[key]
     # History
-    if 'HISTORY' in headarr[0].keys():
+    if 'HISTORY' in head0.keys():
         # Strip \n
-        tmp = str(headarr[0]['HISTORY']).replace('\n', ' ')
+        tmp = str(head0['HISTORY']).replace('\n', ' ')
         prihdu.header.add_history(str(tmp))
 
     # PYPIT
@@ -77,6 +77,7 @@ class ScienceExposure:
         self._nspec    = [None for all in range(ndet)]   # Number of spectral pixels
         self._nspat    = [None for all in range(ndet)]   # Number of spatial pixels
         self._datasec  = [None for all in range(ndet)]   # Locations of the data on each detector
+        self._noise    = [None for all in range(ndet)]   # Detector noise model (see NoiseModel)
         self._pixlocn  = [None for all in range(ndet)]   # Physical locations of each pixel on the detector
         self._lordloc  = [None for all in range(ndet)]   # Array of slit traces (left side) in physical pixel coordinates
         self._rordloc  = [None for all in range(ndet)]   # Array of slit traces (left side) in physical pixel coordinates
@@ -85,6 +86,7 @@ class ScienceExposure:
         self._lordpix  = [None for all in range(ndet)]   # Array of slit traces (left side) in apparent pixel coordinates
         self._rordpix  = [None for all in range(ndet)]   # Array of slit traces (right side) in apparent pixel coordinates
         self._slitpix  = [None for all in range(ndet)]   # Array identifying if a given pixel belongs to a given slit
+        self._slitidx  = [None for all in range(ndet)]   # Index of the pixels of each slit (see SlitIndex)
         self._tilts    = [None for all in range(ndet)]   # Array of spectral tilts at each position on the detector
         self._tiltpar  = [None for all in range(ndet)]   # Dict parameters for tilt fitting
         self._satmask  = [None for all in range(ndet)]   # Array of Arc saturation streaks
@@ -270,19 +272,10 @@ class ScienceExposure:
                 if settings.argflag['arc']['combine']['match'] > 0.0:
                     sframes = arsort.match_frames(frames, settings.argflag['arc']['combine']['match'], frametype='arc',
                                                   satlevel=settings.spect[dnum]['saturation']*settings.spect[dnum]['nonlinear'])
-                    subframes = np.zeros((frames.shape[0], frames.shape[1], len(sframes)))
-                    numarr = np.array([])
-                    for i in range(len(sframes)):
-                        numarr = np.append(numarr, sframes[i].shape[2])
-                        msarc = arcomb.comb_frames(sframes[i], det, 'arc')
-                        # Send the data away to be saved
-                        subframes[:,:,i] = msarc.copy()
+                    msarc = arcomb.comb_sets(sframes, det, 'arc')
                     del sframes
-                    # Combine all sub-frames
-                    msarc = arcomb.comb_frames(subframes, det, 'arc', weights=numarr)
-                    del subframes
                 else:
-                    msarc = arcomb.comb_frames(frames, det, 'arc')
+                    msarc = arcomb.comb_frames(frames, det, 'arc', exptime=fitsdict['exptime'][ind])
                 del frames
         else: # Use input frame name located in MasterFrame directory
             msarc_name = settings.argflag['run']['directory']['master']+'/'+settings.argflag['arc']['useframe']
@@ -324,7 +317,8 @@ class ScienceExposure:
                 ind = self._idx_bias
                 # Load the Bias/Dark frames
                 frames = arload.load_frames(fitsdict, ind, det, frametype=settings.argflag['bias']['useframe'])
-                msbias = arcomb.comb_frames(frames, det, 'bias', printtype=settings.argflag['bias']['useframe'])
+                msbias = arcomb.comb_frames(frames, det, 'bias', printtype=settings.argflag['bias']['useframe'],
+                                             exptime=fitsdict['exptime'][ind])
                 del frames
         elif settings.argflag['bias']['useframe'] == 'overscan':
             self.SetMasterFrame('overscan', "bias", det, mkcopy=False)
@@ -441,19 +435,11 @@ class ScienceExposure:
                     if settings.argflag['pixelflat']['combine']['match'] > 0.0:
                         sframes = arsort.match_frames(frames, settings.argflag['pixelflat']['combine']['match'],
                                                       frametype='pixel flat', satlevel=self._nonlinear)
-                        subframes = np.zeros((frames.shape[0], frames.shape[1], len(sframes)))
-                        numarr = np.array([])
-                        for i in range(len(sframes)):
-                            numarr = np.append(numarr, sframes[i].shape[2])
-                            mspixelflat = arcomb.comb_frames(sframes[i], det, 'pixelflat', printtype='pixel flat')
-                            subframes[:, :, i] = mspixelflat.copy()
+                        mspixelflat = arcomb.comb_sets(sframes, det, 'pixelflat', printtype='pixel flat')
                         del sframes
-                        # Combine all sub-frames
-                        mspixelflat = arcomb.comb_frames(subframes, det, 'pixelflat', weights=numarr,
-                                                         printtype='pixel flat')
-                        del subframes
                     else:
-                        mspixelflat = arcomb.comb_frames(frames, det, 'pixelflat', printtype='pixel flat')
+                        mspixelflat = arcomb.comb_frames(frames, det, 'pixelflat', printtype='pixel flat',
+                                                         exptime=fitsdict['exptime'][ind])
                     del frames
                     # Apply gain (instead of ampsec scale)
                     mspixelflat *= arproc.gain_frame(self, det)
@@ -533,18 +519,10 @@ class ScienceExposure:
                     sframes = arsort.match_frames(frames, settings.argflag['pinhole']['combine']['match'],
                                                   frametype='pinhole', satlevel=settings.spect[dnum]['saturation'] *
                                                   settings.spect['det'][det - 1]['nonlinear'])
-                    subframes = np.zeros((frames.shape[0], frames.shape[1], len(sframes)))
-                    numarr = np.array([])
-                    for i in range(len(sframes)):
-                        numarr = np.append(numarr, sframes[i].shape[2])
-                        mspinhole = arcomb.comb_frames(sframes[i], det, 'pinhole')
-                        subframes[:, :, i] = mspinhole.copy()
+                    mspinhole = arcomb.comb_sets(sframes, det, 'pinhole')
                     del sframes
-                    # Combine all sub-frames
-                    mspinhole = arcomb.comb_frames(subframes, det, 'pinhole', weights=numarr)
-                    del subframes
                 else:
-                    mspinhole = arcomb.comb_frames(frames, det, 'pinhole')
+                    mspinhole = arcomb.comb_frames(frames, det, 'pinhole', exptime=fitsdict['exptime'][ind])
                 del frames
         else:  # It must be the name of a file the user wishes to load
             mspinhole_name = settings.argflag['run']['directory']['master'] + '/' + \
@@ -589,18 +567,10 @@ class ScienceExposure:
                                             trim=settings.argflag['reduce']['trim'])
                 if settings.argflag['trace']['combine']['match'] > 0.0:
                     sframes = arsort.match_frames(frames, settings.argflag['trace']['combine']['match'], frametype='trace', satlevel=settings.spect[dnum]['saturation']*settings.spect['det'][det-1]['nonlinear'])
-                    subframes = np.zeros((frames.shape[0], frames.shape[1], len(sframes)))
-                    numarr = np.array([])
-                    for i in range(len(sframes)):
-                        numarr = np.append(numarr, sframes[i].shape[2])
-                        mstrace = arcomb.comb_frames(sframes[i], det, 'trace')
-                        subframes[:,:,i] = mstrace.copy()
+                    mstrace = arcomb.comb_sets(sframes, det, 'trace')
                     del sframes
-                    # Combine all sub-frames
-                    mstrace = arcomb.comb_frames(subframes, det, 'trace', weights=numarr)
-                    del subframes
                 else:
-                    mstrace = arcomb.comb_frames(frames, det, 'trace')
+                    mstrace = arcomb.comb_frames(frames, det, 'trace', exptime=fitsdict['exptime'][ind])
                 del frames
         else: # It must be the name of a file the user wishes to load
             mstrace_name = settings.argflag['run']['directory']['master']+'/'+settings.argflag['reduce']['trace']['useframe']
@@ -870,6 +840,126 @@ class ScienceExposure:
                 msgs.error("Please contact the authors")
         return None
 
+    def SlitIndex(self, det):
+        """ Generate (or return) an index of the pixels of each slit
+
+        The pixels of slit sl are order[offsets[sl+1]:offsets[sl+2]] in
+        the flattened _slitpix frame, in the same order as np.where.
+        The index is regenerated whenever _slitpix is replaced.
+
+        Parameters
+        ----------
+        det : int
+          Index of the detector
+
+        Returns
+        -------
+        slitidx : dict
+          order, offsets, and the bounding box (rows and columns) of each slit
+        """
+        slitpix = self._slitpix[det-1]
+        if self._slitidx[det-1] is not None and self._slitidx[det-1]['slitpix'] is slitpix:
+            return self._slitidx[det-1]
+        labels = slitpix.ravel().astype(np.int)
+        nslit = max(np.max(labels), 0)
+        order = np.argsort(labels, kind='mergesort')
+        offsets = np.append(0, np.cumsum(np.bincount(labels, minlength=nslit+1)))
+        # Bounding box of each slit
+        bbox = np.zeros((nslit+1, 4), dtype=np.int)
+        nonempty = np.where(offsets[1:] > offsets[:-1])[0]
+        rows, cols = np.divmod(order, slitpix.shape[1])
+        bbox[nonempty, 0] = rows[offsets[nonempty]]
+        bbox[nonempty, 1] = rows[offsets[nonempty+1]-1] + 1
+        bbox[nonempty, 2] = np.minimum.reduceat(cols, offsets[nonempty])
+        bbox[nonempty, 3] = np.maximum.reduceat(cols, offsets[nonempty]) + 1
+        self._slitidx[det-1] = dict(slitpix=slitpix, order=order, offsets=offsets, bbox=bbox)
+        return self._slitidx[det-1]
+
+    def GetSlitPixels(self, det, slit, unmasked=False):
+        """ Return the pixels of a slit, i.e. np.where(_slitpix == slit+1)
+
+        Parameters
+        ----------
+        det : int
+          Index of the detector
+        slit : int
+          Index of the slit (starting from 0)
+        unmasked : bool, optional
+          Only return the pixels that are not masked in _scimask
+
+        Returns
+        -------
+        word : tuple
+          The rows and columns of the pixels of the slit
+        """
+        slitidx = self.SlitIndex(det)
+        if slit+2 >= slitidx['offsets'].size:
+            pix = np.zeros(0, dtype=np.int)
+        else:
+            pix = slitidx['order'][slitidx['offsets'][slit+1]:slitidx['offsets'][slit+2]]
+        word = np.divmod(pix, self._slitpix[det-1].shape[1])
+        if unmasked:
+            gdp = self._scimask[det-1][word] == 0
+            word = (word[0][gdp], word[1][gdp])
+        return word
+
+    def NoiseModel(self, det):
+        """ Generate (or return) the noise model of a detector
+
+        The gain and read noise of each amplifier are mapped onto the
+        detector (using _datasec) once, and the model is regenerated
+        whenever _datasec is replaced or the detector settings change.
+        The returned frames are shared, and must not be modified.
+
+        Parameters
+        ----------
+        det : int
+          Index of the detector
+
+        Returns
+        -------
+        noise : dict
+          gain and read noise variance (rn2) frames, the read noise
+          term of the sky variance (rnsky), and the dark current
+        """
+        dnum = settings.get_dnum(det)
+        datasec = self._datasec[det-1]
+        numamp = settings.spect[dnum]['numamplifiers']
+        gain = np.array(settings.spect[dnum]['gain'][:numamp], dtype=np.float)
+        ronoise = np.array(settings.spect[dnum]['ronoise'][:numamp], dtype=np.float)
+        params = (tuple(gain), tuple(ronoise), settings.spect[dnum]['darkcurr'])
+        noise = self._noise[det-1]
+        if noise is not None and noise['datasec'] is datasec and noise['params'] == params:
+            return noise
+        # Look up the values of each amplifier (pixels that are not on an amplifier are set to zero)
+        amps = datasec.astype(np.int)
+        amps[(amps < 0) | (amps > gain.size)] = 0
+        gainimg = np.append(0.0, gain)[amps]
+        rnimg = np.append(0.0, ronoise**2 + (0.5*gain)**2)[amps]
+        self._noise[det-1] = dict(datasec=datasec, params=params, gain=gainimg, rn2=rnimg,
+                                  rnsky=np.sqrt(2)*np.sqrt(rnimg), darkcurr=params[2])
+        return self._noise[det-1]
+
+    def GetSlitCrop(self, det, slit):
+        """ Return the slices of the smallest sub-image that contains a slit
+
+        Parameters
+        ----------
+        det : int
+          Index of the detector
+        slit : int
+          Index of the slit (starting from 0)
+
+        Returns
+        -------
+        crop : tuple
+          Slices of the rows and columns (empty if there are no pixels in the slit)
+        """
+        bbox = self.SlitIndex(det)['bbox']
+        if slit+1 >= bbox.shape[0]:
+            return slice(0, 0), slice(0, 0)
+        return slice(bbox[slit+1, 0], bbox[slit+1, 1]), slice(bbox[slit+1, 2], bbox[slit+1, 3])
+
     def update_sci_pixmask(self, det, mask_pix, mask_type):
         """ Update the binary pixel mask for a given science frame
 
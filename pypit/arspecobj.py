@@ -145,11 +145,8 @@ def init_exp(slf, scidx, det, fitsdict, trc_img, ypos=0.5, **kwargs):
                 # xobj
                 _, xobj = get_objid(slf, det, sl, qq, trc_img, ypos=ypos)
                 # Generate
-                if trc_img[sl]['object'] is None:
-                    specobj = SpecObjExp((trc_img[0]['object'].shape[:2]), config, scidx, det, xslit, ypos, xobj, **kwargs)
-                else:
-                    specobj = SpecObjExp((trc_img[sl]['object'].shape[:2]), config, scidx, det, xslit, ypos, xobj,
-                                         **kwargs)
+                specobj = SpecObjExp(trc_img[sl]['object'][qq]['shape'], config, scidx, det, xslit, ypos, xobj,
+                                     **kwargs)
                 # Add traces
                 specobj.trace = trc_img[sl]['traces'][:, qq]
                 # Append
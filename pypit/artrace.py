@@ -2,6 +2,7 @@ from __future__ import (print_function, absolute_import, division, unicode_liter
 
 import numpy as np
 import copy
+from functools import partial
 from pypit import arqa
 from pypit import ararc
 from pypit import armsgs
@@ -23,6 +24,11 @@ try:
 except NameError:
     ustr = str
 
+# Cache of the coordinate maps used to rectify each slit (see rectify_map)
+_rectify_maps = dict({})
+# Frames shared (read-only) with the workers of trace_objects (see trace_objects_init)
+_trace_frames = dict({})
+
 
 def assign_slits(binarr, edgearr, ednum=100000, lor=-1):
     """
@@ -302,15 +308,18 @@ def expand_slits(slf, mstrace, det, ordcen, extord):
 
 
 def trace_objbg_image(slf, det, sciframe, slitn, objreg, bgreg, trim=2, triml=None, trimr=None):
-    """ Creates an image with weights corresponding to object or background pixels.
+    """ Creates the apertures with weights corresponding to object or background pixels.
 
     Each weight can take any floating point value from 0 to 1 (inclusive). For the
-    rec_obj_img, a weight of 1 means that the pixel is fully contained within the
+    object apertures, a weight of 1 means that the pixel is fully contained within the
     object region, and 0 means that the pixel is fully contained within the
-    background region. The opposite is true for the rec_bg_img array. A pixel that
+    background region. The opposite is true for the background apertures. A pixel that
     is on the border of object/background is assigned a value between 0 and 1, based
     on the percentage overlap with the object/background regions.
 
+    The apertures are stored in a compact form (see aperture_dict), and
+    an image of the weights can be generated with aperture_image.
+
     Parameters
     ----------
     slf : Class instance
@@ -339,10 +348,10 @@ def trace_objbg_image(slf, det, sciframe, slitn, objreg, bgreg, trim=2, triml=No
 
     Returns
     -------
-    rec_obj_img : ndarray
-      An image containing weights to be used for the object
-    rec_bg_img : ndarray
-      An image containing weights to be used for the background
+    rec_obj_img : list of dict
+      The aperture of each object
+    rec_bg_img : list of dict
+      The background aperture of each object
     """
     # Get the number of objects in the slit
     nobj = len(objreg[0])
@@ -351,53 +360,221 @@ def trace_objbg_image(slf, det, sciframe, slitn, objreg, bgreg, trim=2, triml=No
     if trimr is None:
         trimr = trim
     npix = int(slf._pixwid[det-1][slitn] - triml - trimr)
-    # Make an image of pixel weights for each object
-    xint = np.linspace(0.0, 1.0, sciframe.shape[0])
-    yint = np.linspace(0.0, 1.0, npix)
-    yint = np.append(-yint[1], np.append(yint, 2.0-yint[-2]))
-    msgs.info("Creating an image weighted by object pixels")
-    rec_obj_img = np.zeros((sciframe.shape[0], sciframe.shape[1], nobj))
+    lordloc = slf._lordloc[det-1][:, slitn] + triml
+    msgs.info("Creating the apertures of the object pixels")
+    rec_obj_img = []
     for o in range(nobj):
         obj = np.zeros(npix)
         obj[objreg[0][o]:objreg[1][o]+1] = 1
-        scitmp = np.append(0.0, np.append(obj, 0.0))
-        objframe = scitmp.reshape(1, -1).repeat(sciframe.shape[0], axis=0)
-        objspl = interp.RectBivariateSpline(xint, yint, objframe, bbox=[0.0, 1.0, yint.min(), yint.max()], kx=1, ky=1, s=0)
-        xx, yy = np.meshgrid(np.linspace(0, 1.0, sciframe.shape[0]), np.arange(0, sciframe.shape[1]), indexing='ij')
-        lo = (slf._lordloc[det-1][:, slitn]+triml).reshape((-1, 1))
-        vv = ((yy-lo)/(npix-1.0)).flatten()
-        xx = xx.flatten()
-        wf = np.where((vv >= yint[0]) & (vv <= yint[-1]))
-        rec_obj_arr = objspl.ev(xx[wf], vv[wf])
-        idxarr = np.zeros(sciframe.shape).flatten()
-        idxarr[wf] = 1
-        idxarr = idxarr.reshape(sciframe.shape)
-        rec_img = np.zeros_like(sciframe)
-        rec_img[np.where(idxarr == 1)] = rec_obj_arr
-        rec_obj_img[:, :, o] = rec_img.copy()
-    # Make an image of pixel weights for the background region of each object
-    msgs.info("Creating an image weighted by background pixels")
-    rec_bg_img = np.zeros((sciframe.shape[0], sciframe.shape[1], nobj))
+        rec_obj_img.append(aperture_dict(sciframe.shape, lordloc, obj))
+    msgs.info("Creating the apertures of the background pixels")
+    rec_bg_img = []
     for o in range(nobj):
-        backtmp = np.append(0.0, np.append(bgreg[0][:, o] + bgreg[1][:, o], 0.0))
-        bckframe = backtmp.reshape(1, -1).repeat(sciframe.shape[0], axis=0)
-        bckspl = interp.RectBivariateSpline(xint, yint, bckframe, bbox=[0.0, 1.0, yint.min(), yint.max()], kx=1, ky=1, s=0)
-        xx, yy = np.meshgrid(np.linspace(0, 1.0, sciframe.shape[0]), np.arange(0, sciframe.shape[1]), indexing='ij')
-        lo = (slf._lordloc[det-1][:, slitn]+triml).reshape((-1, 1))
-        vv = ((yy-lo)/(npix-1.0)).flatten()
-        xx = xx.flatten()
-        wf = np.where((vv >= yint[0]) & (vv <= yint[-1]))
-        rec_bg_arr = bckspl.ev(xx[wf], vv[wf])
-        idxarr = np.zeros(sciframe.shape).flatten()
-        idxarr[wf] = 1
-        idxarr = idxarr.reshape(sciframe.shape)
-        rec_img = np.zeros_like(sciframe)
-        rec_img[np.where(idxarr == 1)] = rec_bg_arr
-        rec_bg_img[:, :, o] = rec_img.copy()
+        rec_bg_img.append(aperture_dict(sciframe.shape, lordloc, bgreg[0][:, o] + bgreg[1][:, o]))
     return rec_obj_img, rec_bg_img
 
 
-def trace_object_dict(nobj, traces, object=None, background=None, params=None, tracelist=None):
+def aperture_dict(shape, lordloc, weights):
+    """ Creates a compact representation of an object (or background) aperture
+
+    The weights of the aperture are given on a grid of pixels that
+    starts at lordloc on every row, and are linearly interpolated onto
+    the detector pixels (falling to zero one pixel beyond the first and
+    last pixels of the grid). Only the span of columns that contain
+    non-zero weights is recorded for each row.
+
+    Parameters
+    ----------
+    shape : tuple
+      Shape of the detector frame
+    lordloc : ndarray
+      Location of the first pixel of the aperture grid at each row
+    weights : ndarray
+      Weights of the aperture grid
+
+    Returns
+    -------
+    aperture : dict
+      The frame shape, the location and the (zero padded) weights of
+      the aperture grid, and the first (start) and last+1 (stop)
+      columns of the aperture at each row
+    """
+    profile = np.append(0.0, np.append(weights, 0.0))
+    wnz = np.where(profile != 0.0)[0]
+    if wnz.size == 0:
+        start = np.zeros(shape[0], dtype=np.int)
+        stop = np.zeros(shape[0], dtype=np.int)
+    else:
+        # The weights are zero at (and beyond) the neighbouring grid pixels
+        start = np.clip(np.floor(lordloc + wnz[0] - 2.0).astype(np.int) + 1, 0, shape[1])
+        stop = np.clip(np.ceil(lordloc + wnz[-1]).astype(np.int), 0, shape[1])
+        stop = np.maximum(start, stop)
+    return dict(shape=tuple(shape), lordloc=lordloc, profile=profile, start=start, stop=stop)
+
+
+def aperture_crop(aperture):
+    """ Return the slices of the smallest sub-image that contains an aperture
+
+    Parameters
+    ----------
+    aperture : dict
+      Aperture (see aperture_dict)
+
+    Returns
+    -------
+    crop : tuple
+      Slices of the rows and columns (empty if the aperture contains no pixels)
+    """
+    wrow = np.where(aperture['stop'] > aperture['start'])[0]
+    if wrow.size == 0:
+        return slice(0, 0), slice(0, 0)
+    return slice(wrow[0], wrow[-1]+1), slice(np.min(aperture['start'][wrow]), np.max(aperture['stop'][wrow]))
+
+
+def aperture_image(aperture, crop=None):
+    """ Generate an image of the weights of an aperture
+
+    Parameters
+    ----------
+    aperture : dict
+      Aperture (see aperture_dict)
+    crop : tuple, optional
+      Slices of the rows and columns of the sub-image to be generated
+      (by default, the full frame)
+
+    Returns
+    -------
+    image : ndarray
+      Weights of the aperture
+    """
+    shape = aperture['shape']
+    if crop is None:
+        crop = (slice(0, shape[0]), slice(0, shape[1]))
+    rows = np.arange(shape[0])[crop[0]]
+    cols = np.arange(shape[1])[crop[1]]
+    image = np.zeros((rows.size, cols.size))
+    if rows.size == 0 or cols.size == 0:
+        return image
+    # Only evaluate the weights within the spans of the aperture
+    c0 = max(np.min(aperture['start'][rows]), cols[0])
+    c1 = min(np.max(aperture['stop'][rows]), cols[-1]+1)
+    if c1 <= c0:
+        return image
+    profile = aperture['profile']
+    uu = np.arange(c0, c1).reshape((1, -1)) - aperture['lordloc'][rows].reshape((-1, 1))
+    image[:, c0-cols[0]:c1-cols[0]] = np.interp(uu, np.arange(-1.0, profile.size-1.0), profile)
+    return image
+
+
+def aperture_shift(aperture, shift):
+    """ Shift an aperture along the spatial direction
+
+    Parameters
+    ----------
+    aperture : dict
+      Aperture (see aperture_dict)
+    shift : ndarray
+      Shift (in pixels) at each row
+
+    Returns
+    -------
+    aperture : dict
+      The shifted aperture
+    """
+    return aperture_dict(aperture['shape'], aperture['lordloc'] + shift, aperture['profile'][1:-1])
+
+
+def rectify_map(det, slitn, lordloc, rordloc, ncol, npix):
+    """ Generate (or return) the coordinate map used to rectify a slit
+
+    Each row of the slit is resampled onto npix pixels that are evenly
+    spaced between the left and right edges. The maps are cached for
+    each detector and slit, and are reused for all frames (and all
+    exposures) that share the same slit edges.
+
+    Parameters
+    ----------
+    det : int
+      Index of the detector
+    slitn : int
+      Slit (or order) number
+    lordloc : ndarray
+      Left edge of the rectified slit (in pixels) at each row
+    rordloc : ndarray
+      Right edge of the rectified slit (in pixels) at each row
+    ncol : int
+      Number of spatial pixels of the detector
+    npix : int
+      Number of spatial pixels of the rectified slit
+
+    Returns
+    -------
+    rmap : tuple
+      The rows, the lower columns and the interpolation weights of the
+      upper columns of the rectified slit
+    """
+    key = (ncol, npix, lordloc.tobytes(), rordloc.tobytes())
+    if (det, slitn) in _rectify_maps and _rectify_maps[(det, slitn)][0] == key:
+        return _rectify_maps[(det, slitn)][1]
+    yy = np.linspace(0.0, 1.0, npix)
+    # Pixels beyond the edges of the detector take the value of the edge
+    cols = np.clip(lordloc.reshape((-1, 1)) + (rordloc-lordloc).reshape((-1, 1))*yy, 0.0, ncol-1.0)
+    lcol = np.minimum(cols.astype(np.int), ncol-2)
+    rows = np.arange(lordloc.size).reshape((-1, 1))
+    rmap = (rows, lcol, cols-lcol)
+    _rectify_maps[(det, slitn)] = (key, rmap)
+    return rmap
+
+
+def trace_object_map(slf, det, slitn, ncol, triml, trimr):
+    """ Generate (or return) the coordinate map used by trace_object to rectify a slit
+
+    Parameters
+    ----------
+    slf : Class instance
+      An instance of the Science Exposure class
+    det : int
+      Index of the detector
+    slitn : int
+      Slit (or order) number
+    ncol : int
+      Number of spatial pixels of the detector
+    triml : int
+      Number of pixels to trim from the left slit edge
+    trimr : int
+      Number of pixels to trim from the right slit edge
+
+    Returns
+    -------
+    rmap : tuple
+      Coordinate map of the slit (see rectify_map)
+    """
+    npix = int(slf._pixwid[det-1][slitn] - triml - trimr)
+    return rectify_map(det, slitn, slf._lordloc[det-1][:, slitn] + triml, slf._rordloc[det-1][:, slitn] - trimr,
+                       ncol, npix)
+
+
+def rectify_slit(frame, rmap):
+    """ Rectify a slit by linear interpolation along each row
+
+    Parameters
+    ----------
+    frame : ndarray
+      Frame to be rectified
+    rmap : tuple
+      Coordinate map of the slit (see rectify_map)
+
+    Returns
+    -------
+    rec_frame : ndarray
+      The rectified slit
+    """
+    rows, lcol, wght = rmap
+    lval = frame[rows, lcol]
+    return lval + (frame[rows, lcol+1] - lval)*wght
+
+
+def trace_object_dict(nobj, traces, object=None, background=None, params=None, tracelist=None, edges=None):
     """ Creates a list of dictionaries, which contain the object traces in each slit
 
     Parameters
@@ -406,22 +583,17 @@ def trace_object_dict(nobj, traces, object=None, background=None, params=None, t
       Number of objects in this slit
     traces : numpy ndarray
       the trace of each object in this slit
-    object: numpy ndarray (optional)
-      An image containing weights to be used for the object.
-    background : numpy ndarray (optional)
-      An image containing weights to be used for the background
+    object: list of dict (optional)
+      The aperture of each object (see aperture_dict)
+    background : list of dict (optional)
+      The background aperture of each object (see aperture_dict)
     params : dict
       A dictionary containing some of the important parameters used in
       the object tracing.
     tracelist : list of dict
       A list containing a trace dictionary for each slit
-
-    To save memory, the object and background images for multiple slits
-    can be stored in a single object image and single background image.
-    In this case, you must only set object and background for the zeroth
-    slit (with 'None' set for all other slits). In this case, the object
-    and background images must be set according to the slit locations
-    assigned in the slf._slitpix variable.
+    edges : list of ndarray (optional)
+      The left and right edges of each object (used for the QA)
 
     Returns
     -------
@@ -435,6 +607,7 @@ def trace_object_dict(nobj, traces, object=None, background=None, params=None, t
     newdict['object'] = object
     newdict['params'] = params
     newdict['background'] = background
+    newdict['edges'] = edges
     if tracelist is None:
         tracelist = []
     tracelist.append(newdict)
@@ -507,20 +680,10 @@ def trace_object(slf, det, sciframe, varframe, crmask, trim=2,
                     tracefunc=tracefunc, traceorder=traceorder, xedge=xedge)
     # Interpolate the science array onto a new grid (with constant spatial slit length)
     msgs.info("Rectifying science frame")
-    xint = np.linspace(0.0, 1.0, sciframe.shape[0])
-    yint = np.linspace(0.0, 1.0, sciframe.shape[1])
-    scispl = interp.RectBivariateSpline(xint, yint, sciframe, bbox=[0.0, 1.0, 0.0, 1.0], kx=1, ky=1, s=0)
-    varspl = interp.RectBivariateSpline(xint, yint, varframe, bbox=[0.0, 1.0, 0.0, 1.0], kx=1, ky=1, s=0)
-    crmspl = interp.RectBivariateSpline(xint, yint, crmask, bbox=[0.0, 1.0, 0.0, 1.0], kx=1, ky=1, s=0)
-    xx, yy = np.meshgrid(np.linspace(0.0, 1.0, sciframe.shape[0]), np.linspace(0.0, 1.0, npix), indexing='ij')
-    ro = (slf._rordloc[det-1][:, slitn] - trimr).reshape((-1, 1)) / (sciframe.shape[1] - 1.0)
-    lo = (slf._lordloc[det-1][:, slitn] + triml).reshape((-1, 1)) / (sciframe.shape[1] - 1.0)
-    vv = (lo+(ro-lo)*yy).flatten()
-    xx = xx.flatten()
-    recsh = (sciframe.shape[0], npix)
-    rec_sciframe = scispl.ev(xx, vv).reshape(recsh)
-    rec_varframe = varspl.ev(xx, vv).reshape(recsh)
-    rec_crmask   = crmspl.ev(xx, vv).reshape(recsh)
+    rmap = trace_object_map(slf, det, slitn, sciframe.shape[1], triml, trimr)
+    rec_sciframe = rectify_slit(sciframe, rmap)
+    rec_varframe = rectify_slit(varframe, rmap)
+    rec_crmask   = rectify_slit(crmask, rmap)
     # Update the CR mask to ensure it only contains 1's and 0's
     rec_crmask[np.where(rec_crmask > 0.2)] = 1.0
     rec_crmask[np.where(rec_crmask <= 0.2)] = 0.0
@@ -670,7 +833,7 @@ def trace_object(slf, det, sciframe, varframe, crmask, trim=2,
     for o in range(nobj):
         trccopy[:, o] = trcfunc[:, o] - cval[o] + objr[o]/(npix-1.0)
     trobjr = ofst + (diff-triml-trimr)*trccopy
-    # Generate an image of pixel weights for each object
+    # Generate the apertures of pixel weights for each object
     rec_obj_img, rec_bg_img = trace_objbg_image(slf, det, sciframe, slitn,
                                                 [objl, objr], [bckl, bckr],
                                                 triml=triml, trimr=trimr)
@@ -683,7 +846,7 @@ def trace_object(slf, det, sciframe, varframe, crmask, trim=2,
         debugger.set_trace()
     # Trace dict
     tracedict = trace_object_dict(nobj, traces, object=rec_obj_img, background=rec_bg_img,
-                                  params=tracepar, tracelist=tracedict)
+                                  params=tracepar, tracelist=tracedict, edges=[trobjl, trobjr])
 
     # Save the quality control
     if doqa: # and (not msgs._debug['no_qa']):
@@ -698,6 +861,215 @@ def trace_object(slf, det, sciframe, varframe, crmask, trim=2,
     return tracedict
 
 
+def trace_objects(slf, det, sciframe, varframe, crmask, doqa=True, **kwargs):
+    """ Finds objects, and traces their location on the detector, in every slit
+
+    The slits are traced independently (see trace_object). If more than
+    one CPU is used, the slits are distributed to a pool of processes.
+    The frames and the coordinate maps of the slits are passed to each
+    worker once, when it starts, and the maps are generated by (and
+    remain cached in) the caller.
+
+    Parameters
+    ----------
+    slf : Class instance
+      An instance of the Science Exposure class
+    det : int
+      Index of the detector
+    sciframe: numpy ndarray
+      Science frame
+    varframe: numpy ndarray
+      Variance frame
+    crmask: numpy ndarray
+      Mask or cosmic rays
+    doqa : bool
+      Should QA be output?
+    kwargs
+      Passed to trace_object
+
+    Returns
+    -------
+    tracelist : list of dict
+      A list containing a trace dictionary for each slit
+    """
+    nslit = slf._lordloc[det-1].shape[1]
+    tracer = partial(trace_object_slit, **kwargs)
+    ncpus = settings.get_ncpus(nslit)
+    if msgs._debug['trace_obj']:
+        # Debugging is interactive
+        ncpus = 1
+    # Generate the coordinate maps here, so that they remain cached for the next exposures
+    trim = kwargs.get('trim', 2)
+    triml = trim if kwargs.get('triml') is None else kwargs['triml']
+    trimr = trim if kwargs.get('trimr') is None else kwargs['trimr']
+    rmaps = dict({})
+    for sl in range(nslit):
+        trace_object_map(slf, det, sl, sciframe.shape[1], triml, trimr)
+        rmaps[(det, sl)] = _rectify_maps[(det, sl)]
+    initargs = (slf, det, sciframe, varframe, crmask, rmaps)
+    if ncpus > 1:
+        msgs.info("Tracing the objects of {0:d} slits with {1:d} CPUs".format(nslit, ncpus))
+    try:
+        # The frames and maps are passed to each worker once, when it starts
+        tracelist = list(arutils.mp_imap(tracer, range(nslit), ncpus, pool='process',
+                                         initializer=trace_objects_init, initargs=initargs))
+    finally:
+        _trace_frames.clear()
+    # Exit if the tracing of a slit has failed (see trace_object_slit)
+    for tracedict in tracelist:
+        if isinstance(tracedict, SystemExit):
+            raise tracedict
+
+    # Save the quality control of all slits
+    if doqa:
+        trace_objects_qa(slf, det, sciframe, tracelist)
+    return tracelist
+
+
+def refine_objects(slf, det, sciframe, tracelist, niter=3, doqa=True):
+    """ Refine the traces of objects that have already been found
+
+    The objects are not searched for again. Instead, the centroid of
+    each object is measured at every row of the frame (see
+    trace_fweight), starting from the current trace and iterating
+    niter times, and the centroids are fitted with the trace function.
+    The object edges and apertures are shifted with the trace.
+
+    Parameters
+    ----------
+    slf : Class instance
+      An instance of the Science Exposure class
+    det : int
+      Index of the detector
+    sciframe: numpy ndarray
+      Science frame
+    tracelist : list of dict
+      A list containing a trace dictionary for each slit (see trace_objects)
+    niter : int, optional
+      Number of iterations of the centroids
+    doqa : bool
+      Should QA be output?
+
+    Returns
+    -------
+    tracelist : list of dict
+      A list containing the refined trace dictionary of each slit
+    """
+    tracefunc = settings.argflag['trace']['object']['function']
+    traceorder = settings.argflag['trace']['object']['order']
+    specfit = np.linspace(-1.0, 1.0, sciframe.shape[0])
+    newlist = []
+    for sl in range(len(tracelist)):
+        newdict = copy.copy(tracelist[sl])
+        newlist.append(newdict)
+        nobj = newdict['nobj']
+        if nobj == 0:
+            continue
+        traces = newdict['traces']
+        edges = newdict['edges']
+        shift = np.zeros_like(traces)
+        for o in range(nobj):
+            # Centroid the object over (at least) 3 pixels either side of the trace
+            radius = 3.0
+            if edges is not None:
+                radius = max(radius, 0.5*np.median(edges[1][:, o] - edges[0][:, o]))
+            xnew = traces[:, o]
+            for ii in range(niter):
+                xnew, xerr = trace_fweight(sciframe, xnew, radius=radius)
+            w = np.where(xerr != 999.0)
+            if w[0].size <= traceorder + 1:
+                msgs.warn("Could not refine the trace of object {0:d} in slit {1:d}".format(o+1, sl+1))
+                continue
+            mskbad, coeffs = arutils.robust_polyfit(specfit[w], xnew[w], traceorder, function=tracefunc,
+                                                    minv=-1.0, maxv=1.0)
+            shift[:, o] = arutils.func_val(coeffs, specfit, tracefunc, minv=-1.0, maxv=1.0) - traces[:, o]
+        newdict['traces'] = traces + shift
+        if edges is not None:
+            newdict['edges'] = [edges[0] + shift, edges[1] + shift]
+        for key in ['object', 'background']:
+            if newdict[key] is not None:
+                newdict[key] = [aperture_shift(newdict[key][o], shift[:, o]) for o in range(nobj)] + \
+                               newdict[key][nobj:]
+    if doqa:
+        trace_objects_qa(slf, det, sciframe, newlist)
+    return newlist
+
+
+def trace_objects_qa(slf, det, sciframe, tracelist):
+    """ Generate the QA plot of the object traces in all slits
+
+    Parameters
+    ----------
+    slf : Class instance
+      An instance of the Science Exposure class
+    det : int
+      Index of the detector
+    sciframe: numpy ndarray
+      Science frame
+    tracelist : list of dict
+      A list containing a trace dictionary for each slit
+    """
+    from pypit.arspecobj import get_objid
+    objids, trobjl, trobjr = [], [], []
+    for sl in range(len(tracelist)):
+        for ii in range(tracelist[sl]['nobj']):
+            objid, xobj = get_objid(slf, det, sl, ii, tracelist)
+            objids.append(objid)
+            trobjl.append(tracelist[sl]['edges'][0][:, ii])
+            trobjr.append(tracelist[sl]['edges'][1][:, ii])
+    if len(objids) > 0:
+        arqa.obj_trace_qa(slf, sciframe, np.array(trobjl).T, np.array(trobjr).T, objids, det,
+                          root="object_trace", normalize=False)
+
+
+def trace_objects_init(slf, det, sciframe, varframe, crmask, rmaps):
+    """ Store the frames traced by trace_object_slit (see trace_objects)
+
+    Parameters
+    ----------
+    slf : Class instance
+      An instance of the Science Exposure class
+    det : int
+      Index of the detector
+    sciframe: numpy ndarray
+      Science frame
+    varframe: numpy ndarray
+      Variance frame
+    crmask: numpy ndarray
+      Mask or cosmic rays
+    rmaps : dict
+      Coordinate maps of the slits (see rectify_map)
+    """
+    _trace_frames['frames'] = (slf, det, sciframe, varframe, crmask)
+    _rectify_maps.update(rmaps)
+
+
+def trace_object_slit(slitn, **kwargs):
+    """ Finds and traces the objects of a single slit
+
+    This function is called by trace_objects for each slit.
+
+    Parameters
+    ----------
+    slitn : int
+      Slit (or order) number
+    kwargs
+      Passed to trace_object
+
+    Returns
+    -------
+    tracedict : dict
+      The trace dictionary of the slit. If the tracing failed with
+      msgs.error, the SystemExit is returned instead, because it would
+      otherwise terminate a worker without returning a result.
+    """
+    slf, det, sciframe, varframe, crmask = _trace_frames['frames']
+    try:
+        return trace_object(slf, det, sciframe, varframe, crmask, slitn=slitn, doqa=False, **kwargs)[0]
+    except SystemExit as err:
+        return SystemExit(err.code)
+
+
 def trace_slits(slf, mstrace, det, pcadesc="", maskBadRows=False, min_sqm=30.):
     """
     This routine traces the locations of the slit edges
@@ -111,6 +111,170 @@ def bspline_fit(x,y,order=3,knots=None,everyn=20,xmin=None,xmax=None,w=None,bksp
     return tck
 
 
+def bspline_iterfit(x, y, ivar=None, order=3, knots=None, everyn=20, bkspace=None,
+                    xmin=None, xmax=None, sigma=5.0, maxiter=None):
+    """ Robust least-squares bspline fit to sorted x,y (in the style of
+    the IDL routine bspline_iterfit)
+
+    The bspline basis functions are evaluated once, and the banded normal
+    equations are solved in each rejection iteration. The rejection is the
+    same as robust_polyfit (maxone=False) with function='bspline'.
+
+    Parameters
+    ----------
+    x : ndarray
+      Sorted independent variable values
+    y : ndarray
+      Dependent variable values
+    ivar : ndarray, optional
+      Inverse variance of y (pixels with ivar <= 0 are not fit)
+    order : int, optional
+      Order of the spline (default=3, i.e. cubic)
+    knots : ndarray, optional
+      Internal knots only
+    everyn : int, optional
+      Knot everyn good pixels, if used
+    bkspace : float, optional
+      Spacing of breakpoints in units of x
+    xmin : float, optional
+      Left end of the spline (default is the minimum good x)
+    xmax : float, optional
+      Right end of the spline (default is the maximum good x)
+    sigma : float, optional
+      Rejection threshold, in units of the robust standard deviation of the residuals
+    maxiter : int, optional
+      Maximum number of rejection iterations (None means until no new pixels are rejected)
+
+    Returns
+    -------
+    mask : ndarray
+      Mask of the rejected pixels (1 = rejected)
+    tck : tuple
+      describes the bspline (as returned by scipy.interpolate.splrep)
+    """
+    from scipy.linalg import solveh_banded, LinAlgError
+    if ivar is None:
+        ivar = np.ones(x.size)
+    gd = np.where(ivar > 0.0)[0]
+    xb = np.min(x[gd]) if xmin is None else xmin
+    xe = np.max(x[gd]) if xmax is None else xmax
+    # Make the knots
+    if knots is None:
+        if bkspace is not None:
+            xrnge = (np.max(x[gd]) - np.min(x[gd]))
+            nbkpts = max(int(xrnge/bkspace) + 1, 2)
+            knots = np.arange(1, nbkpts-1)*xrnge/(nbkpts-1) + np.min(x[gd])
+        elif everyn is not None:
+            # A knot every good N pixels
+            knots = x[gd[np.arange(everyn//2, gd.size-everyn//2, everyn)]]
+        else:
+            msgs.error("No method specified to generate knots")
+    knots = np.unique(knots)
+    knots = knots[(knots > xb) & (knots < xe)]
+    tknots = np.concatenate(([xb]*(order+1), knots, [xe]*(order+1)))
+    ncoeff = tknots.size - order - 1
+    # Evaluate the nonzero basis functions of each pixel
+    ileft, basis = bspline_basis(tknots, order, x)
+    mask = np.zeros(x.size, dtype=np.int)
+    mskcnt, niter = 0, 0
+    while True:
+        # Accumulate and solve the banded normal equations
+        wgt = ivar * (mask == 0)
+        band = np.zeros((order+1, ncoeff))
+        rhs = np.zeros(ncoeff)
+        for a in range(order+1):
+            wbasis = wgt * basis[a]
+            rhs += np.bincount(ileft+a, weights=wbasis*y, minlength=ncoeff)
+            for b in range(a, order+1):
+                band[b-a, :] += np.bincount(ileft+a, weights=wbasis*basis[b], minlength=ncoeff)
+        try:
+            coeff = solveh_banded(band, rhs, lower=True)
+        except (LinAlgError, ValueError):
+            # Some coefficients are not constrained by the data
+            msgs.warn("Problem in the bspline knots - regularizing the fit")
+            band[0, :] += 1.0e-10 * np.max(band[0, :]) + (band[0, :] == 0.0)
+            coeff = solveh_banded(band, rhs, lower=True)
+        if maxiter is not None and niter >= maxiter:
+            break
+        niter += 1
+        # Reject deviant pixels
+        model = np.sum(basis * coeff[ileft + np.arange(order+1)[:, np.newaxis]], axis=0)
+        w = np.where(mask == 0)
+        sigmed = 1.4826*np.median(np.abs(y[w]-model[w]))
+        if x.size-np.sum(mask) <= order+2:
+            msgs.warn("More parameters than data points - fit might be undesirable")
+            break  # More data was masked than allowed by order
+        mask[np.abs(y-model) > sigma*sigmed] = 1
+        if mskcnt == np.sum(mask): break  # No new values have been included in the mask
+        mskcnt = np.sum(mask)
+    tck = (tknots, np.append(coeff, np.zeros(order+1)), order)
+    return mask, tck
+
+
+def bspline_basis(tknots, order, x):
+    """ Evaluate the nonzero bspline basis functions (Cox-de Boor recursion)
+
+    Parameters
+    ----------
+    tknots : ndarray
+      Full set of knots (including the order+1 knots at each end)
+    order : int
+      Order of the spline
+    x : ndarray
+      Values at which the basis functions are evaluated
+
+    Returns
+    -------
+    ileft : ndarray
+      Index of the first nonzero basis function of each x
+    basis : ndarray
+      Values of the order+1 nonzero basis functions, shape (order+1, x.size)
+    """
+    ncoeff = tknots.size - order - 1
+    # Knot interval of each x (the last interval includes its right end)
+    ileft = np.clip(np.searchsorted(tknots, x, side='right') - 1, order, ncoeff-1)
+    basis = np.zeros((order+1, x.size))
+    basis[0] = 1.0
+    left = np.zeros((order+1, x.size))
+    right = np.zeros((order+1, x.size))
+    for j in range(1, order+1):
+        left[j] = x - tknots[ileft+1-j]
+        right[j] = tknots[ileft+j] - x
+        saved = np.zeros(x.size)
+        for r in range(j):
+            denom = right[r+1] + left[j-r]
+            temp = basis[r] / (denom + (denom == 0.0))
+            basis[r] = saved + right[r+1]*temp
+            saved = left[j-r]*temp
+        basis[j] = saved
+    return ileft - order, basis
+
+
+def bspline_val(tck, x, nchunk=1048576):
+    """ Evaluate a bspline on an array of any shape (e.g. an image),
+    nchunk values at a time
+
+    Parameters
+    ----------
+    tck : tuple
+      describes the bspline
+    x : ndarray
+      Values at which the bspline is evaluated
+    nchunk : int, optional
+      Number of values evaluated at once
+
+    Returns
+    -------
+    val : ndarray
+      The bspline evaluated at x (zero outside the range of the bspline)
+    """
+    xflat = np.ravel(x)
+    val = np.zeros(xflat.size)
+    for i in range(0, xflat.size, nchunk):
+        val[i:i+nchunk] = interpolate.splev(xflat[i:i+nchunk], tck, ext=1)
+    return val.reshape(np.shape(x))
+
+
 def calc_ivar(varframe):
     """ Calculate the inverse variance based on the input array
     """
@@ -658,6 +822,132 @@ def moffat(x,p0,p1,p2):
     """
     return p0 / (1+(x/p1)**2)**p2
 
+
+def mp_pool(ncpus, pool='thread', initializer=None, initargs=()):
+    """ Generate a pool of workers for a parallel step of the reduction
+
+    Parameters
+    ----------
+    ncpus : int
+      Number of workers
+    pool : str, optional
+      Type of pool (thread, process). Threads share memory with
+      the caller and are best suited to I/O or to routines that
+      release the GIL. The workers of a process pool receive the
+      current settings (and a logger) when they start, whichever
+      start method (fork, spawn, forkserver) is used, so any other
+      data they need must be passed with initializer and initargs.
+    initializer : callable, optional
+      Called with initargs by each worker when it starts
+    initargs : tuple, optional
+      Arguments of initializer
+
+    Returns
+    -------
+    mpool : multiprocessing.pool.ThreadPool or multiprocessing.pool.Pool
+      The caller is responsible for closing and joining the pool
+      (see mp_imap)
+    """
+    from multiprocessing.pool import Pool, ThreadPool
+    from pypit import arparse as settings
+    if pool == 'thread':
+        return ThreadPool(processes=ncpus, initializer=initializer, initargs=initargs)
+    elif pool == 'process':
+        return Pool(processes=ncpus, initializer=mp_init,
+                    initargs=(settings.argflag, settings.spect, getattr(settings, 'ftdict', dict({})),
+                              msgs._debug, msgs._verbosity, initializer, initargs))
+    else:
+        msgs.error("Pool type '{0:s}' is not recognised (thread, process)".format(pool))
+
+
+def mp_imap(func, tasks, ncpus, pool='thread', initializer=None, initargs=()):
+    """ Apply a function to each task of a parallel step of the reduction
+
+    If ncpus > 1, the tasks are distributed to a pool of workers (see
+    mp_pool). Threads suit functions that read files or release the
+    GIL, while functions that mostly run python code need processes.
+    The function (and initializer) of a process pool is pickled, so it
+    must be defined at the module level.
+
+    Parameters
+    ----------
+    func : callable
+      Called with each task
+    tasks : iterable
+      The tasks
+    ncpus : int
+      Number of workers. The tasks are performed by the caller if ncpus <= 1
+    pool : str, optional
+      Type of pool (thread, process)
+    initializer : callable, optional
+      Called with initargs by each worker when it starts (or once by
+      the caller if ncpus <= 1)
+    initargs : tuple, optional
+      Arguments of initializer
+
+    Returns
+    -------
+    A generator of the results, in the order of the tasks
+    """
+    if ncpus <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for task in tasks:
+            yield func(task)
+        return
+    mpool = mp_pool(ncpus, pool=pool, initializer=initializer, initargs=initargs)
+    done = False
+    try:
+        # imap returns the results in the order the tasks were submitted
+        for result in mpool.imap(func, tasks):
+            yield result
+        done = True
+    finally:
+        # Stop the remaining tasks if the caller did not use all results
+        if done:
+            mpool.close()
+        else:
+            mpool.terminate()
+        mpool.join()
+
+
+def mp_init(argflag, spect, ftdict, debug, verbosity, initializer=None, initargs=()):
+    """ Initialize a worker of a process pool (see mp_pool)
+
+    Workers that are not forked from the caller (e.g. with the spawn
+    start method) import pypit afresh, so the settings and the logger
+    must be set up again.
+
+    Parameters
+    ----------
+    argflag : dict
+      Arguments and flags of the settings
+    spect : dict
+      Spectrograph settings
+    ftdict : dict
+      Frame types of the settings
+    debug : dict
+      Debug flags of the logger
+    verbosity : int
+      Verbosity of the logger
+    initializer : callable, optional
+      Called with initargs after the settings are set up
+    initargs : tuple, optional
+      Arguments of initializer
+    """
+    import sys
+    from pypit import arparse as settings
+    settings.argflag, settings.spect, settings.ftdict = argflag, spect, ftdict
+    if armsgs.get_logger() is None:
+        logger = armsgs.get_logger((None, debug, verbosity))
+        # Modules imported before the logger was set up hold msgs = None
+        for name, module in list(sys.modules.items()):
+            if name.startswith('pypit') and getattr(module, 'msgs', 0) is None:
+                module.msgs = logger
+    if initializer is not None:
+        initializer(*initargs)
+
+
 def gauss_2deg(x,ampl,sigm):
     """  Simple 2 parameter Gaussian (amplitude, sigma)
     Parameters
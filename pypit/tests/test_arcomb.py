@@ -0,0 +1,106 @@
+# Module to run tests on arcomb
+
+### TEST_UNICODE_LITERALS
+
+import numpy as np
+import pytest
+
+from pypit import pyputils
+msgs = pyputils.get_dummy_logger()
+from pypit import arutils
+from pypit import arcomb
+from pypit import arparse as settings
+
+
+@pytest.fixture
+def frames():
+    np.random.seed(1234)
+    frames = np.random.normal(1000.0, 30.0, (101, 37, 5))
+    # Add a cosmic ray and a bright row
+    frames[50, 20, 2] = 1.0e5
+    frames[10, :, 3] += 500.0
+    return frames
+
+
+def test_comb_frames_blocks(frames, monkeypatch):
+    arutils.dummy_settings(spectrograph='shane_kast_blue', set_idx=False)
+    monkeypatch.setitem(settings.argflag['run'], 'ncpus', 1)
+    settings.argflag['arc']['combine']['reject']['cosmics'] = 5.0
+    settings.argflag['run']['framecube']['blocksize'] = None
+    msarc = arcomb.comb_frames(frames.copy(), 1, 'arc')
+    assert msarc.shape == (101, 37)
+    # The cosmic ray is rejected
+    assert msarc[50, 20] < 2000.0
+    # Combining blocks of rows gives identical results
+    settings.argflag['run']['framecube']['blocksize'] = 0.05
+    assert np.array_equal(msarc, arcomb.comb_frames(frames.copy(), 1, 'arc'))
+
+
+def test_comb_frames_lowhigh(frames):
+    arutils.dummy_settings(spectrograph='shane_kast_blue', set_idx=False)
+    settings.argflag['arc']['combine']['method'] = 'mean'
+    settings.argflag['arc']['combine']['satpix'] = 'nothing'
+    settings.argflag['arc']['combine']['reject']['level'] = [-1.0, -1.0]
+    settings.argflag['arc']['combine']['reject']['lowhigh'] = [1, 2]
+    msarc = arcomb.comb_frames(frames.copy(), 1, 'arc')
+    # Compare with the mean of the sorted values
+    assert np.allclose(msarc, np.mean(np.sort(frames, axis=2)[:, :, 1:-2], axis=2))
+
+
+def test_masked_lowhigh():
+    from pypit import arcycomb
+    maskvalue = 1048577.0
+    frames = np.array([[[5.0, 1.0, maskvalue, 3.0, 9.0, 1.0]]])
+    # The frames are not reordered, and masked values are ignored
+    rej = arcycomb.masked_lowhigh(frames.copy(), 1, 1, maskvalue)
+    assert np.array_equal(rej[0, 0], [5.0, maskvalue, maskvalue, 3.0, maskvalue, 1.0])
+    rej = arcycomb.masked_lowhigh(frames.copy(), 2, 2, maskvalue)
+    assert np.sum(rej[0, 0] != maskvalue) == 1
+    rej = arcycomb.masked_lowhigh(frames.copy(), 3, 3, maskvalue)
+    assert np.all(rej[0, 0] == maskvalue)
+
+
+def test_comb_frames_weights(frames):
+    arutils.dummy_settings(spectrograph='shane_kast_blue', set_idx=False)
+    settings.argflag['arc']['combine']['method'] = 'mean'
+    settings.argflag['arc']['combine']['satpix'] = 'nothing'
+    settings.argflag['arc']['combine']['reject']['level'] = [-1.0, -1.0]
+    weights = np.array([1.0, 2.0, 0.0, 3.0, 4.0])
+    msarc = arcomb.comb_frames(frames.copy(), 1, 'arc', weights=weights)
+    assert np.allclose(msarc, np.average(frames, axis=2, weights=weights))
+    # User-supplied and exposure time weights
+    settings.argflag['arc']['combine']['weights'] = weights.tolist()
+    assert np.array_equal(msarc, arcomb.comb_frames(frames.copy(), 1, 'arc'))
+    settings.argflag['arc']['combine']['weights'] = 'exptime'
+    assert np.allclose(msarc, arcomb.comb_frames(frames.copy(), 1, 'arc', exptime=10*weights))
+    # Frames with no exposure time (e.g. bias frames) are given equal weight
+    assert np.allclose(arcomb.comb_frames(frames.copy(), 1, 'arc', exptime=np.zeros(5)), np.mean(frames, axis=2))
+
+
+def test_comb_sets(frames):
+    arutils.dummy_settings(spectrograph='shane_kast_blue', set_idx=False)
+    settings.argflag['arc']['combine']['method'] = 'mean'
+    settings.argflag['arc']['combine']['satpix'] = 'nothing'
+    settings.argflag['arc']['combine']['reject']['level'] = [-1.0, -1.0]
+    # The weights of the individual frames do not apply to the matched sets
+    settings.argflag['arc']['combine']['weights'] = [1.0, 2.0, 0.0, 3.0, 4.0]
+    sframes = [frames[:, :, :2], frames[:, :, 2:]]
+    msarc = arcomb.comb_sets(sframes, 1, 'arc')
+    assert np.allclose(msarc, np.mean(frames, axis=2))
+
+
+def test_masked_sigclip(frames):
+    from pypit import arcycomb
+    maskvalue = 1048577.0
+    # One iteration about the median is identical to a median/MAD rejection
+    medarr = np.median(frames, axis=2)
+    stdarr = 1.4826*np.median(np.abs(frames-medarr[:, :, np.newaxis]), axis=2)
+    rej = arcycomb.masked_sigclip(frames.copy(), 2.0, 2.0, 1, 1, maskvalue)
+    mask = (frames < (medarr - 2.0*stdarr)[:, :, np.newaxis]) | (frames > (medarr + 2.0*stdarr)[:, :, np.newaxis])
+    assert np.array_equal(rej == maskvalue, mask)
+    # Iterate about the mean
+    vals = np.array([[[10.0, 11.0, 9.0, 10.5, 9.5, 10.0, 14.0, 100.0]]])
+    rej = arcycomb.masked_sigclip(vals.copy(), 2.0, 2.0, 1, 0, maskvalue)
+    assert np.sum(rej == maskvalue) == 1
+    rej = arcycomb.masked_sigclip(vals.copy(), 2.0, 2.0, 5, 0, maskvalue)
+    assert np.array_equal(rej == maskvalue, vals > 12.0)
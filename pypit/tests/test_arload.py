@@ -24,9 +24,63 @@ def test_load_headers():
     kast_files = [data_path('b1.fits.gz'), data_path('b27.fits.gz')]
     fitsdict, updates = arl.load_headers(kast_files)
     # Test
-    headers = fitsdict['headers']
-    assert len(headers) == 2
-    assert headers[0][0]['OBJECT'] == 'Arcs'
+    assert len(fitsdict['filename']) == 2
+    assert 'headers' not in fitsdict.keys()
+    assert fitsdict['target'][0] == 'Arcs'
+    # The full headers are read on demand
+    assert arl.get_header(fitsdict, 0)['OBJECT'] == 'Arcs'
+
+def test_load_headers_threads(monkeypatch):
+    from pypit import arparse as settings
+    arutils.dummy_settings(spectrograph='shane_kast_blue', set_idx=False)
+    kast_files = [data_path('b1.fits.gz'), data_path('b27.fits.gz'), data_path('b1.fits.gz')]
+    monkeypatch.setitem(settings.argflag['run'], 'ncpus', 1)
+    fitsdict, updates = arl.load_headers(kast_files)
+    # Read the headers concurrently (the order of the files must be preserved)
+    monkeypatch.setitem(settings.argflag['run'], 'maxopen', 2)
+    tfitsdict, tupdates = arl.load_headers(kast_files)
+    assert tupdates == updates
+    for key in fitsdict.keys():
+        assert np.array_equal(tfitsdict[key], fitsdict[key])
+
+def test_load_headers_cache():
+    from pypit import arparse as settings
+    arutils.dummy_settings(spectrograph='shane_kast_blue', set_idx=False)
+    kast_files = [data_path('b1.fits.gz'), data_path('b27.fits.gz')]
+    fitsdict, updates = arl.load_headers(kast_files)
+    cache_file = data_path('test_headers.cache')
+    if os.path.isfile(cache_file):
+        os.remove(cache_file)
+    settings.argflag['run']['headercache'] = cache_file
+    # Generate the cache, then load the headers from the cache
+    for ii in range(2):
+        cfitsdict, cupdates = arl.load_headers(kast_files)
+        assert cupdates == updates
+        for key in fitsdict.keys():
+            assert np.array_equal(cfitsdict[key], fitsdict[key])
+    os.remove(cache_file)
+
+def test_load_frames(monkeypatch):
+    from pypit import arparse as settings
+    arutils.dummy_settings(spectrograph='shane_kast_blue', set_idx=False)
+    kast_files = [data_path('b1.fits.gz'), data_path('b27.fits.gz'), data_path('b1.fits.gz')]
+    fitsdict, updates = arl.load_headers(kast_files)
+    # Serial
+    monkeypatch.setitem(settings.argflag['run'], 'ncpus', 1)
+    frames = arl.load_frames(fitsdict, [0, 1, 2], 1, frametype='bias')
+    assert frames.shape[2] == 3
+    assert np.array_equal(frames[:, :, 0], frames[:, :, 2])
+    # The threads insert the frames directly into the cube
+    monkeypatch.setitem(settings.argflag['run'], 'ncpus', 2)
+    monkeypatch.setitem(settings.argflag['run'], 'pool', 'thread')
+    assert np.array_equal(frames, arl.load_frames(fitsdict, [0, 1, 2], 1, frametype='bias'))
+    # Memory-mapped, single precision frame cube
+    settings.argflag['run']['framecube']['memmap'] = True
+    settings.argflag['run']['framecube']['dtype'] = 'float32'
+    mframes = arl.load_frames(fitsdict, [0, 1, 2], 1, frametype='bias')
+    assert isinstance(mframes, np.memmap)
+    assert mframes.dtype == np.float32
+    assert np.array_equal(frames, mframes)
 
 def test_load_specobj():
     spec_file = data_path('spec1d_J0025-0312_KASTr_2015Jan23T025323.85.fits')
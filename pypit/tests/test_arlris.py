@@ -0,0 +1,73 @@
+# Module to run tests on arlris
+
+import numpy as np
+import os
+import pytest
+
+import astropy.io.fits as pyfits
+
+from pypit import pyputils
+msgs = pyputils.get_dummy_logger()
+from pypit import arlris
+
+
+def data_path(filename):
+    data_dir = os.path.join(os.path.dirname(__file__), 'files')
+    return os.path.join(data_dir, filename)
+
+
+def mk_lris(filename, xbin=2, ybin=2):
+    """ Generate a raw LRIS file, where each amplifier has a constant value
+    equal to its position on the mosaic (1-4), with pre- and post-scan
+    values of -1 and -2.
+    """
+    precol, postpix, postline = 12, 80, 20
+    head0 = pyfits.Header()
+    head0['PRECOL'], head0['POSTPIX'] = precol, postpix
+    head0['PRELINE'], head0['POSTLINE'] = 0, postline
+    head0['BINNING'] = '{:d},{:d}'.format(xbin, ybin)
+    hdus = [pyfits.PrimaryHDU(np.zeros((1, 1), dtype=np.uint16), header=head0)]
+    detsecs = ['[1:1024,1:4096]', '[2048:1025,1:4096]', '[2049:3072,4096:1]', '[4096:3073,1:4096]']
+    nxt = (1024+precol+postpix)//xbin
+    for i in [2, 0, 3, 1]:
+        data = np.zeros((4096//ybin+postline, nxt))
+        data[:, :precol//xbin] = -1.0
+        data[:, precol//xbin:nxt-postpix//xbin] = i+1
+        data[:, nxt-postpix//xbin:] = -2.0
+        hdu = pyfits.ImageHDU(data)
+        hdu.header['DETSEC'] = detsecs[i]
+        hdu.header['DATASEC'] = '[{:d}:{:d},1:{:d}]'.format(precol//xbin+1, (precol+1024)//xbin, 4096//ybin)
+        hdus.append(hdu)
+    pyfits.HDUList(hdus).writeto(filename, overwrite=True)
+
+
+def test_read_lris():
+    lris_file = data_path('test_lris.fits')
+    mk_lris(lris_file)
+    for det in [1, 2]:
+        array, head0, sections = arlris.read_lris(lris_file, det=det)
+        assert array.shape == (2068, 1116)
+        assert array.flags['C_CONTIGUOUS']
+        # Pre-scan, data of each amplifier, and post-scan
+        assert np.all(array[:, :12] == -1.0)
+        assert np.all(array[:, 12:524] == 2*det-1)
+        assert np.all(array[:, 524:1036] == 2*det)
+        assert np.all(array[:, 1036:] == -2.0)
+        assert sections[0] == ['[0:2048,12:524]', '[0:2048,524:1036]']
+        assert sections[1] == ['[:,1036:1076]', '[:,1076:1116]']
+    # The layout is cached
+    assert len(arlris._lris_layouts) >= 2
+    array, _, _ = arlris.read_lris(lris_file, det=2)
+    assert np.all(array[:, 12:524] == 3)
+    os.remove(lris_file)
+
+
+def test_read_lris_layout():
+    lris_file = data_path('test_lris.fits')
+    mk_lris(lris_file, xbin=1, ybin=1)
+    array, head0, sections = arlris.read_lris(lris_file, det=1)
+    # The layout is determined from the headers alone
+    layout = arlris.read_lris_layout(lris_file, det=1)
+    assert layout['shape'] == array.shape
+    assert layout['sections'] == sections
+    os.remove(lris_file)
@@ -0,0 +1,208 @@
+# Module to run tests on arproc
+
+import numpy as np
+import pytest
+
+from scipy import signal
+
+from pypit import pyputils
+msgs = pyputils.get_dummy_logger()
+from pypit import arproc
+from pypit import arutils
+
+
+@pytest.fixture
+def crframe():
+    np.random.seed(1234)
+    frame = np.random.normal(200.0, 15.0, (120, 90))
+    # Cosmic rays and a saturated star
+    frame[20, 30] += 3000.0
+    frame[60:62, 10] += 2000.0
+    frame[100, 80] += 1500.0
+    frame[80:83, 40:43] = 1.0e6
+    return frame
+
+
+def test_lacosmic_laplacian(crframe):
+    # Subsample, convolve with a Laplacian kernel, clip and rebin
+    laplkernel = np.array([[0.0, -1.0, 0.0], [-1.0, 4.0, -1.0], [0.0, -1.0, 0.0]])
+    conved = signal.convolve2d(arutils.subsample(crframe), laplkernel, mode="same", boundary="symm")
+    lplus = arutils.rebin(conved.clip(min=0.0), np.array(crframe.shape))
+    assert np.allclose(arproc.lacosmic_laplacian(crframe), lplus, rtol=1e-12, atol=1e-9)
+
+
+def test_lacosmic_block(crframe):
+    satlev = 1.0e5
+    crmask, counts = arproc.lacosmic_block(crframe, None, satlev, (0, crframe.shape[0]))
+    assert crmask[20, 30] and crmask[60, 10] and crmask[100, 80]
+    # The saturated star is not a cosmic ray
+    assert not np.any(crmask[80:83, 40:43])
+    # Searching blocks of rows gives the same mask
+    for nrows in [7, 50]:
+        bmask = np.concatenate([arproc.lacosmic_block(crframe, None, satlev, (r0, min(r0+nrows, crframe.shape[0])))[0]
+                                for r0 in range(0, crframe.shape[0], nrows)])
+        assert np.array_equal(bmask, crmask)
+    # Single precision
+    smask, _ = arproc.lacosmic_block(crframe.astype(np.float32), None, satlev, (0, crframe.shape[0]))
+    assert np.array_equal(smask, crmask)
+
+
+def test_stack_cosmics():
+    arutils.dummy_settings(spectrograph='shane_kast_blue', set_idx=True)
+    fitsdict = arutils.dummy_fitsdict()
+    slf = arutils.dummy_self(fitsdict=fitsdict)
+    np.random.seed(1234)
+    # Four registered exposures of a source (one with twice the exposure time)
+    shape = (120, 90)
+    stkidx = [4, 5, 6, 7]
+    fitsdict['exptime'][4:8] = [300.0, 300.0, 300.0, 600.0]
+    scene = np.full(shape, 200.0)
+    scene[:, 50:53] += 1000.0
+    stack = np.random.normal(scene[:, :, np.newaxis], 15.0, shape + (4,))
+    stack[:, :, 3] += scene
+    # Cosmic rays in the science frame, and in two exposures at the same pixel
+    stack[20, 30, 0] += 3000.0
+    stack[60:62, 10, 0] += 2000.0
+    stack[100, 80, 0] += 1500.0
+    stack[100, 80, 1] += 1500.0
+    slf._datasec[0] = np.ones(shape)
+    slf._bpix[0] = np.zeros(shape)
+    crmask, unresolved = arproc.stack_cosmics(slf, fitsdict, 1, stack, stkidx, 4, grow=0.5)
+    assert crmask[20, 30] and crmask[60, 10] and crmask[61, 10]
+    assert np.sum(crmask) == 3
+    # The exposures cannot tell which of them are affected by the last cosmic ray
+    assert unresolved[100, 80] and not crmask[100, 80]
+    # The other exposures do not include cosmic rays
+    crmask, unresolved = arproc.stack_cosmics(slf, fitsdict, 1, stack, stkidx, 7)
+    assert not np.any(crmask)
+
+
+def test_stack_register():
+    arutils.dummy_settings(spectrograph='shane_kast_blue', set_idx=True)
+    slf = arutils.dummy_self()
+    np.random.seed(1234)
+    nspec, nspat = 150, 80
+    slf._lordloc[0] = np.outer(np.ones(nspec), [5.0, 45.0]) + np.linspace(0.0, 3.0, nspec)[:, np.newaxis]
+    slf._rordloc[0] = slf._lordloc[0] + 30.0
+    slf._pixwid[0] = np.array([30, 30])
+    # An ABBA nod along the first slit (the last exposure is slightly offset)
+    xx = np.arange(nspat)[np.newaxis, :] - slf._lordloc[0][:, :1]
+    stkidx = [4, 5, 6, 7]
+    stack = np.zeros((nspec, nspat, 4))
+    for i, objpos in enumerate([10.0, 20.0, 20.0, 10.2]):
+        stack[:, :, i] = 200.0 + 500.0*np.exp(-0.5*((xx-objpos)/1.5)**2)
+    stack = np.random.normal(stack, 15.0)
+    registered = arproc.stack_register(slf, 1, stack, stkidx, 4)
+    assert np.array_equal(registered, [True, False, False, True])
+    registered = arproc.stack_register(slf, 1, stack, stkidx, 5)
+    assert np.array_equal(registered, [False, True, True, False])
+    # Without an object, all exposures are kept
+    stack = np.random.normal(200.0, 15.0, stack.shape)
+    assert np.all(arproc.stack_register(slf, 1, stack, stkidx, 4))
+
+
+def test_bg_reject_bins():
+    np.random.seed(1234)
+    nspec, nspat = 200, 30
+    tilts = (np.arange(nspec)[:, np.newaxis] + 0.3*np.random.rand(nspec, nspat))/(nspec-1)
+    sciframe = np.random.normal(100.0, 10.0, (nspec, nspat))
+    sciframe[:, 14:17] += 500.0*np.random.rand(nspec, 3)
+    sciframe[np.random.rand(nspec, nspat) < 0.01] += 3000.0
+    sxvpix = np.sort(tilts.flatten())
+    sscipix = sciframe.flatten()[np.argsort(tilts.flatten())]
+    edges = np.linspace(0.0, max(1.0, np.max(sxvpix)), nspec)
+    # Some pixels are on the edges of the bins
+    sxvpix[::97] = edges[np.arange(0, sxvpix.size, 97) // nspat]
+    sxvpix.sort()
+    maskpix, fitcls = arproc.bg_reject_bins(sxvpix, sscipix, edges)
+    # Compare with a robust fit of each bin
+    for i in range(nspec-1):
+        wpix = np.where((sxvpix >= edges[i]) & (sxvpix <= edges[i+1]))[0]
+        msk, cf = arutils.robust_polyfit(sxvpix[wpix], sscipix[wpix], 0, sigma=3.0)
+        # The mask of the pixels on the upper edge is set by the next bin
+        lower = (sxvpix[wpix] < edges[i+1]) | (i+1 == nspec-1)
+        assert np.array_equal(maskpix[wpix][lower], msk[lower])
+    assert np.sum(maskpix) > 0
+
+
+def test_bg_subtraction(monkeypatch):
+    from pypit import arparse as settings
+    from pypit import artrace
+    arutils.dummy_settings(spectrograph='shane_kast_blue', set_idx=True)
+    slf = arutils.dummy_self()
+    np.random.seed(1234)
+    # Two slits with a different sky spectrum, and an object in the second slit
+    nspec, nspat = 200, 60
+    lordloc = np.outer(np.ones(nspec), [4.5, 31.5])
+    rordloc = np.outer(np.ones(nspec), [25.5, 55.5])
+    slitpix = np.zeros((nspec, nspat), dtype=np.int)
+    slitpix[:, 5:26] = 1
+    slitpix[:, 32:56] = 2
+    spec = np.arange(nspec)[:, np.newaxis] + 0.02*np.arange(nspat)[np.newaxis, :]
+    sky = np.zeros((nspec, nspat))
+    sky[:, :30] = 100.0 + 50.0*np.sin(spec[:, :30]/10.0)
+    sky[:, 30:] = 300.0 + 100.0*np.cos(spec[:, 30:]/15.0)
+    sciframe = np.random.normal(sky, 5.0)
+    sciframe[:, 42:45] += 1000.0
+    slf._slitpix[0] = slitpix
+    slf._tilts[0] = spec/(nspec-1)
+    slf._lordloc[0], slf._rordloc[0] = lordloc, rordloc
+    slf._pixlocn[0] = artrace.gen_pixloc(sciframe, 1, gen=True)
+    slf._bpix[0] = np.zeros((nspec, nspat))
+    varframe = np.full((nspec, nspat), 25.0)
+    crmask = np.zeros((nspec, nspat))
+    monkeypatch.setitem(settings.argflag['run'], 'ncpus', 1)
+    bgframe = arproc.bg_subtraction(slf, 1, sciframe, varframe, crmask)
+    # The sky of each slit is modelled, and the object is rejected
+    assert np.all(bgframe[slitpix == 0] == 0.0)
+    assert np.all(np.abs(bgframe - sky)[1:-1][slitpix[1:-1] != 0] < 5.0)
+
+
+def test_slit_pixels():
+    from pypit import arparse as settings
+    arutils.dummy_settings(spectrograph='shane_kast_blue', set_idx=True)
+    slf = arutils.dummy_self()
+    np.random.seed(1234)
+    nrow, ncol, nslit = 200, 100, 6
+    # Overlapping slits, and slits that fall off the edges of the frame
+    cen = np.linspace(-5.0, ncol+5.0, nslit)[np.newaxis, :] + np.random.normal(0.0, 0.5, (nrow, nslit))
+    wid = np.array([8.0, 15.0, 5.0, 12.0, 9.0, 10.0])
+    slf._lordloc[0] = cen - wid
+    slf._rordloc[0] = cen + wid
+    settings.argflag['trace']['slits']['pad'] = 1
+    slitpix = arproc.slit_pixels(slf, (nrow, ncol), 1)
+    assert slitpix.dtype == np.int16
+    # Fill each slit in turn
+    expected = np.zeros((nrow, ncol))
+    for o in range(nslit):
+        for x in range(nrow):
+            ymin = max(int(cen[x, o]-wid[o])-1, 0)
+            ymax = min(int(cen[x, o]+wid[o])+2, ncol-1)
+            expected[x, ymin:ymax] = o+1
+    assert np.array_equal(slitpix, expected)
+
+
+def test_slit_profile(monkeypatch):
+    from pypit import arparse as settings
+    arutils.dummy_settings(spectrograph='shane_kast_blue', set_idx=True)
+    slf = arutils.dummy_self()
+    np.random.seed(1234)
+    # Three slits on a detector with two amplifiers of different gain
+    nspec, nspat, nslit = 300, 120, 3
+    cen = np.array([20.0, 60.0, 100.0])[np.newaxis, :] + np.sin(np.arange(nspec)/50.0)[:, np.newaxis]
+    slf._lordloc[0], slf._rordloc[0] = cen-12.0, cen+12.0
+    slf._pixwid[0] = np.full(nslit, 24)
+    slf._slitpix[0] = arproc.slit_pixels(slf, (nspec, nspat), 1)
+    slf._tilts[0] = np.outer(np.linspace(0.0, 1.0, nspec), np.ones(nspat))
+    slf._datasec[0] = np.ones((nspec, nspat), dtype=np.int)
+    slf._datasec[0][:, 80:] = 2
+    blaze = 1000.0*(1.0 + 0.5*np.sin(6.0*slf._tilts[0]))
+    mstrace = np.random.normal(blaze, 5.0) * np.where(slf._datasec[0] == 2, 1.2, 1.0)
+    monkeypatch.setitem(settings.argflag['run'], 'ncpus', 1)
+    settings.argflag['reduce']['slitprofile']['perform'] = True
+    slit_profiles, mstracenrm, msblaze, blazeext, extrap_slit = arproc.slit_profile(slf, mstrace.copy(), 1)
+    # The amplifier gains are corrected, and the blaze function is removed
+    inslit = slf._slitpix[0] != 0
+    assert np.all(np.abs(mstracenrm[inslit] - 1.0) < 0.05)
+    assert np.all(np.abs(msblaze[1:-1] - 1000.0*(1.0 + 0.5*np.sin(np.linspace(0.0, 6.0, nspec)))[1:-1, np.newaxis]) < 10.0)
+    assert np.all(slit_profiles[~inslit] == 1.0)
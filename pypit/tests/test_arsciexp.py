@@ -0,0 +1,71 @@
+# Module to run tests on arsciexp module
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+import pytest
+
+from pypit import pyputils
+msgs = pyputils.get_dummy_logger()
+from pypit import arutils as arut
+
+
+def test_slit_index():
+    arut.dummy_settings(spectrograph='shane_kast_blue', set_idx=True)
+    slf = arut.dummy_self()
+    # Three slits (the second one is empty)
+    slitpix = np.zeros((50, 40), dtype=np.int)
+    slitpix[5:45, 2:10] = 1
+    slitpix[10:20, 25:31] = 3
+    slitpix[30, 32] = 3
+    slf._slitpix[0] = slitpix
+    slf._scimask[0] = np.zeros(slitpix.shape, dtype=np.int)
+    slf._scimask[0][6, 3] = 2
+    for sl in range(4):
+        word = slf.GetSlitPixels(1, sl)
+        assert np.array_equal(word[0], np.where(slitpix == sl+1)[0])
+        assert np.array_equal(word[1], np.where(slitpix == sl+1)[1])
+    assert slf.GetSlitPixels(1, 0, unmasked=True)[0].size == 8*40 - 1
+    # Cropped sub-images
+    assert slf.GetSlitCrop(1, 0) == (slice(5, 45), slice(2, 10))
+    assert slf.GetSlitCrop(1, 2) == (slice(10, 31), slice(25, 33))
+    assert np.sum(slitpix[slf.GetSlitCrop(1, 1)]) == 0
+    # The index is updated when the slits are replaced
+    slf._slitpix[0] = np.zeros_like(slitpix)
+    assert slf.GetSlitPixels(1, 0)[0].size == 0
+
+
+def test_noise_model():
+    from pypit import arparse as settings
+    from pypit import arproc
+    arut.dummy_settings(spectrograph='shane_kast_blue', set_idx=True)
+    slf = arut.dummy_self()
+    fitsdict = arut.dummy_fitsdict()
+    dnum = settings.get_dnum(1)
+    datasec = np.zeros((50, 40))
+    datasec[:, :20] = 1
+    datasec[:, 20:38] = 2
+    slf._datasec[0] = datasec
+    settings.spect[dnum]['gain'] = [1.2, 1.5]
+    settings.spect[dnum]['ronoise'] = [3.0, 4.0]
+    noise = slf.NoiseModel(1)
+    assert np.all(noise['gain'][:, :20] == 1.2) & np.all(noise['gain'][:, 38:] == 0.0)
+    assert np.all(noise['rn2'][:, 20:38] == 4.0**2 + 0.75**2)
+    assert slf.NoiseModel(1) is noise
+    assert arproc.rn_frame(slf, 1) is noise['rn2']
+    # The model is updated when the detector settings change
+    settings.spect[dnum]['gain'] = [1.0, 1.5]
+    assert np.all(arproc.gain_frame(slf, 1)[:, :20] == 1.0)
+    # Variance frames
+    np.random.seed(1234)
+    sciframe = np.random.normal(100.0, 20.0, datasec.shape)
+    rnoise = slf.NoiseModel(1)['rn2']
+    dnoise = settings.spect[dnum]['darkcurr'] * float(fitsdict['exptime'][2])/3600.0
+    varframe = arproc.variance_frame(slf, 1, sciframe, 2, fitsdict)
+    assert np.allclose(varframe, np.abs(sciframe) + rnoise + dnoise)
+    modvar = np.abs(sciframe + 10.0 - np.sqrt(2)*np.sqrt(rnoise)) + rnoise
+    assert np.allclose(arproc.variance_frame(slf, 1, None, 2, skyframe=sciframe, objframe=np.full(datasec.shape, 10.0)),
+                       modvar)
+    # The variance can be stored in an existing frame
+    out = arproc.variance_frame(slf, 1, sciframe, 2, fitsdict, out=varframe)
+    assert out is varframe
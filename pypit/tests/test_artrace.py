@@ -0,0 +1,127 @@
+# Module to run tests on artrace
+
+# TEST_UNICODE_LITERALS
+
+import numpy as np
+import pytest
+
+from pypit import pyputils
+msgs = pyputils.get_dummy_logger()
+from pypit import artrace
+
+
+def test_rectify_slit():
+    import scipy.interpolate as interp
+    np.random.seed(1234)
+    nrow, ncol, npix = 100, 60, 15
+    frame = np.random.normal(0.0, 1.0, (nrow, ncol))
+    lordloc = 20.3 + 3.0*np.sin(np.arange(nrow)/20.0)
+    rordloc = lordloc + 16.5
+    # The slit falls off the edge of the detector at the first rows
+    lordloc[:5] = -2.5
+    rmap = artrace.rectify_map(1, 0, lordloc, rordloc, ncol, npix)
+    rec_frame = artrace.rectify_slit(frame, rmap)
+    # Compare to a bilinear interpolation of the full frame
+    xint, yint = np.linspace(0.0, 1.0, nrow), np.linspace(0.0, 1.0, ncol)
+    spl = interp.RectBivariateSpline(xint, yint, frame, bbox=[0.0, 1.0, 0.0, 1.0], kx=1, ky=1, s=0)
+    xx, yy = np.meshgrid(xint, np.linspace(0.0, 1.0, npix), indexing='ij')
+    vv = (lordloc.reshape((-1, 1)) + (rordloc-lordloc).reshape((-1, 1))*yy) / (ncol - 1.0)
+    assert np.allclose(rec_frame, spl.ev(xx.flatten(), vv.flatten()).reshape((nrow, npix)))
+    # The coordinate map is reused until the slit edges change
+    assert artrace.rectify_map(1, 0, lordloc.copy(), rordloc, ncol, npix) is rmap
+    assert artrace.rectify_map(1, 0, lordloc+1.0, rordloc, ncol, npix) is not rmap
+
+
+def test_aperture():
+    nrow, ncol = 50, 40
+    lordloc = 10.25 + 0.1*np.arange(nrow)
+    lordloc[:3] = -4.5
+    weights = np.zeros(15)
+    weights[4:9] = 1.0
+    aperture = artrace.aperture_dict((nrow, ncol), lordloc, weights)
+    image = artrace.aperture_image(aperture)
+    assert image.shape == (nrow, ncol)
+    # The weights are one within the object, and fall linearly to zero one pixel beyond
+    for row in [0, 10, 49]:
+        uu = np.arange(ncol) - lordloc[row]
+        expected = np.clip(np.minimum(uu - 3.0, 9.0 - uu), 0.0, 1.0)
+        assert np.allclose(image[row], expected)
+        assert np.all(image[row, :aperture['start'][row]] == 0.0)
+        assert np.all(image[row, aperture['stop'][row]:] == 0.0)
+    # Cutouts of the aperture
+    crop = artrace.aperture_crop(aperture)
+    assert np.sum(image[crop]) == np.sum(image)
+    assert np.array_equal(artrace.aperture_image(aperture, crop), image[crop])
+    sub = (slice(5, 20), slice(12, 18))
+    assert np.array_equal(artrace.aperture_image(aperture, sub), image[sub])
+    # An empty aperture
+    empty = artrace.aperture_dict((nrow, ncol), lordloc, np.zeros(15))
+    assert artrace.aperture_crop(empty) == (slice(0, 0), slice(0, 0))
+    assert np.all(artrace.aperture_image(empty) == 0.0)
+
+
+def test_refine_objects():
+    from pypit import arutils
+    arutils.dummy_settings(spectrograph='shane_kast_blue', set_idx=True)
+    slf = arutils.dummy_self()
+    np.random.seed(1234)
+    nspec, nspat = 200, 60
+    slf._lordloc[0] = np.full((nspec, 1), 10.0)
+    slf._rordloc[0] = np.full((nspec, 1), 50.0)
+    # An object with a tilted trace
+    objcen = 30.7 + 2.0*np.arange(nspec)/nspec
+    sciframe = 100.0*np.exp(-0.5*((np.arange(nspat)[np.newaxis, :] - objcen[:, np.newaxis])/1.5)**2)
+    sciframe += np.random.normal(0.0, 0.1, sciframe.shape)
+    # A first pass trace that is offset from the object
+    traces = (objcen - 1.0).reshape((-1, 1))
+    weights = np.zeros(36)
+    weights[16:23] = 1.0
+    lordloc = traces[:, 0] - 19.0
+    aperture = artrace.aperture_dict(sciframe.shape, lordloc, weights)
+    tracelist = artrace.trace_object_dict(1, traces, object=[aperture], background=[aperture],
+                                          edges=[traces-3.0, traces+3.0])
+    newlist = artrace.refine_objects(slf, 1, sciframe, tracelist, doqa=False)
+    assert np.all(np.abs(newlist[0]['traces'][:, 0] - objcen) < 0.1)
+    # The edges and apertures follow the trace, and the first pass is not modified
+    shift = newlist[0]['traces'] - traces
+    assert np.allclose(newlist[0]['edges'][0], traces-3.0+shift)
+    assert np.allclose(newlist[0]['object'][0]['lordloc'], lordloc+shift[:, 0])
+    assert np.array_equal(tracelist[0]['traces'], traces)
+
+
+def _stub_trace_object(slf, det, sciframe, varframe, crmask, slitn=0, doqa=True, fail=None, **kwargs):
+    # Stands in for trace_object, which requires arcytrace
+    if slitn == fail:
+        raise SystemExit(1)
+    assert (det, slitn) in artrace._rectify_maps
+    return [dict(slitn=slitn, flux=sciframe[0, slitn] + varframe[0, slitn], ncr=np.sum(crmask))]
+
+
+def test_trace_objects(monkeypatch):
+    from pypit import arparse as settings
+    from pypit import arutils
+    arutils.dummy_settings(spectrograph='shane_kast_blue', set_idx=True)
+    slf = arutils.dummy_self()
+    nspec, nspat, nslit = 50, 40, 5
+    slf._lordloc[0] = np.outer(np.ones(nspec), 2.0 + 7.0*np.arange(nslit))
+    slf._rordloc[0] = slf._lordloc[0] + 6.0
+    slf._pixwid[0] = np.full(nslit, 6)
+    sciframe = np.arange(nspec*nspat, dtype=np.float).reshape((nspec, nspat))
+    varframe = np.ones_like(sciframe)
+    crmask = np.zeros_like(sciframe)
+    crmask[3, 4] = 1.0
+    monkeypatch.setattr(artrace, 'trace_object', _stub_trace_object)
+    artrace._rectify_maps.clear()
+    for ncpus in [1, 2]:
+        monkeypatch.setitem(settings.argflag['run'], 'ncpus', ncpus)
+        tracelist = artrace.trace_objects(slf, 1, sciframe, varframe, crmask, doqa=False, trim=1)
+        # The slits are returned in order
+        assert [tracedict['slitn'] for tracedict in tracelist] == list(range(nslit))
+        assert [tracedict['flux'] for tracedict in tracelist] == [sl+1.0 for sl in range(nslit)]
+        assert all([tracedict['ncr'] == 1.0 for tracedict in tracelist])
+        # The coordinate maps are cached by the caller
+        assert all([(1, sl) in artrace._rectify_maps for sl in range(nslit)])
+        assert artrace._trace_frames == dict({})
+        # A failure in one slit exits in the caller
+        with pytest.raises(SystemExit):
+            artrace.trace_objects(slf, 1, sciframe, varframe, crmask, doqa=False, fail=3)
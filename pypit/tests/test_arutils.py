@@ -34,6 +34,29 @@ def test_func_fit():
         1.58666296,  2.22132814,  3.14159265,  3.14159265,  3.14159265], atol=1e-5)
 
 
+def test_bspline_iterfit():
+    """ Compare the banded bspline solver with scipy
+    """
+    from scipy import interpolate
+    np.random.seed(1234)
+    x = np.sort(np.random.uniform(0.0, 1.0, 5000))
+    y = 100.0 + 50.0*np.sin(20.0*x) + np.random.normal(0.0, 3.0, x.size)
+    ivar = np.random.uniform(0.05, 0.2, x.size)
+    # Least-squares fit without rejection, with the same knots
+    mask, tck = arut.bspline_iterfit(x, y, ivar=ivar, everyn=50, maxiter=0)
+    stck = interpolate.splrep(x, y, w=np.sqrt(ivar), k=3, t=tck[0][4:-4])
+    xv = np.linspace(x[0], x[-1], 1000)
+    np.testing.assert_allclose(arut.bspline_val(tck, xv), interpolate.splev(xv, stck), rtol=1e-9)
+    # Reject outliers
+    y[::100] += 500.0
+    mask, tck = arut.bspline_iterfit(x, y, ivar=ivar, everyn=50, sigma=5.0)
+    assert np.all(mask[::100] == 1)
+    assert np.sum(mask) < 2*x.size//100
+    # Evaluate onto an image
+    img = np.outer(xv[:100], np.ones(7))
+    assert np.array_equal(arut.bspline_val(tck, img, nchunk=64)[:, 3], arut.func_val(tck, xv[:100], 'bspline'))
+
+
 def test_calc_ivar():
     """ Run the parameter setup script
     """
@@ -41,3 +64,28 @@ def test_calc_ivar():
     res = arut.calc_ivar(x)
     assert np.array_equal(res, np.array([0.0, 0.0, 0.0, 10.0, 1.0]))
     assert np.array_equal(arut.calc_ivar(res), np.array([0.0, 0.0, 0.0, 0.1, 1.0]))
+
+
+_mp_offset = dict({})
+
+
+def _mp_init(offset):
+    _mp_offset['offset'] = offset
+
+
+def _mp_add(x):
+    return x + _mp_offset['offset']
+
+
+def test_mp_imap():
+    arut.dummy_settings(spectrograph='shane_kast_blue', set_idx=False)
+    tasks = np.arange(20.0)
+    # The results are identical, and in order, serially and in parallel
+    for ncpus, pool in [(1, 'thread'), (3, 'thread'), (3, 'process')]:
+        _mp_offset.clear()
+        results = list(arut.mp_imap(_mp_add, iter(tasks), ncpus, pool=pool, initializer=_mp_init, initargs=(0.5,)))
+        assert np.array_equal(results, tasks+0.5)
+    # The caller may stop before all tasks are performed
+    results = arut.mp_imap(_mp_add, tasks, 3, pool='process', initializer=_mp_init, initargs=(1.0,))
+    assert next(results) == 1.0
+    results.close()
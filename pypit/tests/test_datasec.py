@@ -33,3 +33,22 @@ def test_ampsec(fitsdict):
     assert np.sum(np.isclose(slf._datasec[0], 2)) == 2162688  # second amp
     assert settings.spect['det01']['oscansec01'] == [[0, 0], [2049, 2080]]
     assert settings.spect['det01']['datasec01'] == [[0, 0], [0, 1024]]
+
+
+def test_sub_overscan_trim():
+    arutils.dummy_settings(spectrograph='shane_kast_blue')
+    settings.argflag['reduce']['overscan']['method'] = 'savgol'
+    settings.argflag['reduce']['overscan']['params'] = [2, 11]
+    np.random.seed(1234)
+    frame = np.random.normal(1000.0, 10.0, (200, 2112))
+    # Two amplifiers, with overscan regions on the right of the chip
+    oframe = arproc.trim(arproc.sub_overscan(frame.copy(), 1), 1)
+    assert oframe.shape == (200, 2048)
+    assert np.abs(np.median(oframe)) < 1.0
+    # The data sections are contiguous, so the trimmed frame is a view
+    assert np.may_share_memory(arproc.trim(frame, 1), frame)
+    # A cube of frames is processed at once
+    cube = np.stack([frame, 2*frame], axis=2)
+    ocube = arproc.trim(arproc.sub_overscan(cube, 1), 1)
+    assert np.allclose(ocube[:, :, 0], oframe)
+    assert np.allclose(ocube[:, :, 1], 2*oframe)
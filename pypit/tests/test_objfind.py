@@ -11,7 +11,6 @@ from pypit import pyputils
 msgs = pyputils.get_dummy_logger()
 from pypit import arutils
 from pypit import artrace
-from pypit import arcytrace
 
 
 def data_path(filename):
@@ -34,6 +33,7 @@ def test_very_close_obj():
 
 
 def test_objstd():
+    arcytrace = pytest.importorskip('pypit.arcytrace')
     # Read trace example
     tbl = Table.read(data_path('trc.fits'))
     trcprof = tbl['trc'].data.astype(np.float64)
@@ -72,4 +72,30 @@ def test_npeaks():
          2.13649812e+02,   2.62738738e+02]), rtol=1e-5)
 
 
-
+def test_trace_objects(monkeypatch):
+    """ Trace the objects of several slits
+    """
+    # trace_object needs the compiled modules
+    pytest.importorskip('pypit.arcytrace')
+    pytest.importorskip('pypit.arcyutils')
+    from pypit import arparse as settings
+    arutils.dummy_settings(spectrograph='shane_kast_blue', set_idx=True)
+    slf = arutils.dummy_self()
+    np.random.seed(1234)
+    nspec, nspat = 400, 200
+    slf._lordloc[0] = np.outer(np.ones(nspec), [5.2, 55.2, 105.2, 150.2])
+    slf._rordloc[0] = slf._lordloc[0] + 40.0
+    slf._pixwid[0] = np.full(4, 40)
+    # One object in each slit
+    objcen = [20.0, 70.0, 130.0, 165.0]
+    sciframe = np.random.normal(0.0, 1.0, (nspec, nspat))
+    for cen in objcen:
+        sciframe += 50.0*np.exp(-0.5*((np.arange(nspat)-cen)/2.0)**2)[np.newaxis, :]
+    varframe = np.ones_like(sciframe)
+    crmask = np.zeros_like(sciframe)
+    monkeypatch.setitem(settings.argflag['run'], 'ncpus', 1)
+    tracelist = artrace.trace_objects(slf, 1, sciframe, varframe, crmask, bgreg=20, doqa=False)
+    assert len(tracelist) == 4
+    for sl in range(4):
+        assert tracelist[sl]['nobj'] >= 1
+        assert np.min(np.abs(tracelist[sl]['traces'][nspec//2, :] - objcen[sl])) < 2.0